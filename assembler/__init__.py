@@ -0,0 +1,27 @@
+from .assembler import (
+    assemble,
+    parse,
+    emit,
+    line_table,
+    AssemblyError,
+    InstructionTable,
+    default_table,
+)
+from .images import (
+    read_image,
+    write_image,
+    read_raw,
+    write_raw,
+    ImageError,
+    FORMATS,
+)
+from .batch import assemble_tree, assemble_file
+from .objects import (
+    ObjectModule,
+    LinkError,
+    assemble_object,
+    cached_object,
+    link,
+)
+from .optimizer import optimize, Report
+from .debuginfo import DebugInfo, assemble_debug
@@ -0,0 +1,220 @@
+import re
+
+from isa import default_isa
+
+NUMBER = "{number}"
+LABEL = "{label}"
+
+# A number operand, either on its own or inside ram[...]
+NUMBER_RE = re.compile(r"(?<![\w.])(?:0x([0-9a-fA-F]+)|0b([01]+)|([0-9]+))(?!\w)")
+COMMENT_RE = re.compile(r"//.*")
+
+
+class AssemblyError(Exception):
+    def __init__(self, message, line=None, text=None):
+        self.message = message
+        self.line = line
+        self.text = text
+        if line is not None:
+            message = "Line %d %s" % (line, message)
+        super().__init__(message)
+
+
+def check_mov(args):
+    r = re.match(r"([abcd]) ([abcd])", args)
+    if r is not None:
+        return r.group(1) != r.group(2)
+
+
+def check_load(args):
+    r = re.match(r"ram\[[abcd]\] [abcd]", args)
+    if r is not None:
+        return True
+    r = re.match(r"ram\[[0-9]+\] [abcd]", args)
+    if r is not None:
+        return True
+    r = re.match(r"rom [abcd] [0-9]+", args)
+    return r is not None
+
+
+def check_save(args):
+    r = re.match(r"[abcd] ram", args)
+    if r is not None:
+        return True
+    r = re.match(r"[abcd] ram\[[abcd]\]", args)
+    if r is not None:
+        return True
+    r = re.match(r"[abcd] ram\[[0-9]+\]", args)
+    if r is not None:
+        return True
+    r = re.match(r"[abcd] mar", args)
+    return r is not None
+
+
+operations = {
+    "nop": lambda x: x == "",
+    "mov": check_mov,
+    "cmp": re.compile(r"([abcd]) ([abcd]|0|1|-1|255)").match,
+    "jmp": re.compile(r"(\.?(<=|<|=|>|>=) [abcd])|(.+)").match,
+    "jmpr": re.compile(r"(\.?(<=|<|=|>|>=) [abcd])|(.+)").match,
+    "opp": re.compile(r"").match,
+    "load": check_load,
+    "save": check_save,
+    "set": re.compile(r"[abcd] rampage$").match,
+    "in": re.compile(r"[abcd]").match,
+    "out": re.compile(r"[abcd]|[0-9]+|ram\[[0-9]+\]|ram\[[abcd]\]").match,
+    "halt": lambda x: x == "",
+}
+
+
+class InstructionTable:
+    """Opcodes for every assembler template, indexed by operand shape.
+
+    A line is looked up as is, then with its number operand replaced by
+    {number}, then with its last operand replaced by {label}, so matching a
+    line is a fixed number of dict lookups however many templates there are.
+    """
+
+    def __init__(self, templates):
+        self.templates = templates
+        self.exact = {}
+        self.numbers = {}
+        self.labels = {}
+
+        for opcode, template in enumerate(templates):
+            if not template:
+                continue
+            if LABEL in template:
+                table = self.labels
+            elif NUMBER in template:
+                table = self.numbers
+            else:
+                table = self.exact
+            table.setdefault(template, opcode)
+
+    def match(self, line):
+        """Returns (opcode, operand) where operand is None, a number or a label."""
+        opcode = self.exact.get(line)
+        if opcode is not None:
+            return opcode, None
+
+        numbers = []
+
+        def replace(match):
+            numbers.append(match)
+            return NUMBER
+
+        shape = NUMBER_RE.sub(replace, line)
+        opcode = self.numbers.get(shape)
+        if opcode is not None and len(numbers) == 1:
+            hex_value, bin_value, dec_value = numbers[0].groups()
+            if hex_value is not None:
+                return opcode, int(hex_value, 16)
+            if bin_value is not None:
+                return opcode, int(bin_value, 2)
+            return opcode, int(dec_value)
+
+        head, _, label = line.rpartition(" ")
+        opcode = self.labels.get(head + " " + LABEL)
+        if opcode is not None:
+            return opcode, label
+
+        return None, None
+
+
+_default_table = None
+
+
+def default_table():
+    global _default_table
+    if _default_table is None:
+        _default_table = InstructionTable(default_isa().templates)
+    return _default_table
+
+
+def parse(text, table=None):
+    """First pass, returns the instructions and the address of every label.
+
+    Each instruction is (line number, opcode, operand).
+    """
+    table = table or default_table()
+
+    instructions = []
+    labels = {}
+    offset = 0
+
+    for ln, line in enumerate(text.splitlines(), 1):
+        line = COMMENT_RE.sub("", line).strip()
+        if not line:
+            continue
+
+        variables = line.split()
+        opp = variables[0]
+        opp_args = " ".join(variables[1:])
+        line = " ".join(variables)
+
+        if opp.startswith(":") and len(opp) > 1:
+            if opp[1:] in labels:
+                raise AssemblyError("duplicate label detected", ln, line)
+            labels[opp[1:]] = offset
+            continue
+
+        if opp not in operations:
+            raise AssemblyError("couldn't find matching instruction", ln, line)
+        if not operations[opp](opp_args):
+            raise AssemblyError("is not valid", ln, line)
+
+        opcode, operand = table.match(line)
+        if opcode is None:
+            raise AssemblyError("couldn't find translation for instruction", ln, line)
+
+        if isinstance(operand, str):
+            # Instructions with labels are 3 bytes
+            offset += 3
+        elif operand is not None:
+            # Instructions with numbers are 2 bytes
+            if operand > 0xFF:
+                raise AssemblyError("number larger than can fit in register", ln, line)
+            offset += 2
+        else:
+            offset += 1
+
+        instructions.append((ln, opcode, operand))
+
+    return instructions, labels
+
+
+def emit(instructions, labels):
+    """Second pass, returns the bytes for the output of parse()."""
+    output = bytearray()
+    for ln, opcode, operand in instructions:
+        output.append(opcode)
+        if isinstance(operand, str):
+            if operand not in labels:
+                raise AssemblyError("label %s has not been defined" % operand, ln)
+            address = labels[operand]
+            output.append((address >> 8) & 0xFF)
+            output.append(address & 0xFF)
+        elif operand is not None:
+            output.append(operand)
+    return bytes(output)
+
+
+def line_table(instructions):
+    """The source line of the instruction starting at each address."""
+    lines = {}
+    address = 0
+    for ln, opcode, operand in instructions:
+        lines[address] = ln
+        if isinstance(operand, str):
+            address += 3
+        elif operand is not None:
+            address += 2
+        else:
+            address += 1
+    return lines
+
+
+def assemble(text, table=None):
+    """Assembles source text to the bytes of a ROM image."""
+    return emit(*parse(text, table))
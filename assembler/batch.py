@@ -0,0 +1,116 @@
+import os
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from isa import ARTIFACT, CU_FLAGS, ALU_FLAGS
+
+from .assembler import AssemblyError
+from .images import write_image
+from .debuginfo import assemble_debug, SUFFIX
+
+PROGRAMS = Path(__file__).resolve().parent.parent / "example_programs" / "assembly"
+
+
+class Result:
+    def __init__(self, source, output):
+        self.source = source
+        self.output = output
+        self.size = None
+        self.elapsed = 0
+        self.skipped = False
+        self.error = None
+
+
+def table_mtime():
+    # Every .o depends on the instruction table as well as its source
+    return max(x.stat().st_mtime for x in (ARTIFACT, CU_FLAGS, ALU_FLAGS) if x.exists())
+
+
+def up_to_date(source, output, dependency_mtime):
+    if not output.exists():
+        return False
+    mtime = output.stat().st_mtime
+    return mtime >= source.stat().st_mtime and mtime >= dependency_mtime
+
+
+def assemble_file(source, output, debug=False):
+    result = Result(source, output)
+    start = time.perf_counter()
+    try:
+        with open(source, "r") as f:
+            data, debug_info = assemble_debug(f.read(), Path(source).name)
+        write_image(output, data)
+        if debug:
+            debug_info.save(Path(output).with_suffix(SUFFIX))
+        result.size = len(data)
+    except AssemblyError as e:
+        result.error = str(e) if e.text is None else "%s: %s" % (e, e.text)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def assemble_tree(directory=PROGRAMS, jobs=None, force=False, debug=False):
+    """Assembles every .j under directory to a .o next to it, and a .jdbg
+    as well if debug is set.
+
+    Files whose outputs are newer than both the source and the instruction
+    table are skipped unless force is set. Returns a Result for every file.
+    """
+    sources = sorted(Path(directory).rglob("*.j"))
+    dependency_mtime = table_mtime()
+
+    results = []
+    pending = []
+    for source in sources:
+        output = source.with_suffix(".o")
+        current = up_to_date(source, output, dependency_mtime)
+        if debug:
+            current = current and up_to_date(
+                source, output.with_suffix(SUFFIX), dependency_mtime
+            )
+        if not force and current:
+            result = Result(source, output)
+            result.skipped = True
+            results.append(result)
+        else:
+            pending.append((source, output))
+
+    if len(pending) > 1 and (jobs is None or jobs > 1):
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results.extend(
+                pool.map(assemble_file, *zip(*pending), [debug] * len(pending))
+            )
+    else:
+        results.extend(assemble_file(*x, debug) for x in pending)
+
+    results.sort(key=lambda x: x.source)
+    return results
+
+
+def print_summary(results, directory):
+    for result in results:
+        name = os.path.relpath(result.source, directory)
+        if result.skipped:
+            print("%-40s %10s" % (name, "up to date"))
+        elif result.error is not None:
+            print("%-40s %10s  %s" % (name, "FAILED", result.error))
+        else:
+            print(
+                "%-40s %6d bytes %8.2f ms" % (name, result.size, result.elapsed * 1000)
+            )
+
+    built = [x for x in results if not x.skipped and x.error is None]
+    failed = [x for x in results if x.error is not None]
+    skipped = [x for x in results if x.skipped]
+    print(
+        "%d assembled (%d bytes, %.2f ms), %d up to date, %d failed"
+        % (
+            len(built),
+            sum(x.size for x in built),
+            sum(x.elapsed for x in built) * 1000,
+            len(skipped),
+            len(failed),
+        )
+    )
+    return failed
@@ -0,0 +1,184 @@
+import sys
+import pathlib
+import argparse
+
+from .assembler import parse, emit, AssemblyError
+from .images import write_image, format_for, FORMATS
+from .optimizer import optimize
+from .batch import assemble_tree, print_summary, PROGRAMS
+from .objects import cached_object, link, ObjectModule, LinkError
+from .debuginfo import DebugInfo, SUFFIX
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Assemble a program to machine level code"
+    )
+    parser.add_argument(
+        "input",
+        nargs="*",
+        help="The assembly file to compile to machine level code, given more "
+        "than one .j or .jo file they are linked together in order",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="The machine level filename to write",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        help="Image format to write: raw (Logisim v2.0 raw text, the default), "
+        "bin (raw bytes to flash) or hex (Intel HEX). Picked from the output "
+        "suffix when not given",
+    )
+    parser.add_argument(
+        "--all",
+        nargs="?",
+        const=PROGRAMS,
+        metavar="DIR",
+        help="Assemble every .j file under DIR (default example_programs/assembly)",
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        help="With --all, assemble files even if their .o is up to date",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="With --all, number of processes to assemble with",
+    )
+    parser.add_argument(
+        "--optimize",
+        "-O",
+        action="store_true",
+        help="Run the peephole optimizer and report what it saved",
+    )
+    parser.add_argument(
+        "--object",
+        "-c",
+        action="store_true",
+        help="Write a relocatable .jo object for each input instead of linking",
+    )
+    parser.add_argument(
+        "--debug",
+        "-g",
+        action="store_true",
+        help="Also write a %s file mapping addresses to source lines" % SUFFIX,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Where to cache assembled objects, by default .jcache next to each source",
+    )
+    args = parser.parse_args(argv)
+    if args.optimize and (args.object or len(args.input) > 1 or args.all is not None):
+        parser.error(
+            "--optimize only works on a single source, not with --all or linking"
+        )
+
+    if args.object or len(args.input) > 1:
+        return link_files(args)
+
+    if args.all is not None:
+        results = assemble_tree(args.all, args.jobs, args.force, args.debug)
+        failed = print_summary(results, args.all)
+        return 1 if failed else 0
+
+    input_file = args.input[0] if args.input else None
+    if input_file is None:
+        import tkinter as tk
+        from tkinter import filedialog
+
+        root = tk.Tk()
+        root.withdraw()
+
+        input_file = filedialog.askopenfilename()
+        if not input_file:
+            return 1
+
+    output_file, image_format = output_path(args, input_file)
+
+    with open(input_file, "r") as f:
+        text = f.read()
+
+    try:
+        instructions, labels = parse(text)
+        if args.optimize:
+            instructions, labels, report = optimize(instructions, labels)
+            print(report)
+        data = emit(instructions, labels)
+    except AssemblyError as e:
+        if e.text is not None:
+            print(e.text)
+        print(e)
+        return 1
+
+    write_image(output_file, data, image_format)
+    if args.debug:
+        debug_info = DebugInfo.from_instructions(
+            instructions, labels, text, pathlib.Path(input_file).name
+        )
+        debug_info.save(pathlib.Path(output_file).with_suffix(SUFFIX))
+
+    print("Successfully compiled")
+    print("File written to %s" % output_file)
+    return 0
+
+
+def output_path(args, input_file):
+    image_format = args.format
+    if args.output is not None:
+        return args.output, image_format or format_for(args.output)
+    image_format = image_format or "raw"
+    return pathlib.Path(input_file).stem + FORMATS[image_format], image_format
+
+
+def link_files(args):
+    modules = []
+    for path in args.input:
+        try:
+            if path.endswith(".jo"):
+                module = ObjectModule.load(path)
+            else:
+                module, cached = cached_object(path, args.cache_dir)
+                print("%s %s" % ("Cached" if cached else "Assembled", path))
+        except AssemblyError as e:
+            if e.text is not None:
+                print(e.text)
+            print("%s: %s" % (path, e))
+            return 1
+
+        if args.object:
+            output_file = pathlib.Path(path).stem + ".jo"
+            if args.output and len(args.input) == 1:
+                output_file = args.output
+            module.save(output_file)
+            print("Object written to %s" % output_file)
+        modules.append(module)
+
+    if args.object:
+        return 0
+
+    try:
+        data = link(modules)
+    except LinkError as e:
+        print(e)
+        return 1
+
+    output_file, image_format = output_path(args, args.input[0])
+    write_image(output_file, data, image_format)
+    if args.debug:
+        DebugInfo.from_modules(modules).save(
+            pathlib.Path(output_file).with_suffix(SUFFIX)
+        )
+
+    print("Successfully linked %d modules, %d bytes" % (len(modules), len(data)))
+    print("File written to %s" % output_file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import json
+from bisect import bisect_right
+from pathlib import Path
+
+from .assembler import parse, emit, line_table, COMMENT_RE, AssemblyError
+
+DEBUG_VERSION = 1
+SUFFIX = ".jdbg"
+
+
+def instruction_text(source, ln):
+    return " ".join(COMMENT_RE.sub("", source[ln - 1]).split())
+
+
+class DebugInfo:
+    """Where every instruction in a ROM image came from.
+
+    entries are (address, file, line, text) sorted by address, file indexes
+    files. Saved next to the image as a .jdbg, a small JSON file any tool
+    can read without the assembler.
+    """
+
+    def __init__(self, files=(), entries=(), labels=None):
+        self.files = list(files)
+        self.entries = sorted(entries)
+        self.labels = labels or {}
+
+        self._addresses = [x[0] for x in self.entries]
+        self._by_address = {x[0]: x for x in self.entries}
+        self._starts = sorted((address, name) for name, address in self.labels.items())
+        self._label_addresses = [x[0] for x in self._starts]
+
+    @classmethod
+    def from_instructions(cls, instructions, labels, source, name="", base=0):
+        source = source.splitlines()
+        lines = line_table(instructions)
+        entries = [
+            (base + address, 0, ln, instruction_text(source, ln))
+            for address, ln in lines.items()
+        ]
+        labels = {x: base + address for x, address in labels.items()}
+        return cls([name], entries, labels)
+
+    @classmethod
+    def from_modules(cls, modules, base=0):
+        """The debug info for link(modules, base)."""
+        files = []
+        entries = []
+        labels = {}
+        address = base
+        for i, module in enumerate(modules):
+            files.append(module.name)
+            entries.extend((address + x, i, ln, text) for x, ln, text in module.lines)
+            for name, offset in module.symbols.items():
+                # Local labels can repeat between modules
+                if name.startswith("."):
+                    name = "%s:%s" % (module.name, name)
+                labels[name] = address + offset
+            address += len(module.code)
+        return cls(files, entries, labels)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "version": DEBUG_VERSION,
+                "files": self.files,
+                "labels": self.labels,
+                "entries": self.entries,
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if data.get("version") != DEBUG_VERSION:
+            raise ValueError(
+                "Debug info is version %s, not %d"
+                % (data.get("version"), DEBUG_VERSION)
+            )
+        return cls(data["files"], [tuple(x) for x in data["entries"]], data["labels"])
+
+    def save(self, path):
+        Path(path).write_text(self.to_json())
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_json(Path(path).read_text())
+
+    @classmethod
+    def find(cls, image, data=None):
+        """The debug info for the image at path image.
+
+        Uses the .jdbg saved next to it, otherwise, given the image's bytes,
+        assembles the .j next to it if that still produces the same image.
+        Returns None when neither works.
+        """
+        image = Path(image)
+        path = image.with_suffix(SUFFIX)
+        if path.exists():
+            return cls.load(path)
+
+        source = image.with_suffix(".j")
+        if data is None or not source.exists():
+            return None
+        try:
+            assembled, debug_info = assemble_debug(source.read_text(), source.name)
+        except AssemblyError:
+            return None
+        return debug_info if assembled == bytes(data) else None
+
+    def entry(self, address):
+        """The instruction covering address, None if it isn't in one."""
+        i = bisect_right(self._addresses, address) - 1
+        # No instruction is longer than 3 bytes
+        if i < 0 or address - self.entries[i][0] >= 3:
+            return None
+        return self.entries[i]
+
+    def line(self, address):
+        entry = self._by_address.get(address)
+        return entry[2] if entry else None
+
+    def text(self, address):
+        entry = self._by_address.get(address)
+        return entry[3] if entry else ""
+
+    def file(self, address):
+        entry = self._by_address.get(address)
+        return self.files[entry[1]] if entry else None
+
+    def label(self, address):
+        # The closest label at or before the address
+        i = bisect_right(self._label_addresses, address) - 1
+        return self._starts[i][1] if i >= 0 else None
+
+    def symbolize(self, address):
+        """A description of address like "primes.j:11 jmp = nextprime (divide+2)"."""
+        entry = self.entry(address)
+        if entry is None:
+            return "%04x" % address
+        parts = ["%04x" % address]
+        where = "%s:%d" % (self.files[entry[1]] or "line", entry[2])
+        if entry[0] != address:
+            where += " (inside)"
+        parts.append(where)
+        parts.append(entry[3])
+        label = self.label(address)
+        if label is not None:
+            parts.append("(%s+%d)" % (label, address - self.labels[label]))
+        return " ".join(parts)
+
+
+def assemble_debug(text, name="", table=None):
+    """Like assemble(), but also returns the DebugInfo for the image."""
+    instructions, labels = parse(text, table)
+    return emit(instructions, labels), DebugInfo.from_instructions(
+        instructions, labels, text, name
+    )
@@ -0,0 +1,150 @@
+from pathlib import Path
+
+# Output formats for ROM images, by the suffix they are usually written with.
+# raw is the Logisim "v2.0 raw" text the programs have always been kept in,
+# bin can be flashed to the SPI ROM as is and hex is Intel HEX.
+FORMATS = {"raw": ".o", "bin": ".bin", "hex": ".hex"}
+
+RAW_HEADER = "v2.0 raw"
+HEX_RECORD = 16
+# Most the ROM can hold, with 24 bit addresses
+ROM_LIMIT = 1 << 24
+
+
+class ImageError(Exception):
+    pass
+
+
+def format_for(path):
+    suffix = Path(path).suffix.lower()
+    if suffix == ".bin":
+        return "bin"
+    if suffix in (".hex", ".ihex"):
+        return "hex"
+    return "raw"
+
+
+def write_raw(path, data):
+    # Logisim "v2.0 raw" image
+    with open(path, "w") as f:
+        f.write(RAW_HEADER + "\n")
+        f.write(" ".join("%02x" % x for x in data))
+        f.write("\n")
+
+
+def write_bin(path, data):
+    Path(path).write_bytes(bytes(data))
+
+
+def _record(address, kind, payload):
+    body = bytes([len(payload), (address >> 8) & 0xFF, address & 0xFF, kind])
+    body += bytes(payload)
+    checksum = -sum(body) & 0xFF
+    return ":%s%02X\n" % (body.hex().upper(), checksum)
+
+
+def write_hex(path, data):
+    data = bytes(data)
+    lines = []
+    upper = 0
+    for address in range(0, len(data), HEX_RECORD):
+        if address >> 16 != upper:
+            # Extended linear address for images past 64K
+            upper = address >> 16
+            lines.append(_record(0, 4, bytes([upper >> 8, upper & 0xFF])))
+        lines.append(_record(address & 0xFFFF, 0, data[address : address + HEX_RECORD]))
+    lines.append(_record(0, 1, b""))
+    Path(path).write_text("".join(lines))
+
+
+WRITERS = {"raw": write_raw, "bin": write_bin, "hex": write_hex}
+
+
+def write_image(path, data, format=None):
+    """Writes data in format, picked from the suffix of path when not given."""
+    WRITERS[format or format_for(path)](path, data)
+
+
+def parse_raw(text):
+    # "v2.0 raw" images may use `count*value` run lengths
+    data = []
+    for line in text.splitlines()[1:]:
+        for g in line.split():
+            if "*" in g:
+                count, value = g.split("*")
+                data.extend([int(value, 16)] * int(count))
+            else:
+                data.append(int(g, 16))
+    return data
+
+
+def parse_hex(text, limit=ROM_LIMIT):
+    memory = {}
+    upper = 0
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError:
+            record = None
+        if not line.startswith(":") or not record or len(record) != record[0] + 5:
+            raise ImageError("Intel HEX line %d is malformed" % n)
+        if sum(record) & 0xFF:
+            raise ImageError("Intel HEX line %d has a bad checksum" % n)
+
+        address = record[1] << 8 | record[2]
+        kind = record[3]
+        payload = record[4:-1]
+        if kind == 0:
+            if upper + address + len(payload) > limit:
+                raise ImageError(
+                    "Intel HEX line %d is past the end of the ROM at %06x" % (n, limit)
+                )
+            for i, x in enumerate(payload):
+                memory[upper + address + i] = x
+        elif kind == 1:
+            break
+        elif kind == 2:
+            upper = (payload[0] << 8 | payload[1]) << 4
+        elif kind == 4:
+            upper = (payload[0] << 8 | payload[1]) << 16
+        elif kind in (3, 5):
+            # Start addresses are ignored, the computer always starts at 0
+            continue
+        else:
+            raise ImageError("Intel HEX line %d has unknown record type %d" % (n, kind))
+
+    if not memory:
+        return []
+    # Gaps read back as erased flash
+    data = bytearray(b"\xff" * (max(memory) + 1))
+    for address, x in memory.items():
+        data[address] = x
+    return data
+
+
+def read_image(path):
+    """Loads a ROM image in any of the FORMATS. Text images are told apart by
+    their content, only a .bin is taken as raw bytes.
+
+    Returns the bytes of the image, raises ImageError if it isn't one.
+    """
+    path = Path(path)
+    content = path.read_bytes()
+    if format_for(path) == "bin":
+        return content
+    try:
+        if content.startswith(RAW_HEADER.encode()):
+            return bytes(parse_raw(content.decode()))
+        if content.startswith(b":"):
+            return bytes(parse_hex(content.decode()))
+    except ValueError as e:
+        raise ImageError("%s is malformed: %s" % (path, e))
+    raise ImageError("%s is neither a %s image nor Intel HEX" % (path, RAW_HEADER))
+
+
+def read_raw(path):
+    with open(path, "r") as f:
+        return parse_raw(f.read())
@@ -0,0 +1,190 @@
+import re
+import json
+import hashlib
+from pathlib import Path
+
+from isa import default_isa
+
+from .assembler import parse, line_table, AssemblyError
+from .debuginfo import instruction_text
+
+OBJECT_VERSION = 2
+CACHE_DIR = ".jcache"
+
+
+class LinkError(Exception):
+    pass
+
+
+class ObjectModule:
+    """A relocatable module, code assembled as if it were loaded at 0.
+
+    Every label operand is left as 00 00 with a relocation (offset, symbol,
+    line) pointing at it. symbols holds the offset of every label the module
+    defines. Labels starting with "." are local to the module, the rest are
+    visible to the other modules being linked. lines has the (offset, line,
+    text) of every instruction for the debug info.
+    """
+
+    def __init__(self, name, code, symbols, relocations, hash=None, lines=()):
+        self.name = name
+        self.code = bytes(code)
+        self.symbols = symbols
+        self.relocations = relocations
+        self.hash = hash
+        self.lines = list(lines)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "version": OBJECT_VERSION,
+                "name": self.name,
+                "hash": self.hash,
+                "code": self.code.hex(),
+                "symbols": self.symbols,
+                "relocations": self.relocations,
+                "lines": self.lines,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if data.get("version") != OBJECT_VERSION:
+            raise LinkError(
+                "Object is version %s, not %d" % (data.get("version"), OBJECT_VERSION)
+            )
+        return cls(
+            data["name"],
+            bytes.fromhex(data["code"]),
+            data["symbols"],
+            [tuple(x) for x in data["relocations"]],
+            data["hash"],
+            [tuple(x) for x in data["lines"]],
+        )
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.to_json())
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_json(Path(path).read_text())
+
+
+def source_hash(text):
+    # Objects depend on the instruction table as well as the source
+    h = hashlib.sha256()
+    h.update(b"%d\0" % OBJECT_VERSION)
+    h.update(default_isa().hash.encode() + b"\0")
+    h.update(text.encode())
+    return h.hexdigest()[:16]
+
+
+def assemble_object(text, name="", table=None):
+    instructions, labels = parse(text, table)
+
+    code = bytearray()
+    relocations = []
+    for ln, opcode, operand in instructions:
+        code.append(opcode)
+        if isinstance(operand, str):
+            if operand.startswith(".") and operand not in labels:
+                raise AssemblyError("local label %s has not been defined" % operand, ln)
+            relocations.append((len(code), operand, ln))
+            code.extend(b"\0\0")
+        elif operand is not None:
+            code.append(operand)
+
+    source = text.splitlines()
+    lines = [
+        (offset, ln, instruction_text(source, ln))
+        for offset, ln in line_table(instructions).items()
+    ]
+    return ObjectModule(name, code, labels, relocations, source_hash(text), lines)
+
+
+def cached_object(path, cache_dir=None):
+    """Assembles path to an ObjectModule, reusing the cached object when the
+    source and instruction table are unchanged.
+
+    Objects are cached in a .jcache directory next to the source by default.
+    """
+    path = Path(path)
+    text = path.read_text()
+    key = source_hash(text)
+
+    cache_dir = Path(cache_dir) if cache_dir is not None else path.parent / CACHE_DIR
+    cached = _cache_path(path, cache_dir, key)
+    if cached.exists():
+        try:
+            return ObjectModule.load(cached), True
+        except (ValueError, KeyError, LinkError):
+            pass
+
+    module = assemble_object(text, path.name)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    # Older objects of this source, not of sources whose names start the same
+    stale = re.compile(re.escape(path.stem) + r"\.[0-9a-f]{16}\.jo")
+    for old in cached.parent.glob(f"{path.stem}.*.jo"):
+        if stale.fullmatch(old.name):
+            old.unlink()
+    module.save(cached)
+    return module, False
+
+
+def _cache_path(path, cache_dir, key):
+    # Objects are kept under the source's path from the directory holding the
+    # cache, so same-named sources sharing a --cache-dir don't evict each other
+    path = path.resolve()
+    try:
+        relative = path.relative_to(cache_dir.resolve().parent)
+    except ValueError:
+        relative = path.relative_to(path.anchor)
+    return cache_dir / relative.parent / f"{path.stem}.{key}.jo"
+
+
+def link(modules, base=0):
+    """Places modules one after another from base and resolves their labels.
+
+    The first module is where execution starts. Returns the ROM image bytes.
+    """
+    bases = []
+    symbols = {}
+    address = base
+    for module in modules:
+        bases.append(address)
+        for name, offset in module.symbols.items():
+            if name.startswith("."):
+                continue
+            if name in symbols:
+                raise LinkError(
+                    "Symbol %s is defined in both %s and %s"
+                    % (name, symbols[name][0].name, module.name)
+                )
+            symbols[name] = (module, address + offset)
+        address += len(module.code)
+
+    if address > 0x10000:
+        raise LinkError(
+            "Linked program is %d bytes, larger than the ROM" % (address - base)
+        )
+
+    image = bytearray()
+    for module, module_base in zip(modules, bases):
+        code = bytearray(module.code)
+        for offset, name, ln in module.relocations:
+            if name in module.symbols:
+                target = module_base + module.symbols[name]
+            elif name in symbols:
+                target = symbols[name][1]
+            else:
+                raise LinkError(
+                    "%s line %d label %s has not been defined" % (module.name, ln, name)
+                )
+            code[offset] = (target >> 8) & 0xFF
+            code[offset + 1] = target & 0xFF
+        image.extend(code)
+    return bytes(image)
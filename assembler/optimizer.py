@@ -0,0 +1,291 @@
+from collections import Counter
+
+from isa import default_isa, FLAG_NAMES, ALU_BITS
+
+# Flag word bits, in the same order as the ROM tables
+FLAGS = {name: 1 << i for i, name in enumerate(FLAG_NAMES)}
+READS = {r: FLAGS[r.upper() + "O"] | FLAGS[r.upper() + "O2"] for r in "abcd"}
+ALUO = FLAGS["AO"] | FLAGS["BO"] | FLAGS["CO"] | FLAGS["DO"]
+JMPO = FLAGS["JMPO"]
+WRITES = {r: FLAGS[r.upper() + "I"] for r in "abcd"}
+HALT = FLAGS["HALT"]
+
+# ALU control word bit that lets an operation write the flags
+CMP = 1 << ALU_BITS.index("CMP")
+
+JMP = 0x30
+CLR_CMP = 0x50
+CARRY_ON = 0x52
+
+
+class Report:
+    def __init__(self, size):
+        self.size_before = size
+        self.size_after = size
+        self.removed = Counter()
+        self.retargeted = 0
+        self.skipped = None
+
+    @property
+    def bytes_saved(self):
+        return self.size_before - self.size_after
+
+    @property
+    def spi_fetches_saved(self):
+        # Each byte removed is one less ROM read every time that code runs
+        return self.bytes_saved
+
+    def __str__(self):
+        # The emulator imports the assembler, so only once both are loaded
+        from emulator import spi_cycles
+
+        if self.skipped:
+            return "Not optimized, %s" % self.skipped
+        lines = [
+            "%d -> %d bytes, %d bytes saved"
+            % (self.size_before, self.size_after, self.bytes_saved),
+            "%d fewer SPI fetches (~%d cycles) per pass over the removed code"
+            % (self.spi_fetches_saved, self.spi_fetches_saved * spi_cycles()),
+        ]
+        for reason, count in sorted(self.removed.items()):
+            lines.append("  removed %d %s" % (count, reason))
+        if self.retargeted:
+            lines.append("  retargeted %d jumps" % self.retargeted)
+        return "\n".join(lines)
+
+
+class Effects:
+    """What an opcode reads and writes, worked out from the CU and ALU words."""
+
+    def __init__(self, isa, opcode, carry_mode):
+        flags = isa.flags_1[opcode] | isa.flags_2[opcode]
+        self.flags = flags
+        self.reads = {r for r, bits in READS.items() if flags & bits}
+        self.writes = {r for r, bits in WRITES.items() if flags & bits}
+
+        uses_alu = flags & ALUO
+        self.writes_flags = bool(
+            uses_alu and isa.alu_rom[opcode] & CMP or opcode == CLR_CMP
+        )
+        # With carry mode on a flag writing ALU op adds the carry flag in
+        self.reads_flags = bool(flags & JMPO) or (self.writes_flags and carry_mode)
+
+        self.ends_block = opcode == JMP or bool(flags & HALT)
+        self.is_mov = isa.templates[opcode].startswith("mov ")
+        self.is_cmp = isa.templates[opcode].startswith("cmp ")
+
+
+def _size(operand):
+    if operand is None:
+        return 1
+    return 3 if isinstance(operand, str) else 2
+
+
+class Optimizer:
+    def __init__(self, instructions, labels, isa=None):
+        self.isa = isa or default_isa()
+
+        # The program as a list of ("label", name) and
+        # ("ins", line, opcode, operand) entries
+        by_offset = {}
+        for name, offset in labels.items():
+            by_offset.setdefault(offset, []).append(name)
+
+        self.code = []
+        offset = 0
+        for ln, opcode, operand in instructions:
+            for name in by_offset.pop(offset, []):
+                self.code.append(("label", name))
+            self.code.append(("ins", ln, opcode, operand))
+            offset += _size(operand)
+        for offset in sorted(by_offset):
+            for name in by_offset[offset]:
+                self.code.append(("label", name))
+
+        opcodes = {x[2] for x in self.code if x[0] == "ins"}
+        carry_mode = CARRY_ON in opcodes
+        self.effects = {x: Effects(self.isa, x, carry_mode) for x in opcodes}
+
+        self.report = Report(sum(_size(x[3]) for x in self.code if x[0] == "ins"))
+
+    def _remove(self, index, reason):
+        del self.code[index]
+        self.report.removed[reason] += 1
+
+    def _unreachable(self):
+        changed = False
+        i = 0
+        while i < len(self.code):
+            entry = self.code[i]
+            i += 1
+            if entry[0] != "ins" or not self.effects[entry[2]].ends_block:
+                continue
+            while i < len(self.code) and self.code[i][0] == "ins":
+                self._remove(i, "unreachable instructions")
+                changed = True
+        return changed
+
+    def _first_instruction(self, index):
+        while index < len(self.code) and self.code[index][0] == "label":
+            index += 1
+        return index
+
+    def _thread_jumps(self):
+        changed = False
+        positions = {x[1]: i for i, x in enumerate(self.code) if x[0] == "label"}
+        for i, entry in enumerate(self.code):
+            if entry[0] != "ins" or not isinstance(entry[3], str):
+                continue
+
+            target = entry[3]
+            seen = {target}
+            while True:
+                index = positions.get(target)
+                if index is None:
+                    break
+                index = self._first_instruction(index)
+                if index >= len(self.code):
+                    break
+                next_entry = self.code[index]
+                if next_entry[2] != JMP or next_entry[3] in seen:
+                    break
+                target = next_entry[3]
+                seen.add(target)
+
+            if target != entry[3]:
+                self.code[i] = (entry[0], entry[1], entry[2], target)
+                self.report.retargeted += 1
+                changed = True
+        return changed
+
+    def _jumps_to_next(self):
+        changed = False
+        i = 0
+        while i < len(self.code):
+            entry = self.code[i]
+            if entry[0] == "ins" and isinstance(entry[3], str):
+                j = i + 1
+                names = set()
+                while j < len(self.code) and self.code[j][0] == "label":
+                    names.add(self.code[j][1])
+                    j += 1
+                if entry[3] in names:
+                    # Jumps don't touch the flags, so even conditional ones
+                    # to the next instruction do nothing
+                    self._remove(i, "jumps to the next instruction")
+                    changed = True
+                    continue
+            i += 1
+        return changed
+
+    def _dead_flags(self, i):
+        # The flags written at i are overwritten before anything reads them
+        for j in range(i + 1, len(self.code)):
+            entry = self.code[j]
+            if entry[0] == "label":
+                return False
+            effects = self.effects[entry[2]]
+            if effects.reads_flags:
+                return False
+            if effects.flags & HALT:
+                return True
+            if effects.writes_flags:
+                return True
+            if effects.ends_block:
+                return False
+        return False
+
+    def _blocks(self):
+        changed = False
+        # Registers known to hold the same value, and the last compare
+        equal = set()
+        last_cmp = None
+
+        i = 0
+        while i < len(self.code):
+            entry = self.code[i]
+            if entry[0] == "label":
+                equal = set()
+                last_cmp = None
+                i += 1
+                continue
+
+            opcode = entry[2]
+            effects = self.effects[opcode]
+
+            if effects.is_mov:
+                src, dst = self.isa.templates[opcode].split()[1:]
+                if frozenset((src, dst)) in equal:
+                    self._remove(i, "redundant moves")
+                    changed = True
+                    continue
+
+            if effects.is_cmp and not effects.reads_flags:
+                if not effects.writes_flags:
+                    self._remove(i, "compares that don't set the flags")
+                    changed = True
+                    continue
+                if opcode == last_cmp:
+                    self._remove(i, "repeated compares")
+                    changed = True
+                    continue
+                if self._dead_flags(i):
+                    self._remove(i, "compares whose flags are never read")
+                    changed = True
+                    continue
+
+            for reg in effects.writes:
+                equal = {x for x in equal if reg not in x}
+            if effects.is_mov:
+                equal.add(frozenset((src, dst)))
+
+            if effects.writes_flags:
+                last_cmp = opcode if effects.is_cmp else None
+            if last_cmp is not None and effects.writes & self.effects[last_cmp].reads:
+                last_cmp = None
+            if effects.ends_block:
+                equal = set()
+                last_cmp = None
+            i += 1
+        return changed
+
+    def optimize(self):
+        for entry in self.code:
+            if entry[0] == "ins" and entry[3] is not None:
+                if self.effects[entry[2]].flags & JMPO and not isinstance(
+                    entry[3], str
+                ):
+                    # Moving code would break jumps to fixed addresses
+                    self.report.skipped = "line %d jumps to a number" % entry[1]
+                    return self.result()
+
+        changed = True
+        while changed:
+            changed = self._unreachable()
+            changed |= self._thread_jumps()
+            changed |= self._jumps_to_next()
+            changed |= self._blocks()
+        return self.result()
+
+    def result(self):
+        instructions = []
+        labels = {}
+        offset = 0
+        for entry in self.code:
+            if entry[0] == "label":
+                labels.setdefault(entry[1], offset)
+            else:
+                instructions.append(entry[1:])
+                offset += _size(entry[3])
+        self.report.size_after = offset
+        return instructions, labels, self.report
+
+
+def optimize(instructions, labels, isa=None):
+    """Peephole optimizes the output of parse().
+
+    Returns (instructions, labels, report) with the same meaning on the
+    hardware, everything it knows about each opcode comes from the CU and
+    ALU tables. Programs that jump to numeric addresses are left alone.
+    """
+    return Optimizer(instructions, labels, isa).optimize()
@@ -0,0 +1,5 @@
+from .computer import Computer, ALU_CYCLES, spi_cycles, jump_taken
+from .fast import FastComputer
+from .roms import Roms, default_roms, read_mem, read_raw, read_image, ROM_DIR
+from .memory import PagedMemory, Snapshot, PAGE_SIZE, FULL_SIZE
+from .profile import Profile, CU_STATES, profile_run
@@ -0,0 +1,113 @@
+import time
+import argparse
+from pathlib import Path
+from functools import partial
+
+from assembler import DebugInfo, assemble_debug
+
+from . import Computer, FastComputer, Profile, read_image, profile_run
+from .profile import step as profile_step
+from .trace import TraceWriter, step as trace_step
+
+parser = argparse.ArgumentParser(
+    description="Run an assembled program on the reference emulator"
+)
+parser.add_argument(
+    "program",
+    type=Path,
+    help="The assembled image to run (.o, .bin or .hex), or a .j source",
+)
+parser.add_argument(
+    "--cycles", "-c", type=int, default=1000000, help="Clock cycle budget"
+)
+parser.add_argument("--instructions", "-n", type=int, help="Instruction budget")
+parser.add_argument(
+    "--address-24bit", action="store_true", help="Use 24 bit SPI addressing"
+)
+parser.add_argument(
+    "--inputs",
+    "-i",
+    default="",
+    help="Comma separated values driven on ui_in, advanced on each new output",
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="Show where the cycles went, per instruction and CU state",
+)
+parser.add_argument(
+    "--top", type=int, default=20, help="Instructions to list with --profile"
+)
+parser.add_argument(
+    "--folded",
+    type=Path,
+    help="Write the profile as folded stacks for a flamegraph to this file",
+)
+parser.add_argument(
+    "--trace",
+    type=Path,
+    help="Record every instruction to this trace file, see python -m emulator.trace",
+)
+parser.add_argument(
+    "--fast",
+    action="store_true",
+    help="Run translated blocks of instructions, ignored with --profile or --trace",
+)
+args = parser.parse_args()
+
+# Profiles name addresses by source line from the image's .jdbg, or the .j
+# next to it when that still assembles to the same image
+profiling = args.profile or args.folded is not None
+debug_info = None
+if args.program.suffix == ".j":
+    program, debug_info = assemble_debug(args.program.read_text(), args.program.name)
+else:
+    program = list(read_image(args.program))
+    if profiling:
+        debug_info = DebugInfo.find(args.program, program)
+
+inputs = [int(x, 0) & 0xFF for x in args.inputs.split(",") if x.strip()]
+engine = FastComputer if args.fast else Computer
+computer = engine(program, args.address_24bit, inputs)
+
+profile = None
+start = time.perf_counter()
+if args.trace is None:
+    if profiling:
+        profile = profile_run(computer, None, args.cycles, args.instructions)
+    else:
+        computer.run(args.cycles, args.instructions)
+else:
+    step = computer.step
+    if profiling:
+        profile = Profile(args.address_24bit)
+        step = partial(profile_step, computer, profile, {})
+    with TraceWriter(args.trace, args.address_24bit) as writer:
+        while not computer.halted and computer.cycles < args.cycles:
+            if args.instructions is not None:
+                if computer.instructions >= args.instructions:
+                    break
+            trace_step(computer, writer, step)
+elapsed = time.perf_counter() - start
+
+print("Outputs:", " ".join(str(x) for x in computer.outputs))
+print("Halted:", computer.halted)
+print("PC: %04x" % computer.pc)
+print(
+    "A: %02x B: %02x C: %02x D: %02x"
+    % (computer.areg, computer.breg, computer.creg, computer.dreg)
+)
+print(
+    "Z: %d O: %d C: %d S: %d"
+    % (computer.zflag, computer.oflag, computer.cflag, computer.sflag)
+)
+print(
+    "%d instructions, %d cycles in %.2f ms"
+    % (computer.instructions, computer.cycles, elapsed * 1000)
+)
+
+if args.profile:
+    print()
+    print(profile.report(debug_info, args.top))
+if args.folded:
+    args.folded.write_text(profile.folded(debug_info, args.program.stem))
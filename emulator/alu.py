@@ -0,0 +1,80 @@
+# alu_rom.mem control word, see alu.sv
+ZA = 1 << 0
+IA = 1 << 1
+ZB = 1 << 2
+IB = 1 << 3
+IO = 1 << 4
+PO = 1 << 5
+HIGH = 1 << 6
+CMP = 1 << 7
+
+SUM = 0
+AND = 1
+MULT = 2
+DIV = 3
+
+CLR_CMP_INS = 0x50
+CARRY_OFF_INS = 0x51
+CARRY_ON_INS = 0x52
+SIGN_OFF_INS = 0x53
+SIGN_ON_INS = 0x54
+
+
+def _signed(v):
+    return v - 0x100 if v & 0x80 else v
+
+
+def _signed_div(a, b):
+    # Verilog signed division truncates towards zero
+    a = _signed(a)
+    b = _signed(b)
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        q = -q
+    return q & 0xFF
+
+
+def evaluate(val, a, b, carryin=0, carry_mode=False, signed_mode=False):
+    """Returns (aluout, zflag, oflag, cflag, sflag) for one pass through alu.sv.
+
+    The flags are the values the cmp module latches during the INVERT state,
+    so they are taken from the result before the final inversion.
+    """
+    xora = (0 if val & ZA else a) ^ (0xFF if val & IA else 0)
+    xorb = (0 if val & ZB else b) ^ (0xFF if val & IB else 0)
+    cselect = val >> 8
+
+    full_sum = xora + xorb + (1 if val & PO else 0)
+    if carry_mode and val & CMP and carryin:
+        full_sum += 1
+
+    if cselect == SUM:
+        muxoutput = full_sum & 0xFF
+    elif cselect == AND:
+        muxoutput = xora & xorb
+    elif cselect == MULT:
+        # The ternary in alu.sv mixes signed and unsigned operands, so Verilog
+        # evaluates the multiply as unsigned even in signed mode.
+        mult = xora * xorb
+        muxoutput = (mult >> 8) & 0xFF if val & HIGH else mult & 0xFF
+    else:
+        divisor = xorb or 1
+        if signed_mode:
+            muxoutput = _signed_div(xora, divisor)
+        else:
+            muxoutput = xora // divisor
+
+    if cselect == SUM:
+        carry = full_sum >> 8 & 1
+        if val & (IA | IB) and val & PO:
+            carry ^= 1
+    else:
+        carry = 0
+
+    sign = muxoutput >> 7
+    sa = xora >> 7
+    sb = xorb >> 7
+    overflow = ((sign ^ 1) & sa & sb) | (sign & (sa ^ 1) & (sb ^ 1))
+
+    aluout = muxoutput ^ 0xFF if val & IO else muxoutput
+    return aluout, int(muxoutput == 0), overflow, carry, sign
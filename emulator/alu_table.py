@@ -0,0 +1,191 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from . import alu
+from .roms import default_roms
+
+# Every opcode that runs an ALU operation, below are the mode instructions
+OPCODES = range(0x55, 0xBC)
+
+# Fields of evaluate(), in order
+FIELDS = ["aluout", "zflag", "oflag", "cflag", "sflag"]
+
+
+def operands():
+    """a and b for all 65536 pairs, the pair for index i is (i >> 8, i & 0xFF)."""
+    index = np.arange(0x10000, dtype=np.int32)
+    return index >> 8, index & 0xFF
+
+
+def _signed(v):
+    return np.where(v & 0x80, v - 0x100, v)
+
+
+def evaluate(val, a, b, carryin=0, carry_mode=False, signed_mode=False):
+    """alu.evaluate() over arrays of a and b, returns an array per field."""
+    xora = (np.zeros_like(a) if val & alu.ZA else a) ^ (0xFF if val & alu.IA else 0)
+    xorb = (np.zeros_like(b) if val & alu.ZB else b) ^ (0xFF if val & alu.IB else 0)
+    cselect = val >> 8
+
+    full_sum = xora + xorb + (1 if val & alu.PO else 0)
+    if carry_mode and val & alu.CMP and carryin:
+        full_sum = full_sum + 1
+
+    if cselect == alu.SUM:
+        muxoutput = full_sum & 0xFF
+    elif cselect == alu.AND:
+        muxoutput = xora & xorb
+    elif cselect == alu.MULT:
+        mult = xora * xorb
+        muxoutput = (mult >> 8) & 0xFF if val & alu.HIGH else mult & 0xFF
+    else:
+        divisor = np.where(xorb == 0, 1, xorb)
+        if signed_mode:
+            sa = _signed(xora)
+            sb = _signed(divisor)
+            # Truncates towards zero like Verilog
+            q = np.abs(sa) // np.abs(sb)
+            muxoutput = np.where((sa < 0) != (sb < 0), -q, q) & 0xFF
+        else:
+            muxoutput = xora // divisor
+
+    if cselect == alu.SUM:
+        carry = full_sum >> 8 & 1
+        if val & (alu.IA | alu.IB) and val & alu.PO:
+            carry = carry ^ 1
+    else:
+        carry = np.zeros_like(muxoutput)
+
+    sign = muxoutput >> 7
+    sa = xora >> 7
+    sb = xorb >> 7
+    overflow = ((sign ^ 1) & sa & sb) | (sign & (sa ^ 1) & (sb ^ 1))
+
+    aluout = muxoutput ^ 0xFF if val & alu.IO else muxoutput
+    return [
+        np.asarray(x, dtype=np.uint8)
+        for x in (aluout, muxoutput == 0, overflow, carry, sign)
+    ]
+
+
+def table(
+    alu_rom=None, opcodes=OPCODES, carryin=0, carry_mode=False, signed_mode=False
+):
+    """Expected results of every opcode for every a, b pair.
+
+    Returns an array of shape (len(opcodes), len(FIELDS), 65536).
+    """
+    if alu_rom is None:
+        alu_rom = default_roms().alu_rom
+    a, b = operands()
+    return np.stack(
+        [
+            np.stack(evaluate(alu_rom[x], a, b, carryin, carry_mode, signed_mode))
+            for x in opcodes
+        ]
+    )
+
+
+def cross_check(
+    expected,
+    alu_rom=None,
+    opcodes=OPCODES,
+    pairs=None,
+    carryin=0,
+    carry_mode=False,
+    signed_mode=False,
+):
+    """Compares a table() against the scalar alu.evaluate().
+
+    pairs limits the check to those pair indexes, all 65536 by default.
+    Returns (opcode, a, b, field, expected, got) for every difference.
+    """
+    if alu_rom is None:
+        alu_rom = default_roms().alu_rom
+    if pairs is None:
+        pairs = range(0x10000)
+
+    mismatches = []
+    for i, opcode in enumerate(opcodes):
+        val = alu_rom[opcode]
+        rows = expected[i]
+        for pair in pairs:
+            a, b = pair >> 8, pair & 0xFF
+            got = alu.evaluate(val, a, b, carryin, carry_mode, signed_mode)
+            for field, value in enumerate(got):
+                if rows[field, pair] != value:
+                    mismatches.append(
+                        (opcode, a, b, FIELDS[field], int(rows[field, pair]), value)
+                    )
+    return mismatches
+
+
+def format_mismatches(mismatches, templates=None, limit=3):
+    """One line per opcode and field with the count and the first few pairs."""
+    groups = {}
+    for opcode, a, b, field, expected, got in mismatches:
+        groups.setdefault((opcode, field), []).append((a, b, expected, got))
+
+    lines = ["  op  %-12s %-7s %7s  examples (a, b: expected/got)" % ("", "", "count")]
+    for (opcode, field), found in sorted(groups.items()):
+        template = templates[opcode] if templates else ""
+        examples = ", ".join("%02x %02x: %02x/%02x" % x for x in found[:limit])
+        lines.append(
+            "  %02x  %-12s %-7s %7d  %s"
+            % (opcode, template, field, len(found), examples)
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the expected results of every ALU opcode for every "
+        "operand pair and check them against the scalar model"
+    )
+    parser.add_argument(
+        "--signed", action="store_true", help="With the ALU in signed mode"
+    )
+    parser.add_argument(
+        "--carry",
+        action="store_true",
+        help="With carry mode on and the carry flag set",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="Only cross check this many random pairs per opcode",
+    )
+    args = parser.parse_args(argv)
+
+    roms = default_roms()
+    modes = {"signed_mode": args.signed}
+    if args.carry:
+        modes.update(carry_mode=True, carryin=1)
+
+    start = time.perf_counter()
+    expected = table(roms.alu_rom, **modes)
+    built = time.perf_counter() - start
+    print("%d opcodes x 65536 pairs in %.2f ms" % (len(OPCODES), built * 1000))
+
+    pairs = None
+    if args.sample is not None:
+        pairs = np.random.default_rng(0).choice(0x10000, args.sample, replace=False)
+        pairs = [int(x) for x in pairs]
+    start = time.perf_counter()
+    mismatches = cross_check(expected, roms.alu_rom, pairs=pairs, **modes)
+    print("Cross checked in %.2fs" % (time.perf_counter() - start))
+
+    if mismatches:
+        from isa import default_isa
+
+        print(format_mismatches(mismatches, default_isa().templates))
+        return 1
+    print("No mismatches")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
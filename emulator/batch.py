@@ -0,0 +1,454 @@
+import sys
+import time
+import argparse
+import itertools
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from . import alu
+from .computer import ALU_CYCLES, spi_cycles
+from .roms import (
+    default_roms,
+    read_image,
+    IO,
+    AO,
+    BO,
+    CO,
+    DO,
+    AO2,
+    BO2,
+    CO2,
+    DO2,
+    ROMO,
+    RAMO,
+    JMPO,
+    OI,
+    RAMI,
+    MARI,
+    MPAGEI,
+    AI,
+    BI,
+    CI,
+    DI,
+    PCC,
+    HALT,
+    ALUO,
+    SPI_FLAGS,
+)
+
+# Registers a flag bit puts on each side of the ALU
+A_SIDE = [(AO, "areg"), (BO, "breg"), (CO, "creg"), (DO, "dreg")]
+B_SIDE = [(AO2, "areg"), (BO2, "breg"), (CO2, "creg"), (DO2, "dreg")]
+
+# Registers written from the databus, the first bit set wins
+WRITES = [
+    (MARI, "mar"),
+    (MPAGEI, "mpage"),
+    (AI, "areg"),
+    (BI, "breg"),
+    (CI, "creg"),
+    (DI, "dreg"),
+]
+
+
+def _signed(v):
+    return np.where(v & 0x80, v - 0x100, v)
+
+
+def evaluate(val, a, b, carryin, carry_mode, signed_mode):
+    """alu.evaluate() with every argument an array, one element per machine."""
+    xora = np.where(val & alu.ZA, 0, a) ^ np.where(val & alu.IA, 0xFF, 0)
+    xorb = np.where(val & alu.ZB, 0, b) ^ np.where(val & alu.IB, 0xFF, 0)
+    cselect = val >> 8
+
+    full_sum = xora + xorb + (val & alu.PO != 0)
+    full_sum = full_sum + (carry_mode & (val & alu.CMP != 0) & (carryin != 0))
+
+    mult = xora * xorb
+    divisor = np.where(xorb == 0, 1, xorb)
+    sa = _signed(xora)
+    sb = _signed(divisor)
+    # Truncates towards zero like Verilog
+    q = np.abs(sa) // np.abs(sb)
+    signed_div = np.where((sa < 0) != (sb < 0), -q, q) & 0xFF
+    muxoutput = np.select(
+        [cselect == alu.SUM, cselect == alu.AND, cselect == alu.MULT],
+        [
+            full_sum & 0xFF,
+            xora & xorb,
+            np.where(val & alu.HIGH, mult >> 8 & 0xFF, mult & 0xFF),
+        ],
+        np.where(signed_mode, signed_div, xora // divisor),
+    )
+
+    invert = (val & (alu.IA | alu.IB) != 0) & (val & alu.PO != 0)
+    carry = np.where(cselect == alu.SUM, (full_sum >> 8 & 1) ^ invert, 0)
+
+    sign = muxoutput >> 7
+    sa = xora >> 7
+    sb = xorb >> 7
+    overflow = ((sign ^ 1) & sa & sb) | (sign & (sa ^ 1) & (sb ^ 1))
+
+    aluout = np.where(val & alu.IO, muxoutput ^ 0xFF, muxoutput)
+    return aluout, (muxoutput == 0).astype(np.int64), overflow, carry, sign
+
+
+def jump_taken(sel, zflag, oflag, cflag, sflag):
+    """computer.jump_taken() over arrays."""
+    z = zflag != 0
+    o = oflag != 0
+    c = cflag != 0
+    s = sflag != 0
+    conditions = np.stack(
+        [
+            np.ones_like(z),
+            z,
+            ~z,
+            c,
+            c | z,
+            ~c & ~z,
+            ~c,
+            o != s,
+            (o != s) | z,
+            (o == s) & ~z,
+            o == s,
+            z,
+            o,
+            c,
+            s,
+            np.zeros_like(z),
+        ]
+    )
+    return conditions[sel, np.arange(len(sel))]
+
+
+class BatchComputer:
+    """Many Computers running one program in lockstep, each on its own
+    inputs.
+
+    Registers, flags, pc and counters are arrays with an element per
+    machine and every step() runs one instruction on all of them at once.
+    Machines go wherever their own jumps take them, each fetches from its
+    own pc and the effects of every instruction are masked to the machines
+    running it. RAM is kept in 256 byte pages per machine that are only
+    made once some machine touches them. Machines end up in the same state
+    as a Computer given the same inputs would, to the cycle.
+    """
+
+    def __init__(self, program, inputs, address_24bit=False, roms=None):
+        roms = roms or default_roms()
+        self.roms = roms
+        self.address_24bit = address_24bit
+        self.spi_cycles = spi_cycles(address_24bit)
+        self.flags_1 = np.array(roms.flags_1, dtype=np.int64)
+        self.flags_2 = np.array(roms.flags_2, dtype=np.int64)
+        self.alu_rom = np.array(roms.alu_rom, dtype=np.int64)
+        self.jmp_rom = np.array(roms.jmp_rom, dtype=np.int64)
+
+        # Unprogrammed SPI flash reads back as 0xFF, which is also `halt`
+        self.rom = np.full(0x10000, 0xFF, dtype=np.int64)
+        self.rom[: len(program)] = list(program)
+
+        # One row of inputs per machine, padded with its last value
+        inputs = [list(x) for x in inputs]
+        self.count = len(inputs)
+        self.input_lengths = np.array([len(x) for x in inputs], dtype=np.int64)
+        width = max([len(x) for x in inputs] + [1])
+        self.inputs = np.zeros((self.count, width), dtype=np.int64)
+        for i, x in enumerate(inputs):
+            if x:
+                self.inputs[i] = x + x[-1:] * (width - len(x))
+        self.reset()
+
+    def reset(self):
+        def zeros(dtype=np.int64):
+            return np.zeros(self.count, dtype=dtype)
+
+        self.pages = {}
+
+        self.pc = zeros()
+        self.ir = zeros()
+        self.mar = zeros()
+        self.mpage = zeros()
+        self.areg = zeros()
+        self.breg = zeros()
+        self.creg = zeros()
+        self.dreg = zeros()
+        self.oreg = zeros()
+        self.highbits = zeros()
+        self.spi_data = zeros()
+
+        self.zflag = zeros()
+        self.oflag = zeros()
+        self.cflag = zeros()
+        self.sflag = zeros()
+        self.carry_mode = zeros(bool)
+        self.signed_mode = zeros(bool)
+
+        self.halted = zeros(bool)
+        self.cycles = zeros()
+        self.instructions = zeros()
+
+        # Outputs in a growing array, output_counts long for each machine
+        self.output_counts = zeros()
+        self._outputs = np.zeros((self.count, 16), dtype=np.uint8)
+
+        self._input_index = zeros()
+        self.ui_in = self.inputs[:, 0].copy()
+
+    def outputs(self, machine):
+        return self._outputs[machine, : self.output_counts[machine]].tolist()
+
+    def ram(self, address):
+        """The byte at address in the RAM of every machine."""
+        page = self.pages.get(address >> 8)
+        if page is None:
+            return np.full(self.count, 0xFF, dtype=np.uint8)
+        return page[:, address & 0xFF].copy()
+
+    def _page(self, page):
+        if page not in self.pages:
+            self.pages[page] = np.full((self.count, 0x100), 0xFF, dtype=np.uint8)
+        return self.pages[page]
+
+    def _ram_access(self, mask, databus, write):
+        for page in np.unique(self.mpage[mask]):
+            rows = np.nonzero(mask & (self.mpage == page))[0]
+            memory = self._page(int(page))
+            if write:
+                memory[rows, self.mar[rows]] = databus[rows]
+            else:
+                self.spi_data[rows] = memory[rows, self.mar[rows]]
+
+    def _output(self, mask, value):
+        # Only changes of uo_out are seen and advance the inputs, like
+        # Computer._output()
+        mask = mask & (value != self.oreg)
+        advance = mask & (self._input_index + 1 < self.input_lengths)
+        self._input_index += advance
+        rows = np.arange(self.count)
+        self.ui_in = np.where(advance, self.inputs[rows, self._input_index], self.ui_in)
+        self.oreg = np.where(mask, value, self.oreg)
+
+        if self.output_counts.max() >= self._outputs.shape[1]:
+            self._outputs = np.concatenate(
+                [self._outputs, np.zeros_like(self._outputs)], axis=1
+            )
+        rows = np.nonzero(mask)[0]
+        self._outputs[rows, self.output_counts[rows]] = value[rows]
+        self.output_counts += mask
+
+    def _operand(self, flags, side):
+        return np.select(
+            [flags & bit != 0 for bit, _ in side],
+            [getattr(self, name) for _, name in side],
+            0,
+        )
+
+    def _alu(self, mask, flags):
+        ir = self.ir
+        val = self.alu_rom[ir]
+        aluout, zflag, oflag, cflag, sflag = evaluate(
+            val,
+            self._operand(flags, A_SIDE),
+            self._operand(flags, B_SIDE),
+            self.cflag,
+            self.carry_mode,
+            self.signed_mode,
+        )
+        update = mask & ((val & alu.CMP != 0) | (ir == alu.CLR_CMP_INS))
+        self.zflag = np.where(update, zflag, self.zflag)
+        self.oflag = np.where(update, oflag, self.oflag)
+        self.cflag = np.where(update, cflag, self.cflag)
+        self.sflag = np.where(update, sflag, self.sflag)
+        return aluout
+
+    def _databus(self, flags, aluout):
+        return np.select(
+            [flags & ALUO != 0, flags & (ROMO | RAMO) != 0, flags & IO != 0],
+            [aluout, self.spi_data, self.ui_in],
+            0,
+        )
+
+    def step(self, mask=None):
+        """Runs an instruction on the machines in mask, all that haven't
+        halted by default. Returns which of them are still running."""
+        running = ~self.halted if mask is None else mask & ~self.halted
+
+        # UPDATE_SPI, UPDATE_IR
+        ir = np.where(running, self.rom[self.pc], self.ir)
+        self.spi_data = np.where(running, ir, self.spi_data)
+        self.ir = ir
+        self.cycles += running * (self.spi_cycles + 1)
+
+        # The ALU latches these modes while idle, whenever they are on cins
+        self.carry_mode = np.where(
+            running & (ir == alu.CARRY_OFF_INS), False, self.carry_mode
+        )
+        self.carry_mode |= running & (ir == alu.CARRY_ON_INS)
+        self.signed_mode = np.where(
+            running & (ir == alu.SIGN_OFF_INS), False, self.signed_mode
+        )
+        self.signed_mode |= running & (ir == alu.SIGN_ON_INS)
+
+        for table, first in ((self.flags_1, True), (self.flags_2, False)):
+            # FLAGS_1, FLAGS_2
+            flags = np.where(running, table[ir], 0)
+            self.cycles += running
+            halt = flags & HALT != 0
+            if halt.any():
+                self.halted |= halt
+                self.instructions += halt
+                running = running & ~halt
+                flags = np.where(halt, 0, flags)
+            self.pc = np.where(flags & PCC, (self.pc + 1) & 0xFFFF, self.pc)
+
+            aluout = 0
+            uses_alu = flags & ALUO != 0
+            if uses_alu.any():
+                self.cycles += uses_alu * ALU_CYCLES
+                aluout = self._alu(uses_alu, flags)
+
+            uses_spi = flags & SPI_FLAGS != 0
+            if uses_spi.any():
+                self.cycles += uses_spi * self.spi_cycles
+                databus = self._databus(flags, aluout)
+                rom_read = flags & ROMO != 0
+                ram_write = uses_spi & ~rom_read & (flags & RAMI != 0)
+                ram_read = uses_spi & ~rom_read & ~ram_write & (flags & RAMO != 0)
+                # No chip select is asserted otherwise, so nothing drives miso
+                idle = uses_spi & ~rom_read & ~ram_write & ~ram_read
+                self.spi_data = np.where(rom_read, self.rom[self.pc], self.spi_data)
+                self.spi_data = np.where(idle, 0, self.spi_data)
+                if ram_write.any():
+                    self._ram_access(ram_write, databus, True)
+                if ram_read.any():
+                    self._ram_access(ram_read, databus, False)
+
+            # FLAGS_1_EVENTS, FLAGS_2_EVENTS
+            self.cycles += running
+            databus = self._databus(flags, aluout)
+            written = np.zeros(self.count, dtype=bool)
+            for bit, name in WRITES:
+                write = (flags & bit != 0) & ~written
+                if write.any():
+                    setattr(self, name, np.where(write, databus, getattr(self, name)))
+                written |= write
+            output = (flags & OI != 0) & ~written
+            if output.any():
+                self._output(output, databus)
+
+            if first:
+                self.highbits = np.where(running, databus, self.highbits)
+                continue
+
+            pc = np.where(running, (self.pc + 1) & 0xFFFF, self.pc)
+            jumps = flags & JMPO != 0
+            if jumps.any():
+                val = self.jmp_rom[ir]
+                taken = jumps & jump_taken(
+                    val & 0xF, self.zflag, self.oflag, self.cflag, self.sflag
+                )
+                target = self.highbits << 8 | databus
+                target = np.where(val & 0x10, self.pc + target, target) & 0xFFFF
+                pc = np.where(taken, target, pc)
+            self.pc = pc
+
+        self.instructions += running
+        return running
+
+    def run(self, cycles=None, instructions=None):
+        """Steps every machine until it halts or runs out of budget, the
+        budgets are per machine like Computer.run()'s."""
+        while True:
+            mask = ~self.halted
+            if cycles is not None:
+                mask &= self.cycles < cycles
+            if instructions is not None:
+                mask &= self.instructions < instructions
+            if not mask.any():
+                break
+            self.step(mask)
+
+
+def sweep_inputs(length, values=range(256)):
+    """Every sequence of length inputs drawn from values."""
+    return [list(x) for x in itertools.product(values, repeat=length)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a program on many input sequences at once and group "
+        "the sequences by what the program printed"
+    )
+    parser.add_argument(
+        "program",
+        type=Path,
+        help="The assembled image to run (.o, .bin or .hex), or a .j source",
+    )
+    parser.add_argument(
+        "--inputs",
+        "-i",
+        action="append",
+        default=[],
+        help="Comma separated values for ui_in, once per machine",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=int,
+        metavar="LENGTH",
+        help="Also run every sequence of LENGTH input bytes, 256 ** LENGTH machines",
+    )
+    parser.add_argument(
+        "--cycles", "-c", type=int, default=1000000, help="Clock cycle budget"
+    )
+    parser.add_argument("--instructions", "-n", type=int, help="Instruction budget")
+    parser.add_argument(
+        "--address-24bit", action="store_true", help="Use 24 bit SPI addressing"
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="Distinct output sequences to list"
+    )
+    args = parser.parse_args(argv)
+
+    if args.program.suffix == ".j":
+        from assembler import assemble
+
+        program = assemble(args.program.read_text())
+    else:
+        program = list(read_image(args.program))
+
+    inputs = [
+        [int(x, 0) & 0xFF for x in value.split(",") if x.strip()]
+        for value in args.inputs
+    ]
+    if args.sweep is not None:
+        inputs += sweep_inputs(args.sweep)
+    if not inputs:
+        parser.error("Give --inputs or --sweep")
+
+    computer = BatchComputer(program, inputs, args.address_24bit)
+    start = time.perf_counter()
+    computer.run(args.cycles, args.instructions)
+    elapsed = time.perf_counter() - start
+
+    groups = Counter(tuple(computer.outputs(x)) for x in range(computer.count))
+    print("%d machines, %d halted" % (computer.count, computer.halted.sum()))
+    print(
+        "%d instructions in %.2f s, %.0f per second"
+        % (
+            computer.instructions.sum(),
+            elapsed,
+            computer.instructions.sum() / max(elapsed, 1e-9),
+        )
+    )
+    print("%d distinct outputs" % len(groups))
+    for outputs, count in groups.most_common(args.top):
+        print("%8d  %s" % (count, " ".join(str(x) for x in outputs)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
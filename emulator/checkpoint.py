@@ -0,0 +1,218 @@
+import sys
+import json
+import argparse
+from pathlib import Path
+
+from .computer import Computer
+from .fast import FastComputer
+
+CHECKPOINT_VERSION = 1
+
+# Computer attributes a checkpoint keeps, everything a program can see
+# between two instructions plus the counters
+STATE = [
+    "pc",
+    "ir",
+    "mar",
+    "mpage",
+    "areg",
+    "breg",
+    "creg",
+    "dreg",
+    "oreg",
+    "highbits",
+    "spi_data",
+    "zflag",
+    "oflag",
+    "cflag",
+    "sflag",
+    "carry_mode",
+    "signed_mode",
+    "halted",
+    "cycles",
+    "instructions",
+]
+
+# ROM and RAM are saved a page at a time, leaving out erased ones
+PAGE = 0x100
+
+
+def _pages(data):
+    blank = b"\xff" * PAGE
+    return {
+        "%04x" % start: data[start : start + PAGE].hex()
+        for start in range(0, len(data), PAGE)
+        if data[start : start + PAGE] != blank
+    }
+
+
+def _unpages(pages, size=0x10000):
+    data = bytearray(b"\xff" * size)
+    for start, page in pages.items():
+        start = int(start, 16)
+        page = bytes.fromhex(page)
+        data[start : start + len(page)] = page
+    return bytes(data)
+
+
+class Checkpoint:
+    """The architectural state of a Computer between two instructions: its
+    registers, flags, ALU modes, pc and counters, ROM and RAM contents and
+    how far through its inputs it is."""
+
+    def __init__(
+        self, state, rom, ram, inputs=(), input_index=0, outputs=(), address_24bit=False
+    ):
+        self.state = dict(state)
+        self.rom = bytes(rom)
+        self.ram = bytes(ram)
+        self.inputs = list(inputs)
+        self.input_index = input_index
+        self.outputs = list(outputs)
+        self.address_24bit = address_24bit
+
+    @property
+    def ui_in(self):
+        return self.inputs[self.input_index] if self.inputs else 0
+
+    def save(self, path):
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "address_24bit": self.address_24bit,
+            "state": self.state,
+            "inputs": self.inputs,
+            "input_index": self.input_index,
+            "outputs": self.outputs,
+            "rom": _pages(self.rom),
+            "ram": _pages(self.ram),
+        }
+        Path(path).write_text(json.dumps(data, indent=1) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text())
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(
+                "%s is checkpoint version %s, not %d"
+                % (path, data.get("version"), CHECKPOINT_VERSION)
+            )
+        return cls(
+            data["state"],
+            _unpages(data["rom"]),
+            _unpages(data["ram"]),
+            data["inputs"],
+            data["input_index"],
+            data["outputs"],
+            data["address_24bit"],
+        )
+
+
+def capture(computer):
+    """A Checkpoint of computer as it is now."""
+    return Checkpoint(
+        {x: getattr(computer, x) for x in STATE},
+        computer.rom,
+        computer.ram,
+        computer.inputs,
+        computer._input_index,
+        computer.outputs,
+        computer.address_24bit,
+    )
+
+
+def restore(checkpoint, computer=None):
+    """Puts checkpoint into computer, a new Computer by default, and returns
+    it. Running it on gives the same results as running the computer the
+    checkpoint was captured from would have."""
+    if computer is None:
+        computer = Computer((), checkpoint.address_24bit, checkpoint.inputs)
+    elif computer.address_24bit != checkpoint.address_24bit:
+        raise ValueError("The checkpoint has the other SPI address mode")
+    computer.inputs = list(checkpoint.inputs)
+    computer.reset()
+    # Through the slice so FastComputer sees the new program
+    computer.rom[:] = checkpoint.rom
+    computer.ram[:] = checkpoint.ram
+    for name, value in checkpoint.state.items():
+        setattr(computer, name, value)
+    computer._input_index = checkpoint.input_index
+    computer.ui_in = checkpoint.ui_in
+    computer.outputs = list(checkpoint.outputs)
+    return computer
+
+
+def fast_forward(computer, cycles=None, address=None):
+    """Runs computer to the first instruction boundary at or after cycles,
+    or to just before it runs the instruction at address. Returns whether it
+    got there before halting."""
+    if address is None:
+        computer.run(cycles)
+        return not computer.halted
+    while computer.pc != address:
+        if computer.halted or (cycles is not None and computer.cycles >= cycles):
+            return False
+        computer.step()
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a program on the emulator up to a cycle or label and "
+        "save a checkpoint to test the rest of it from"
+    )
+    parser.add_argument(
+        "program", type=Path, help="The program (.o, .bin or .hex), or a .j source"
+    )
+    parser.add_argument("output", type=Path, help="Where to write the checkpoint")
+    parser.add_argument("--cycles", "-c", type=int, help="Stop at this clock cycle")
+    parser.add_argument(
+        "--label", "-l", help="Stop the first time the program gets to this label"
+    )
+    parser.add_argument(
+        "--address-24bit", action="store_true", help="Use 24 bit SPI addressing"
+    )
+    parser.add_argument(
+        "--inputs",
+        "-i",
+        default="",
+        help="Comma separated values driven on ui_in, advanced on each new output",
+    )
+    args = parser.parse_args(argv)
+    if args.cycles is None and args.label is None:
+        parser.error("Give --cycles or --label")
+
+    from assembler import DebugInfo, assemble_debug, read_image
+
+    if args.program.suffix == ".j":
+        program, debug_info = assemble_debug(
+            args.program.read_text(), args.program.name
+        )
+    else:
+        program = list(read_image(args.program))
+        debug_info = DebugInfo.find(args.program, program)
+
+    address = None
+    if args.label is not None:
+        if debug_info is None or args.label not in debug_info.labels:
+            print("No label %s in %s" % (args.label, args.program))
+            return 1
+        address = debug_info.labels[args.label]
+
+    inputs = [int(x, 0) & 0xFF for x in args.inputs.split(",") if x.strip()]
+    # Labels need stepping an instruction at a time, cycles can go by blocks
+    engine = Computer if address is not None else FastComputer
+    computer = engine(program, args.address_24bit, inputs)
+    if not fast_forward(computer, args.cycles, address):
+        print("Didn't get there within %d cycles" % computer.cycles)
+        return 1
+
+    capture(computer).save(args.output)
+    print(
+        "Checkpoint at pc %04x after %d instructions, %d cycles written to %s"
+        % (computer.pc, computer.instructions, computer.cycles, args.output)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+from . import alu
+from .roms import (
+    default_roms,
+    IO,
+    AO,
+    BO,
+    CO,
+    DO,
+    AO2,
+    BO2,
+    CO2,
+    DO2,
+    ROMO,
+    RAMO,
+    JMPO,
+    OI,
+    RAMI,
+    MARI,
+    MPAGEI,
+    AI,
+    BI,
+    CI,
+    DI,
+    PCC,
+    HALT,
+    ALUO,
+    SPI_FLAGS,
+)
+
+# Clock cycles the CU spends waiting on the ALU (start handshake, DECODE,
+# ANDZ, XORZ, SUM/AND/MULT/DIV, INVERT and the done handshake).
+ALU_CYCLES = 8
+
+
+def spi_cycles(address_24bit=False):
+    # Command, address and data bits take two clocks each, plus the start
+    # cycle in IDLE, the cycle spi.sv raises done and the cycle the CU sees it.
+    return 2 * (8 + (24 if address_24bit else 16) + 8) + 3
+
+
+def jump_taken(sel, zflag, oflag, cflag, sflag):
+    # Same ordering as the flags vector in jmp.sv
+    if sel == 0:
+        return True
+    if sel == 1:
+        return zflag
+    if sel == 2:
+        return not zflag
+    if sel == 3:
+        return cflag
+    if sel == 4:
+        return cflag or zflag
+    if sel == 5:
+        return not cflag and not zflag
+    if sel == 6:
+        return not cflag
+    if sel == 7:
+        return oflag != sflag
+    if sel == 8:
+        return oflag != sflag or zflag
+    if sel == 9:
+        return oflag == sflag and not zflag
+    if sel == 10:
+        return oflag == sflag
+    if sel == 11:
+        return zflag
+    if sel == 12:
+        return oflag
+    if sel == 13:
+        return cflag
+    if sel == 14:
+        return sflag
+    return False
+
+
+class Computer:
+    def __init__(self, program=(), address_24bit=False, inputs=(), roms=None):
+        self.roms = roms or default_roms()
+        self.address_24bit = address_24bit
+        self.spi_cycles = spi_cycles(address_24bit)
+
+        # Unprogrammed SPI flash reads back as 0xFF, which is also `halt`
+        self.rom = bytearray(b"\xff" * 0x10000)
+        self.rom[: len(program)] = bytes(program)
+
+        self.inputs = list(inputs)
+        self.reset()
+
+    def reset(self):
+        self.ram = bytearray(b"\xff" * 0x10000)
+
+        self.pc = 0
+        self.ir = 0
+        self.mar = 0
+        self.mpage = 0
+        self.areg = 0
+        self.breg = 0
+        self.creg = 0
+        self.dreg = 0
+        self.oreg = 0
+        self.highbits = 0
+        self.spi_data = 0
+
+        self.zflag = 0
+        self.oflag = 0
+        self.cflag = 0
+        self.sflag = 0
+        self.carry_mode = False
+        self.signed_mode = False
+
+        self.halted = False
+        self.cycles = 0
+        self.instructions = 0
+        self.outputs = []
+
+        self._input_index = 0
+        self.ui_in = self.inputs[0] if self.inputs else 0
+
+    def _output(self, value):
+        # Only changes of uo_out are seen, like test_full.run(), and inputs
+        # advance on each of them
+        if value == self.oreg:
+            return
+        if self._input_index + 1 < len(self.inputs):
+            self._input_index += 1
+            self.ui_in = self.inputs[self._input_index]
+        self.oreg = value
+        self.outputs.append(value)
+
+    def _alu(self, flags):
+        if flags & AO:
+            a = self.areg
+        elif flags & BO:
+            a = self.breg
+        elif flags & CO:
+            a = self.creg
+        elif flags & DO:
+            a = self.dreg
+        else:
+            a = 0
+
+        if flags & AO2:
+            b = self.areg
+        elif flags & BO2:
+            b = self.breg
+        elif flags & CO2:
+            b = self.creg
+        elif flags & DO2:
+            b = self.dreg
+        else:
+            b = 0
+
+        val = self.roms.alu_rom[self.ir]
+        aluout, zflag, oflag, cflag, sflag = alu.evaluate(
+            val, a, b, self.cflag, self.carry_mode, self.signed_mode
+        )
+        if val & alu.CMP or self.ir == alu.CLR_CMP_INS:
+            self.zflag = zflag
+            self.oflag = oflag
+            self.cflag = cflag
+            self.sflag = sflag
+        return aluout
+
+    def _databus(self, flags, aluout):
+        if flags & ALUO:
+            return aluout
+        if flags & (ROMO | RAMO):
+            return self.spi_data
+        if flags & IO:
+            return self.ui_in
+        return 0
+
+    def _spi(self, flags, databus):
+        if flags & ROMO:
+            self.spi_data = self.rom[self.pc]
+            return
+
+        address = self.mpage << 8 | self.mar
+        if flags & RAMI:
+            self.ram[address] = databus
+        elif flags & RAMO:
+            self.spi_data = self.ram[address]
+        else:
+            # No chip select is asserted, so nothing drives miso
+            self.spi_data = 0
+
+    def _write(self, flags, databus):
+        if flags & MARI:
+            self.mar = databus
+        elif flags & MPAGEI:
+            self.mpage = databus
+        elif flags & AI:
+            self.areg = databus
+        elif flags & BI:
+            self.breg = databus
+        elif flags & CI:
+            self.creg = databus
+        elif flags & DI:
+            self.dreg = databus
+        elif flags & OI:
+            self._output(databus)
+
+    def step(self):
+        if self.halted:
+            return False
+
+        roms = self.roms
+
+        # UPDATE_SPI, UPDATE_IR
+        self.spi_data = self.rom[self.pc]
+        self.ir = ir = self.spi_data
+        self.cycles += self.spi_cycles + 1
+
+        # The ALU latches these modes while idle, whenever they are on cins
+        if ir == alu.CARRY_OFF_INS:
+            self.carry_mode = False
+        elif ir == alu.CARRY_ON_INS:
+            self.carry_mode = True
+        elif ir == alu.SIGN_OFF_INS:
+            self.signed_mode = False
+        elif ir == alu.SIGN_ON_INS:
+            self.signed_mode = True
+
+        for flags, first in ((roms.flags_1[ir], True), (roms.flags_2[ir], False)):
+            # FLAGS_1, FLAGS_2
+            self.cycles += 1
+            if flags & HALT:
+                self.halted = True
+                self.instructions += 1
+                return False
+            if flags & PCC:
+                self.pc = (self.pc + 1) & 0xFFFF
+
+            aluout = 0
+            if flags & ALUO:
+                self.cycles += ALU_CYCLES
+                aluout = self._alu(flags)
+
+            if flags & SPI_FLAGS:
+                self.cycles += self.spi_cycles
+                self._spi(flags, self._databus(flags, aluout))
+
+            # FLAGS_1_EVENTS, FLAGS_2_EVENTS
+            self.cycles += 1
+            databus = self._databus(flags, aluout)
+            self._write(flags, databus)
+
+            if first:
+                self.highbits = databus
+                continue
+
+            if flags & JMPO:
+                val = roms.jmp_rom[ir]
+                if jump_taken(
+                    val & 0xF, self.zflag, self.oflag, self.cflag, self.sflag
+                ):
+                    target = self.highbits << 8 | databus
+                    if val & 0x10:
+                        target = self.pc + target
+                    self.pc = target & 0xFFFF
+                    continue
+            self.pc = (self.pc + 1) & 0xFFFF
+
+        self.instructions += 1
+        return True
+
+    def run(self, cycles=None, instructions=None):
+        while not self.halted:
+            if cycles is not None and self.cycles >= cycles:
+                break
+            if instructions is not None and self.instructions >= instructions:
+                break
+            self.step()
+        return self.outputs
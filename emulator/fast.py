@@ -0,0 +1,508 @@
+import re
+import math
+import functools
+
+from . import alu
+from .computer import Computer, ALU_CYCLES
+from .roms import (
+    IO,
+    AO,
+    BO,
+    CO,
+    DO,
+    AO2,
+    BO2,
+    CO2,
+    DO2,
+    ROMO,
+    RAMO,
+    JMPO,
+    OI,
+    RAMI,
+    MARI,
+    MPAGEI,
+    AI,
+    BI,
+    CI,
+    DI,
+    PCC,
+    HALT,
+    ALUO,
+    SPI_FLAGS,
+)
+
+# Longest run of instructions translated into one function
+MAX_BLOCK = 16
+
+# Times execution has to jump to an address before the block from there is
+# translated, code that only runs once is cheaper to interpret
+HOT = 4
+
+# Compiled blocks kept for reuse, by their source
+COMPILED_BLOCKS = 1024
+
+# jump_taken() as expressions of the flags, by jmp_rom select
+CONDITIONS = [
+    "True",
+    "zf",
+    "not zf",
+    "cf",
+    "cf or zf",
+    "not cf and not zf",
+    "not cf",
+    "of != sf",
+    "of != sf or zf",
+    "of == sf and not zf",
+    "of == sf",
+    "zf",
+    "of",
+    "cf",
+    "sf",
+    "False",
+]
+
+# Machine state a block keeps in locals, and the attribute each lives in
+STATE = [
+    ("ra", "areg"),
+    ("rb", "breg"),
+    ("rc", "creg"),
+    ("rd", "dreg"),
+    ("mar", "mar"),
+    ("mpage", "mpage"),
+    ("zf", "zflag"),
+    ("of", "oflag"),
+    ("cf", "cflag"),
+    ("sf", "sflag"),
+    ("cm", "carry_mode"),
+    ("sm", "signed_mode"),
+]
+
+
+class Block:
+    def __init__(self, start, addresses, count, cycles, run):
+        self.start = start
+        self.addresses = addresses
+        self.count = count
+        self.cycles = cycles
+        self.run = run
+
+
+class _Rom(bytearray):
+    # The program with the blocks translated from it, the Block from each
+    # entry address or the times execution has jumped there until it is
+    # translated. They live here, not on the machine, as past 30 attributes
+    # Python stops sharing the keys of instance dicts and step() gets slower
+    def __init__(self, data):
+        super().__init__(data)
+        self.blocks = {}
+
+    def __setitem__(self, address, value):
+        super().__setitem__(address, value)
+        if isinstance(address, slice):
+            self.invalidate(range(*address.indices(len(self))))
+        else:
+            self.invalidate(range(address % len(self), address % len(self) + 1))
+
+    def invalidate(self, addresses=None):
+        # In place, run() holds on to the dict while blocks write the ROM
+        if addresses is None:
+            self.blocks.clear()
+            return
+        addresses = set(addresses)
+        for pc, x in list(self.blocks.items()):
+            if isinstance(x, Block) and not addresses.isdisjoint(x.addresses):
+                del self.blocks[pc]
+
+
+def _operand(flags, regs):
+    # The register put on one side of the ALU, 0 when none is
+    for bit, reg in zip(regs, ("ra", "rb", "rc", "rd")):
+        if flags & bit:
+            return reg
+    return "0"
+
+
+def _side(lines, operand, zero, invert, name):
+    # One input of the ALU, a temporary only when it has to be worked out
+    value = "0" if zero else operand
+    if not invert:
+        return value
+    if value == "0":
+        return "255"
+    lines.append("%s = %s ^ 255" % (name, value))
+    return name
+
+
+def _alu(lines, val, a, b, update_flags):
+    """Appends the code for one pass through the ALU, returns the name or
+    constant its result is in."""
+    xa = _side(lines, a, val & alu.ZA, val & alu.IA, "xa")
+    xb = _side(lines, b, val & alu.ZB, val & alu.IB, "xb")
+
+    cselect = val >> 8
+    if cselect == alu.SUM:
+        terms = [x for x in (xa, xb) if x != "0"]
+        if val & alu.PO:
+            terms.append("1")
+        if val & alu.CMP:
+            terms.append("(cm and cf)")
+        total = " + ".join(terms) or "0"
+        if update_flags:
+            lines.append("fs = %s" % total)
+            lines.append("mux = fs & 255")
+        else:
+            lines.append("mux = (%s) & 255" % total)
+    elif cselect == alu.AND:
+        lines.append("mux = %s & %s" % (xa, xb))
+    elif cselect == alu.MULT:
+        if val & alu.HIGH:
+            lines.append("mux = (%s * %s) >> 8 & 255" % (xa, xb))
+        else:
+            lines.append("mux = %s * %s & 255" % (xa, xb))
+    else:
+        lines.append(
+            "mux = signed_div(%s, %s or 1) if sm else %s // (%s or 1)"
+            % (xa, xb, xa, xb)
+        )
+    out = "mux"
+    if val & alu.IO:
+        lines.append("out = mux ^ 255")
+        out = "out"
+
+    if update_flags:
+        lines.append("zf = int(mux == 0)")
+        lines.append("sf = mux >> 7")
+        lines.append("sa = %s >> 7" % xa)
+        lines.append("sb = %s >> 7" % xb)
+        lines.append("of = ((sf ^ 1) & sa & sb) | (sf & (sa ^ 1) & (sb ^ 1))")
+        if cselect == alu.SUM:
+            invert = val & (alu.IA | alu.IB) and val & alu.PO
+            lines.append("cf = (fs >> 8 & 1)%s" % (" ^ 1" if invert else ""))
+        else:
+            lines.append("cf = 0")
+    return out
+
+
+_ASSIGNMENT = re.compile(r"(\w+) = (.*)")
+_WORD = re.compile(r"\w+")
+
+
+def _drop_dead(lines, loops):
+    """Removes the assignments to locals that are overwritten before anything
+    reads them, mostly flags set by one compare and then by the next."""
+    # Only the top level ones, anything under an if is kept along with
+    # everything it reads
+    live_in = set()
+    while True:
+        live = set(live_in) if loops else set()
+        kept = []
+        for line in reversed(lines):
+            match = None if line[0] == " " else _ASSIGNMENT.fullmatch(line)
+            if match is None:
+                live.update(_WORD.findall(line))
+            elif match.group(1) in live:
+                live.discard(match.group(1))
+                live.update(_WORD.findall(match.group(2)))
+            else:
+                continue
+            kept.append(line)
+        if not loops or live <= live_in:
+            return kept[::-1]
+        # Round again with what the next time round reads
+        live_in |= live
+
+
+def translate(roms, rom, start, spi_cycles):
+    """Python source for the instructions from start up to an unconditional
+    jump it can't follow, a halt or MAX_BLOCK instructions, with the ROM
+    bytes it reads.
+
+    Jumps to a constant address are followed, conditional ones leave the
+    block when taken, and ones back to start loop within it for as long as
+    the budgets passed in allow another time round.
+
+    Returns (source, addresses, count, cycles) where count and cycles are
+    for once round the longest way through.
+    """
+    lines = []
+    addresses = set()
+    cycles = 0
+    count = 0
+    pc = start
+    spi = None
+    highbits = "hb"
+    ir = None
+    end = None
+    loops = False
+
+    def exit(indent, pc, halted=False, looped=False):
+        # Rendered once the whole block is known, the cycles and instructions
+        # of a loop round are already in spent and retired
+        done = (0, 0) if looped else (cycles, count)
+        lines.append((indent, pc, halted, spi, highbits, ir) + done)
+
+    while end is None:
+        # UPDATE_SPI, UPDATE_IR
+        ir = rom[pc]
+        addresses.add(pc)
+        spi = str(ir)
+        cycles += spi_cycles + 1
+        count += 1
+
+        if ir == alu.CARRY_OFF_INS:
+            lines.append("cm = False")
+        elif ir == alu.CARRY_ON_INS:
+            lines.append("cm = True")
+        elif ir == alu.SIGN_OFF_INS:
+            lines.append("sm = False")
+        elif ir == alu.SIGN_ON_INS:
+            lines.append("sm = True")
+
+        for flags, first in ((roms.flags_1[ir], True), (roms.flags_2[ir], False)):
+            cycles += 1
+            if flags & HALT:
+                exit("", str(pc), halted=True)
+                end = "halt"
+                break
+            if flags & PCC:
+                pc = (pc + 1) & 0xFFFF
+
+            if flags & ALUO:
+                cycles += ALU_CYCLES
+                val = roms.alu_rom[ir]
+                result = _alu(
+                    lines,
+                    val,
+                    _operand(flags, (AO, BO, CO, DO)),
+                    _operand(flags, (AO2, BO2, CO2, DO2)),
+                    val & alu.CMP or ir == alu.CLR_CMP_INS,
+                )
+
+            def databus():
+                if flags & ALUO:
+                    return result
+                if flags & (ROMO | RAMO):
+                    return spi
+                if flags & IO:
+                    lines.append("db = m.ui_in")
+                    return "db"
+                return "0"
+
+            if flags & SPI_FLAGS:
+                cycles += spi_cycles
+                if flags & ROMO:
+                    addresses.add(pc)
+                    spi = str(rom[pc])
+                elif flags & RAMI:
+                    lines.append("ram[mpage << 8 | mar] = %s" % databus())
+                elif flags & RAMO:
+                    lines.append("spi = ram[mpage << 8 | mar]")
+                    spi = "spi"
+                else:
+                    spi = "0"
+
+            # FLAGS_1_EVENTS, FLAGS_2_EVENTS
+            cycles += 1
+            value = databus()
+            for bit, name in (
+                (MARI, "mar"),
+                (MPAGEI, "mpage"),
+                (AI, "ra"),
+                (BI, "rb"),
+                (CI, "rc"),
+                (DI, "rd"),
+            ):
+                if flags & bit:
+                    lines.append("%s = %s" % (name, value))
+                    break
+            else:
+                if flags & OI:
+                    lines.append("output(%s)" % value)
+
+            if first:
+                if not value.isdigit():
+                    # Later writes mustn't change it
+                    lines.append("hb = %s" % value)
+                    value = "hb"
+                highbits = value
+                continue
+
+            if flags & JMPO:
+                val = roms.jmp_rom[ir]
+                condition = CONDITIONS[val & 0xF]
+                base = pc if val & 0x10 else 0
+                if highbits.isdigit() and value.isdigit():
+                    target = (base + (int(highbits) << 8 | int(value))) & 0xFFFF
+                else:
+                    target = "(%d + (%s << 8 | %s)) & 65535" % (base, highbits, value)
+
+                if condition == "False":
+                    pass
+                elif target == start:
+                    loops = True
+                    lines.append("if %s:" % condition)
+                    lines.append("    spent += %d" % cycles)
+                    lines.append("    retired += %d" % count)
+                    if highbits != "hb":
+                        lines.append("    hb = %s" % highbits)
+                    lines.append("    if spent > cycles or retired > instructions:")
+                    exit("        ", str(start), looped=True)
+                    lines.append("        return")
+                    lines.append("    continue")
+                    if condition == "True":
+                        end = "loop"
+                elif condition == "True" and isinstance(target, int):
+                    # Translation carries on where it goes
+                    pc = target
+                    continue
+                else:
+                    lines.append("if %s:" % condition)
+                    exit("    ", str(target))
+                    lines.append("    return")
+                    if condition == "True":
+                        end = "jump"
+            pc = (pc + 1) & 0xFFFF
+
+        if end is None and count >= MAX_BLOCK:
+            end = "limit"
+    if end in ("limit", "jump"):
+        exit("", str(pc))
+
+    assigned = {x.split(" = ")[0] for x in lines if isinstance(x, str)}
+    stored = [x for x in STATE if x[0] in assigned]
+    hb_stored = "hb" in assigned
+
+    def render(indent, pc, halted, spi, highbits, ir, cycles, count):
+        # Only what the block may have changed goes back
+        out = ["m.%s = %s" % (attr, name) for name, attr in stored]
+        out.append("m.spi_data = %s" % spi)
+        if highbits != "hb" or hb_stored:
+            out.append("m.highbits = %s" % highbits)
+        out.append("m.ir = %d" % ir)
+        out.append("m.pc = %s" % pc)
+        if loops:
+            out.append("m.cycles += spent + %d" % cycles)
+            out.append("m.instructions += retired + %d" % count)
+        else:
+            out.append("m.cycles += %d" % cycles)
+            out.append("m.instructions += %d" % count)
+        if halted:
+            out.append("m.halted = True")
+        if loops and not indent:
+            out.append("return")
+        return [indent + x for x in out]
+
+    rendered = []
+    for x in lines:
+        rendered.extend([x] if isinstance(x, str) else render(*x))
+    rendered = _drop_dead(rendered, loops)
+
+    # Values carried in from the machine, the budgets left after once round
+    body = ["def block(m, ram, output, cycles, instructions):"]
+    words = set(re.findall(r"\w+", "\n".join(rendered)))
+    body.extend("    %s = m.%s" % x for x in STATE if x[0] in words)
+    if "hb" in words:
+        body.append("    hb = m.highbits")
+    indent = "    "
+    if loops:
+        body.append("    cycles -= %d" % cycles)
+        body.append("    instructions -= %d" % count)
+        body.append("    spent = retired = 0")
+        body.append("    while True:")
+        indent = "        "
+    body.extend(indent + x for x in rendered)
+    return "\n".join(body) + "\n", frozenset(addresses), count, cycles
+
+
+# Translations are plain source with every ROM byte folded in, so the same
+# code at the same address compiles once however many machines run it
+@functools.lru_cache(maxsize=COMPILED_BLOCKS)
+def compile_block(source):
+    namespace = {"signed_div": alu._signed_div}
+    exec(compile(source, "<block>", "exec"), namespace)
+    return namespace["block"]
+
+
+class FastComputer(Computer):
+    """A Computer that runs blocks of instructions as translated Python.
+
+    Each block, from wherever execution enters through the constant jumps
+    it makes up to one it can't follow or a halt, is translated once into a
+    function with the CU decoding, ALU control words and every ROM byte it
+    reads folded in, once execution has jumped there HOT times. Until then
+    the code is stepped, straight through to the next jump without looking
+    for blocks. Loops back to the entry go round inside the function. Blocks
+    are kept per entry address and dropped when a ROM byte they read is
+    written. step() still interprets one instruction, and run() falls back
+    to it when a whole block would go past its budget, so the results are
+    the same as Computer's to the cycle.
+    """
+
+    def __init__(self, program=(), address_24bit=False, inputs=(), roms=None):
+        super().__init__(program, address_24bit, inputs, roms)
+        # A plain attribute, step() reads it every instruction. Write to it
+        # in place, rom[:] = ..., so the blocks reading it are dropped
+        self.rom = _Rom(self.rom)
+
+    def reset(self):
+        super().reset()
+        # Computer.__init__ resets before the ROM is wrapped
+        if isinstance(self.rom, _Rom):
+            self.invalidate()
+
+    def invalidate(self, addresses=None):
+        """Drops the translations reading any of addresses, all of them and
+        the counts of entries to them by default."""
+        self.rom.invalidate(addresses)
+
+    def block(self, pc):
+        block = self.rom.blocks.get(pc)
+        if not isinstance(block, Block):
+            source, addresses, count, cycles = translate(
+                self.roms, self.rom, pc, self.spi_cycles
+            )
+            block = Block(pc, addresses, count, cycles, compile_block(source))
+            self.rom.blocks[pc] = block
+        return block
+
+    def run(self, cycles=None, instructions=None):
+        cycles = math.inf if cycles is None else cycles
+        instructions = math.inf if instructions is None else instructions
+        ram = self.ram
+        output = self._output
+        blocks = self.rom.blocks
+        while (
+            not self.halted
+            and self.cycles < cycles
+            and self.instructions < instructions
+        ):
+            block = blocks.get(self.pc, 0)
+            if block.__class__ is int:
+                if block + 1 < HOT:
+                    blocks[self.pc] = block + 1
+                    self._interpret(cycles, instructions)
+                    continue
+                block = self.block(self.pc)
+            if (
+                self.cycles + block.cycles > cycles
+                or self.instructions + block.count > instructions
+            ):
+                self.step()
+                continue
+            block.run(
+                self,
+                ram,
+                output,
+                cycles - self.cycles,
+                instructions - self.instructions,
+            )
+        return self.outputs
+
+    def _interpret(self, cycles, instructions):
+        # Steps until a jump, blocks only start being looked for where one lands
+        step = self.step
+        pc = self.pc
+        while step() and self.cycles < cycles and self.instructions < instructions:
+            last, pc = pc, self.pc
+            if not last < pc <= last + 3:
+                return
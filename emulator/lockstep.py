@@ -0,0 +1,71 @@
+from collections import deque
+
+from .trace import Record, ARCH_FIELDS, record, format_record
+
+
+class Lockstep:
+    """Checks another engine against a model Computer instruction by
+    instruction.
+
+    Give write() the trace record of every instruction the engine retires,
+    in order, like a TraceWriter. Each one steps the model and compares the
+    architectural state, so only instruction boundaries cost anything. The
+    first disagreement is kept in report and everything after it ignored.
+    """
+
+    def __init__(self, model, debug_info=None, fields=ARCH_FIELDS, context=3):
+        self.model = model
+        self.debug_info = debug_info
+        self.fields = fields
+        self.count = 0
+        self.report = None
+        self._history = deque(maxlen=context)
+
+    @property
+    def diverged(self):
+        return self.report is not None
+
+    def write(self, retired):
+        if self.report is not None:
+            return
+        retired = Record._make(retired)
+        pc = self.model.pc
+        expected = None
+        if self.model.step():
+            expected = Record._make(record(self.model, pc))
+
+        if expected is None:
+            self._diverge(retired, None, "the model halted at %04x" % pc)
+        else:
+            differing = [
+                x for x in self.fields if getattr(retired, x) != getattr(expected, x)
+            ]
+            if differing:
+                self._diverge(retired, expected, "differs in " + ", ".join(differing))
+        self._history.append(retired)
+        self.count += 1
+
+    def finish(self, halted):
+        """Call once the engine stops, halted is whether it got to a halt."""
+        if self.report is not None or not halted:
+            return
+        pc = self.model.pc
+        if self.model.step():
+            self._diverge(
+                None,
+                Record._make(record(self.model, pc)),
+                "the engine halted, the model ran on",
+            )
+
+    def _format(self, retired):
+        return format_record(retired, self.debug_info)
+
+    def _diverge(self, retired, expected, why):
+        lines = ["Diverged from the model at instruction %d, %s" % (self.count, why)]
+        for x in self._history:
+            lines.append("        " + self._format(x))
+        if retired is not None:
+            lines.append("engine: " + self._format(retired))
+        if expected is not None:
+            lines.append("model:  " + self._format(expected))
+        self.report = "\n".join(lines)
@@ -0,0 +1,152 @@
+import mmap
+from pathlib import Path
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+
+# The whole 24 bit SPI address space
+FULL_SIZE = 1 << 24
+
+
+class Snapshot:
+    def __init__(self, pages, dirty):
+        self.pages = pages
+        self.dirty = dirty
+
+
+class PagedMemory:
+    """A sparse byte addressable memory, allocated a page at a time.
+
+    Pages nobody has written read back as fill (0xFF like erased flash and
+    the uninitialised RAM the tests expect), or from backing when given. A
+    backing is any buffer, e.g. an mmap of a .bin image, and is never written
+    to: a page is copied out of it the first time it's written.
+
+    Every page written is remembered in dirty until clear_dirty(), so tests
+    can look at what a program touched without scanning the whole space.
+    """
+
+    def __init__(self, size=FULL_SIZE, fill=0xFF, backing=None):
+        self.size = size
+        self.fill = fill
+        self.backing = backing
+        self.pages = {}
+        self.dirty = set()
+        self._blank = bytes([fill]) * PAGE_SIZE
+
+    @classmethod
+    def from_bytes(cls, data, size=FULL_SIZE, fill=0xFF):
+        memory = cls(size, fill)
+        memory.load(0, data)
+        return memory
+
+    @classmethod
+    def from_file(cls, path, size=FULL_SIZE, fill=0xFF):
+        """Maps a raw binary image, its pages are only read when used."""
+        with open(path, "rb") as f:
+            if Path(path).stat().st_size == 0:
+                return cls(size, fill)
+            backing = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(size, fill, backing)
+
+    def __len__(self):
+        return self.size
+
+    def _page(self, index):
+        # The page to write to, allocated on first use
+        page = self.pages.get(index)
+        if page is None:
+            start = index << PAGE_BITS
+            page = bytearray(self._blank)
+            if self.backing is not None and start < len(self.backing):
+                data = self.backing[start : start + PAGE_SIZE]
+                page[: len(data)] = data
+            self.pages[index] = page
+        self.dirty.add(index)
+        return page
+
+    def _read(self, address):
+        page = self.pages.get(address >> PAGE_BITS)
+        if page is not None:
+            return page[address & (PAGE_SIZE - 1)]
+        if self.backing is not None and address < len(self.backing):
+            return self.backing[address]
+        return self.fill
+
+    def _check(self, address):
+        if not 0 <= address < self.size:
+            raise IndexError("Address %06x is outside the memory" % address)
+
+    def __getitem__(self, address):
+        if isinstance(address, slice):
+            return bytes(self._read(x) for x in range(*address.indices(self.size)))
+        self._check(address)
+        return self._read(address)
+
+    def __setitem__(self, address, value):
+        if isinstance(address, slice):
+            self.load(address.indices(self.size)[0], value)
+            return
+        self._check(address)
+        self._page(address >> PAGE_BITS)[address & (PAGE_SIZE - 1)] = value
+
+    def load(self, address, data):
+        data = bytes(data)
+        if address + len(data) > self.size:
+            raise IndexError("%d bytes at %06x don't fit" % (len(data), address))
+        offset = 0
+        while offset < len(data):
+            start = address + offset
+            within = start & (PAGE_SIZE - 1)
+            count = min(PAGE_SIZE - within, len(data) - offset)
+            page = self._page(start >> PAGE_BITS)
+            page[within : within + count] = data[offset : offset + count]
+            offset += count
+
+    def clear_dirty(self):
+        self.dirty = set()
+
+    def dirty_ranges(self):
+        """The (start, end) address ranges of the pages written, merged."""
+        ranges = []
+        for index in sorted(self.dirty):
+            start = index << PAGE_BITS
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], start + PAGE_SIZE)
+            else:
+                ranges.append((start, start + PAGE_SIZE))
+        return ranges
+
+    def snapshot(self):
+        # Only the allocated pages are copied
+        return Snapshot(
+            {x: bytes(page) for x, page in self.pages.items()}, set(self.dirty)
+        )
+
+    def restore(self, snapshot):
+        self.pages = {x: bytearray(page) for x, page in snapshot.pages.items()}
+        self.dirty = set(snapshot.dirty)
+
+    def changes(self, snapshot):
+        """(address, old, new) of every byte that differs from snapshot.
+
+        Only allocated pages can differ, and each of those that still equals
+        its copy in the snapshot is skipped with a single comparison.
+        """
+        changed = []
+        for index in sorted(set(self.pages) | set(snapshot.pages)):
+            page = self.pages.get(index)
+            old = snapshot.pages.get(index)
+            if page is None or old is None or page != old:
+                start = index << PAGE_BITS
+                for i in range(PAGE_SIZE):
+                    a = self._read(start + i)
+                    b = old[i] if old is not None else self._unwritten(start + i)
+                    if a != b:
+                        changed.append((start + i, b, a))
+        return changed
+
+    def _unwritten(self, address):
+        if self.backing is not None and address < len(self.backing):
+            return self.backing[address]
+        return self.fill
@@ -0,0 +1,196 @@
+from collections import Counter, defaultdict
+
+from .computer import ALU_CYCLES
+from .roms import ALUO, SPI_FLAGS, HALT
+
+# The State enum in cu.sv, in order, so the RTL's cu_state indexes it
+CU_STATES = [
+    "UPDATE_SPI",
+    "UPDATE_IR",
+    "FLAGS_1",
+    "FLAGS_1_ALU",
+    "FLAGS_1_SPI",
+    "FLAGS_1_EVENTS",
+    "FLAGS_2",
+    "FLAGS_2_ALU",
+    "FLAGS_2_SPI",
+    "FLAGS_2_EVENTS",
+]
+SPI_STATES = {"UPDATE_SPI", "FLAGS_1_SPI", "FLAGS_2_SPI"}
+ALU_STATES = {"FLAGS_1_ALU", "FLAGS_2_ALU"}
+
+
+def spi_bytes(address_24bit=False):
+    # Command, address and data bytes of one transaction
+    return 5 if address_24bit else 4
+
+
+def instruction_states(roms, ir, spi_cycles):
+    """The (state, cycles) the CU goes through to run opcode ir."""
+    states = [("UPDATE_SPI", spi_cycles), ("UPDATE_IR", 1)]
+    for half, flags in (("1", roms.flags_1[ir]), ("2", roms.flags_2[ir])):
+        states.append(("FLAGS_" + half, 1))
+        if flags & HALT:
+            break
+        if flags & ALUO:
+            states.append(("FLAGS_%s_ALU" % half, ALU_CYCLES))
+        if flags & SPI_FLAGS:
+            states.append(("FLAGS_%s_SPI" % half, spi_cycles))
+        states.append(("FLAGS_%s_EVENTS" % half, 1))
+    return states
+
+
+class Profile:
+    """Clock cycles spent in each CU state, per instruction address.
+
+    Filled in either from the emulator (profile_run()) or by sampling the
+    RTL's cu_state every clock (test_full.run(profile=...)). Reports take an
+    assembler DebugInfo to name addresses by source line.
+    """
+
+    def __init__(self, address_24bit=False):
+        self.address_24bit = address_24bit
+        self.executed = Counter()
+        self.states = defaultdict(Counter)
+        self.transactions = Counter()
+
+    def add(self, pc, state, cycles=1, entered=True):
+        self.states[pc][state] += cycles
+        if entered:
+            if state == "UPDATE_SPI":
+                self.executed[pc] += 1
+            if state in SPI_STATES:
+                self.transactions[pc] += 1
+
+    def cycles(self, pc=None):
+        if pc is None:
+            return sum(self.cycles(x) for x in self.states)
+        return sum(self.states[pc].values())
+
+    def alu_stalls(self, pc):
+        return sum(self.states[pc][x] for x in ALU_STATES)
+
+    def spi_bytes(self, pc):
+        return self.transactions[pc] * spi_bytes(self.address_24bit)
+
+    def state_totals(self):
+        totals = Counter()
+        for states in self.states.values():
+            totals.update(states)
+        return totals
+
+    def by_line(self, debug_info):
+        """Cycles per source line, addresses without a line are left out."""
+        lines = Counter()
+        for pc in self.states:
+            ln = debug_info.line(pc)
+            if ln is not None:
+                lines[ln] += self.cycles(pc)
+        return lines
+
+    def report(self, debug_info=None, top=20):
+        total = self.cycles() or 1
+        lines = [
+            "%d instructions, %d cycles, %d SPI bytes"
+            % (
+                sum(self.executed.values()),
+                self.cycles(),
+                sum(self.spi_bytes(x) for x in self.states),
+            ),
+            "",
+            "  addr  line     count     cycles      %   spi bytes  alu stall",
+        ]
+        hottest = sorted(self.states, key=self.cycles, reverse=True)[:top]
+        for pc in hottest:
+            ln = debug_info.line(pc) if debug_info else None
+            text = debug_info.text(pc) if debug_info else ""
+            lines.append(
+                "  %04x  %4s  %8d  %9d  %5.1f  %10d  %9d  %s"
+                % (
+                    pc,
+                    ln or "",
+                    self.executed[pc],
+                    self.cycles(pc),
+                    100 * self.cycles(pc) / total,
+                    self.spi_bytes(pc),
+                    self.alu_stalls(pc),
+                    text,
+                )
+            )
+        if debug_info is not None:
+            lines.append("")
+            lines.append("Source lines:")
+            lines.append("  line     count     cycles      %  text")
+            by_line = self.by_line(debug_info)
+            executed = Counter()
+            text = {}
+            for pc in self.states:
+                ln = debug_info.line(pc)
+                if ln is not None:
+                    executed[ln] += self.executed[pc]
+                    text[ln] = debug_info.text(pc)
+            for ln, cycles in by_line.most_common(top):
+                lines.append(
+                    "  %4d  %8d  %9d  %5.1f  %s"
+                    % (ln, executed[ln], cycles, 100 * cycles / total, text[ln])
+                )
+        lines.append("")
+        lines.append("CU states:")
+        totals = self.state_totals()
+        for state in CU_STATES:
+            if totals[state]:
+                lines.append(
+                    "  %-16s %10d  %5.1f%%"
+                    % (state, totals[state], 100 * totals[state] / total)
+                )
+        return "\n".join(lines)
+
+    def folded(self, debug_info=None, name="program"):
+        """Folded stacks for flamegraph.pl/speedscope, one line per
+        program;label;instruction;state with its cycles."""
+        stacks = Counter()
+        for pc, states in self.states.items():
+            frames = [name]
+            if debug_info is not None:
+                frames.append(debug_info.label(pc) or "start")
+                text = debug_info.text(pc)
+                ln = debug_info.line(pc)
+                frames.append("%s %s" % (ln, text) if ln else "%04x" % pc)
+            else:
+                frames.append("%04x" % pc)
+            for state, cycles in states.items():
+                frame = ";".join(x.replace(";", ",") for x in frames + [state])
+                stacks[frame] += cycles
+        return "".join("%s %d\n" % x for x in sorted(stacks.items()))
+
+
+def step(computer, profile, cache=None):
+    """Runs one instruction of computer, recording its cycles in profile."""
+    if computer.halted:
+        return False
+    pc = computer.pc
+    ir = computer.rom[pc]
+
+    states = None if cache is None else cache.get(ir)
+    if states is None:
+        states = instruction_states(computer.roms, ir, computer.spi_cycles)
+        if cache is not None:
+            cache[ir] = states
+
+    running = computer.step()
+    for state, cycles in states:
+        profile.add(pc, state, cycles)
+    return running
+
+
+def profile_run(computer, profile=None, cycles=None, instructions=None):
+    """Like Computer.run(), returns the profile of everything it ran."""
+    profile = profile or Profile(computer.address_24bit)
+    cache = {}
+    while not computer.halted:
+        if cycles is not None and computer.cycles >= cycles:
+            break
+        if instructions is not None and computer.instructions >= instructions:
+            break
+        step(computer, profile, cache)
+    return profile
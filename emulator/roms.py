@@ -0,0 +1,74 @@
+from pathlib import Path
+
+from isa import default_isa
+from assembler.images import read_raw, read_image
+
+ROM_DIR = Path(__file__).resolve().parent.parent / "rom"
+
+# CU flag word bits, in the same order as the columns of cu_flags.csv and the
+# input_flags/output_flags split in tt_um_aerox2_jrb8_computer.sv
+IO = 1 << 0
+AO = 1 << 1
+BO = 1 << 2
+CO = 1 << 3
+DO = 1 << 4
+AO2 = 1 << 5
+BO2 = 1 << 6
+CO2 = 1 << 7
+DO2 = 1 << 8
+ROMO = 1 << 9
+RAMO = 1 << 10
+JMPO = 1 << 11
+OI = 1 << 12
+RAMI = 1 << 13
+MARI = 1 << 14
+MPAGEI = 1 << 15
+AI = 1 << 16
+BI = 1 << 17
+CI = 1 << 18
+DI = 1 << 19
+PCC = 1 << 20
+HALT = 1 << 21
+
+ALUO = AO | BO | CO | DO
+SPI_FLAGS = PCC | RAMI | ROMO | RAMO
+
+# Flags driven by the CU while fetching (UPDATE_SPI, UPDATE_IR)
+FETCH_FLAGS = PCC | ROMO
+
+
+def read_mem(path):
+    with open(path, "r") as f:
+        return [int(x, 16) for x in f.read().split()]
+
+
+class Roms:
+    def __init__(self, rom_dir=ROM_DIR, isa=None):
+        rom_dir = Path(rom_dir)
+        if isa is None:
+            self.cu_rom = read_mem(rom_dir / "cu_rom.mem")
+            self.cu_rom_2 = read_mem(rom_dir / "cu_rom_2.mem")
+            self.cu_flag_conv = read_mem(rom_dir / "cu_flag_conv.mem")
+            self.alu_rom = read_mem(rom_dir / "alu_rom.mem")
+        else:
+            self.cu_rom = isa.cu_rom
+            self.cu_rom_2 = isa.cu_rom_2
+            self.cu_flag_conv = isa.cu_flag_conv
+            self.alu_rom = isa.alu_rom
+        self.jmp_rom = read_mem(rom_dir / "jmp_rom.mem")
+
+        # Flag words for both halves of every instruction, as cu.sv looks
+        # them up in FLAGS_1 and FLAGS_2
+        self.flags_1 = [self.cu_flag_conv[x] for x in self.cu_rom]
+        self.flags_2 = [self.cu_flag_conv[x] for x in self.cu_rom_2]
+
+
+_default_roms = None
+
+
+def default_roms():
+    global _default_roms
+    if _default_roms is None:
+        # The jmp rom isn't part of the sheets, the rest comes from isa.bin
+        _default_roms = Roms(isa=default_isa())
+    return _default_roms
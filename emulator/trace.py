@@ -0,0 +1,355 @@
+import sys
+import mmap
+import struct
+import argparse
+from bisect import bisect_left
+from collections import namedtuple
+from pathlib import Path
+
+from .roms import RAMI
+
+TRACE_VERSION = 1
+MAGIC = b"JRB8TRC\x00"
+
+# magic, version, record size, flags (bit 0 is 24 bit addressing)
+HEADER = struct.Struct("<8sHHB3x")
+
+# One record per retired instruction, the state after it ran. pc is the
+# address of the instruction, ram_address and ram_value are only meaningful
+# when write is set.
+RECORD = struct.Struct("<QHBBBBBBBBBBHB")
+Record = namedtuple(
+    "Record",
+    [
+        "cycles",
+        "pc",
+        "opcode",
+        "areg",
+        "breg",
+        "creg",
+        "dreg",
+        "flags",
+        "mar",
+        "mpage",
+        "oreg",
+        "write",
+        "ram_address",
+        "ram_value",
+    ],
+)
+
+# Bits of Record.flags
+ZFLAG = 1 << 0
+OFLAG = 1 << 1
+CFLAG = 1 << 2
+SFLAG = 1 << 3
+CARRY_MODE = 1 << 4
+SIGNED_MODE = 1 << 5
+
+# Everything the program can see, cycles depend on the engine
+ARCH_FIELDS = [x for x in Record._fields if x != "cycles"]
+
+# The cycles of every INDEX_STRIDE'th record go in the .idx next to a trace
+INDEX_STRIDE = 1024
+INDEX = struct.Struct("<Q")
+
+
+def index_path(path):
+    path = Path(path)
+    return path.with_suffix(path.suffix + ".idx")
+
+
+def pack_flags(zflag, oflag, cflag, sflag, carry_mode=False, signed_mode=False):
+    return (
+        (ZFLAG if zflag else 0)
+        | (OFLAG if oflag else 0)
+        | (CFLAG if cflag else 0)
+        | (SFLAG if sflag else 0)
+        | (CARRY_MODE if carry_mode else 0)
+        | (SIGNED_MODE if signed_mode else 0)
+    )
+
+
+def format_flags(flags):
+    return (
+        "".join(
+            x if flags & bit else "-"
+            for x, bit in (("Z", ZFLAG), ("O", OFLAG), ("C", CFLAG), ("S", SFLAG))
+        )
+        + ("c" if flags & CARRY_MODE else "")
+        + ("s" if flags & SIGNED_MODE else "")
+    )
+
+
+def ram_write(roms, opcode, mpage, mar, ram):
+    """(write, address, value) of the RAM write opcode did, if it did one."""
+    if not (roms.flags_1[opcode] | roms.flags_2[opcode]) & RAMI:
+        return 0, 0, 0
+    address = mpage << 8 | mar
+    return 1, address, ram[address]
+
+
+class TraceWriter:
+    """Appends a fixed width record per retired instruction to a trace file.
+
+    Records are only ever appended, so a trace can be read while it's being
+    written and a crash loses at most the buffered tail. Record n is at a
+    fixed offset, and the .idx written alongside finds records by cycle.
+    """
+
+    def __init__(self, path, address_24bit=False):
+        self.path = Path(path)
+        self.address_24bit = address_24bit
+        self.count = 0
+        self.file = open(self.path, "wb")
+        self.file.write(
+            HEADER.pack(MAGIC, TRACE_VERSION, RECORD.size, int(address_24bit))
+        )
+        self.index = open(index_path(self.path), "wb")
+
+    def write(self, record):
+        if self.count % INDEX_STRIDE == 0:
+            self.index.write(INDEX.pack(record[0]))
+        self.file.write(RECORD.pack(*record))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceReader:
+    """Random access to the records of a trace, trace[n] is the n'th
+    instruction that retired."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size or header[: len(MAGIC)] != MAGIC:
+                raise ValueError("%s isn't a trace" % self.path)
+            _, version, size, flags = HEADER.unpack(header)
+            if version != TRACE_VERSION or size != RECORD.size:
+                raise ValueError(
+                    "%s is trace version %d, not %d" % (path, version, TRACE_VERSION)
+                )
+            self.address_24bit = bool(flags & 1)
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # A record still being written is left out
+        self.count = (len(self.data) - HEADER.size) // RECORD.size
+
+        self.index = []
+        if index_path(self.path).exists():
+            data = index_path(self.path).read_bytes()
+            self.index = [x[0] for x in INDEX.iter_unpack(data)]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError("Record %d is outside the trace" % n)
+        return Record._make(
+            RECORD.unpack_from(self.data, HEADER.size + n * RECORD.size)
+        )
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, start=0, stop=None):
+        stop = self.count if stop is None else min(stop, self.count)
+        for offset in range(
+            HEADER.size + start * RECORD.size,
+            HEADER.size + stop * RECORD.size,
+            RECORD.size,
+        ):
+            yield Record._make(RECORD.unpack_from(self.data, offset))
+
+    def find_cycle(self, cycles):
+        """The first record that retired at or after cycles."""
+        # The index narrows it down to one stride of records
+        block = max(bisect_left(self.index, cycles) - 1, 0)
+        n = block * INDEX_STRIDE
+        for record in self.records(n):
+            if record.cycles >= cycles:
+                return n
+            n += 1
+        return n
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def record(computer, pc):
+    """The Record for the instruction at pc that computer just ran."""
+    ir = computer.ir
+    return (
+        computer.cycles,
+        pc,
+        ir,
+        computer.areg,
+        computer.breg,
+        computer.creg,
+        computer.dreg,
+        pack_flags(
+            computer.zflag,
+            computer.oflag,
+            computer.cflag,
+            computer.sflag,
+            computer.carry_mode,
+            computer.signed_mode,
+        ),
+        computer.mar,
+        computer.mpage,
+        computer.oreg,
+        *ram_write(computer.roms, ir, computer.mpage, computer.mar, computer.ram),
+    )
+
+
+def step(computer, writer, inner=None):
+    """Runs one instruction of computer through inner (computer.step by
+    default), recording it in writer."""
+    pc = computer.pc
+    running = (inner or computer.step)()
+    if running:
+        writer.write(record(computer, pc))
+    return running
+
+
+def trace_run(computer, writer, cycles=None, instructions=None):
+    """Like Computer.run(), with every instruction recorded in writer."""
+    while not computer.halted:
+        if cycles is not None and computer.cycles >= cycles:
+            break
+        if instructions is not None and computer.instructions >= instructions:
+            break
+        step(computer, writer)
+    return computer.outputs
+
+
+def first_divergence(a, b, fields=ARCH_FIELDS):
+    """The index of the first record where traces a and b differ in fields,
+    None if they agree. When one trace is a prefix of the other, that's the
+    length of the shorter one."""
+    for n, (x, y) in enumerate(zip(a, b)):
+        if any(getattr(x, f) != getattr(y, f) for f in fields):
+            return n
+    if len(a) != len(b):
+        return min(len(a), len(b))
+    return None
+
+
+def format_record(record, debug_info=None):
+    where = "%04x" % record.pc
+    if debug_info is not None:
+        where = debug_info.symbolize(record.pc)
+    line = "%10d  %02x  A:%02x B:%02x C:%02x D:%02x %-6s MAR:%02x MPAGE:%02x O:%02x" % (
+        record.cycles,
+        record.opcode,
+        record.areg,
+        record.breg,
+        record.creg,
+        record.dreg,
+        format_flags(record.flags),
+        record.mar,
+        record.mpage,
+        record.oreg,
+    )
+    if record.write:
+        line += " RAM[%04x]=%02x" % (record.ram_address, record.ram_value)
+    return "%s  %s" % (line, where)
+
+
+def diff_report(a, b, fields=ARCH_FIELDS, context=3, debug_info=None):
+    """Describes where traces a and b first diverge, None if they don't."""
+    n = first_divergence(a, b, fields)
+    if n is None:
+        return None
+
+    lines = ["Traces diverge at instruction %d" % n]
+    for record in (a[x] for x in range(max(n - context, 0), n)):
+        lines.append("   " + format_record(record, debug_info))
+    for name, trace in (("a", a), ("b", b)):
+        if n < len(trace):
+            lines.append("%s: %s" % (name, format_record(trace[n], debug_info)))
+        else:
+            lines.append("%s: ended after %d instructions" % (name, len(trace)))
+    if n < len(a) and n < len(b):
+        differing = [f for f in fields if getattr(a[n], f) != getattr(b[n], f)]
+        lines.append("Differs in " + ", ".join(differing))
+    return "\n".join(lines)
+
+
+def _debug_info(path):
+    if path is None:
+        return None
+    from assembler import DebugInfo
+
+    return DebugInfo.load(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Show instruction traces or find where two of them diverge"
+    )
+    parser.add_argument(
+        "--debug", "-g", type=Path, help="A .jdbg to name addresses by source line"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    show = commands.add_parser("show", help="Print the records of a trace")
+    show.add_argument("trace", type=Path)
+    show.add_argument("--start", type=int, default=0, help="First record to show")
+    show.add_argument(
+        "--cycle", type=int, help="Start at the instruction running at this cycle"
+    )
+    show.add_argument("--count", "-n", type=int, default=20)
+
+    diff = commands.add_parser("diff", help="Find the first divergence of two traces")
+    diff.add_argument("a", type=Path)
+    diff.add_argument("b", type=Path)
+    diff.add_argument(
+        "--cycles", action="store_true", help="Cycle counts have to match too"
+    )
+    diff.add_argument(
+        "--context", type=int, default=3, help="Agreeing records to show before it"
+    )
+    args = parser.parse_args(argv)
+    debug_info = _debug_info(args.debug)
+
+    if args.command == "show":
+        with TraceReader(args.trace) as trace:
+            start = args.start
+            if args.cycle is not None:
+                start = trace.find_cycle(args.cycle)
+            for n, record in enumerate(trace.records(start, start + args.count)):
+                print("%8d  %s" % (start + n, format_record(record, debug_info)))
+        return 0
+
+    fields = Record._fields if args.cycles else ARCH_FIELDS
+    with TraceReader(args.a) as a, TraceReader(args.b) as b:
+        report = diff_report(a, b, fields, args.context, debug_info)
+        if report is None:
+            print("Traces agree on all %d instructions" % len(a))
+            return 0
+        print(report)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
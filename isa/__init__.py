@@ -0,0 +1,22 @@
+from .isa import (
+    InstructionSet,
+    IsaError,
+    build,
+    cross_check,
+    mem_tables,
+    write_mems,
+    load,
+    save,
+    default_isa,
+    source_hash,
+    ARTIFACT,
+    ROM_DIR,
+    CU_FLAGS,
+    ALU_FLAGS,
+    ALU_SV,
+    MEM_TABLES,
+    KNOWN_DISAGREEMENTS,
+    FLAG_NAMES,
+    ALU_BITS,
+    VERSION,
+)
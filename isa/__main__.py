@@ -0,0 +1,66 @@
+import sys
+import argparse
+
+from .isa import (
+    build,
+    cross_check,
+    load,
+    save,
+    source_hash,
+    write_mems,
+    IsaError,
+    CU_FLAGS,
+    ALU_FLAGS,
+    ALU_SV,
+    ARTIFACT,
+    ROM_DIR,
+)
+
+parser = argparse.ArgumentParser(
+    description="Build the instruction set artifact and the ROM images the RTL "
+    "loads from the flag spreadsheets, writing only what changed"
+)
+parser.add_argument("--cu-flags", default=CU_FLAGS, help="CU flags spreadsheet")
+parser.add_argument("--alu-flags", default=ALU_FLAGS, help="ALU flags spreadsheet")
+parser.add_argument("--output", "-o", default=ARTIFACT, help="Artifact to write")
+parser.add_argument(
+    "--rom-dir", default=ROM_DIR, help="Where to write the .mem ROM images"
+)
+parser.add_argument("--alu-sv", default=ALU_SV, help="ALU RTL to cross check against")
+parser.add_argument(
+    "--strict",
+    action="store_true",
+    help="Fail when the sheets disagree with the ALU RTL or the artifact "
+    "wasn't built from them",
+)
+args = parser.parse_args()
+
+try:
+    isa = build(args.cu_flags, args.alu_flags)
+except IsaError as e:
+    print(e)
+    sys.exit(1)
+
+problems = cross_check(isa, args.alu_sv)
+if args.strict:
+    # Only checked here, default_isa() trusts the artifact
+    try:
+        source = load(args.output).source
+    except (OSError, IsaError):
+        source = None
+    if source != source_hash(args.cu_flags, args.alu_flags):
+        problems.append("%s wasn't built from the sheets" % args.output)
+for problem in problems:
+    print("Warning: %s" % problem)
+if problems and args.strict:
+    sys.exit(1)
+
+if save(isa, args.output):
+    print("Wrote %s (%s)" % (args.output, isa.hash))
+else:
+    print("%s is up to date (%s)" % (args.output, isa.hash))
+written = write_mems(isa, args.rom_dir)
+for path in written:
+    print("Wrote %s" % path)
+if not written:
+    print("ROM images in %s are up to date" % args.rom_dir)
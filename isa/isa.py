@@ -0,0 +1,359 @@
+import re
+import csv
+import struct
+import hashlib
+import functools
+from pathlib import Path
+
+ROM_DIR = Path(__file__).resolve().parent.parent / "rom"
+
+CU_FLAGS = ROM_DIR / "cu_flags.csv"
+ALU_FLAGS = ROM_DIR / "alu_flags.csv"
+ARTIFACT = ROM_DIR / "isa.bin"
+ALU_SV = ROM_DIR.parent / "src" / "alu.sv"
+
+# The flag columns of each half in cu_flags.csv, in the order of their bits
+# in a flag word
+FLAG_NAMES = [
+    "IO",
+    "AO",
+    "BO",
+    "CO",
+    "DO",
+    "AO2",
+    "BO2",
+    "CO2",
+    "DO2",
+    "ROMO",
+    "RAMO",
+    "JMPO",
+    "OI",
+    "RAMI",
+    "MARI",
+    "MPAGEI",
+    "AI",
+    "BI",
+    "CI",
+    "DI",
+    "PCC",
+    "HALT",
+]
+ALU_USE = ["AO", "BO", "CO", "DO"]
+
+# The bit columns of alu_flags.csv, CSELECT goes above them
+ALU_BITS = ["ZA", "IA", "ZB", "IB", "IO", "PO", "HIGH", "CMP"]
+
+# Opcodes cross_check() already knows disagree with alu.sv, left out so only
+# new disagreements fail. opp clr never starts the ALU, so in the RTL it
+# doesn't clear the flags
+KNOWN_DISAGREEMENTS = {0x50}
+
+# The tables the RTL loads with $readmemh, written to <name>.mem
+MEM_TABLES = ["cu_rom", "cu_rom_2", "cu_flag_conv", "alu_rom"]
+
+MAGIC = b"JRB8ISA\0"
+VERSION = 1
+
+# magic, version, hash of the source sheets, hash of the payload
+HEADER = struct.Struct("<8sH32s32s")
+
+
+class IsaError(Exception):
+    pass
+
+
+class InstructionSet:
+    """Everything the tools need to know about the 256 opcodes.
+
+    cu_rom and cu_rom_2 index into cu_flag_conv for the flag words of the
+    two halves of each instruction, alu_rom has the ALU control word and
+    templates the assembler syntax, "" for unused opcodes.
+    """
+
+    def __init__(self, cu_rom, cu_rom_2, cu_flag_conv, alu_rom, templates, source):
+        self.cu_rom = cu_rom
+        self.cu_rom_2 = cu_rom_2
+        self.cu_flag_conv = cu_flag_conv
+        self.alu_rom = alu_rom
+        self.templates = templates
+        self.source = source
+
+        self.flags_1 = [cu_flag_conv[x] for x in cu_rom]
+        self.flags_2 = [cu_flag_conv[x] for x in cu_rom_2]
+
+    def to_bytes(self):
+        templates = "\0".join(self.templates).encode()
+        payload = b"".join(
+            [
+                bytes(self.cu_rom),
+                bytes(self.cu_rom_2),
+                struct.pack("<B", len(self.cu_flag_conv)),
+                struct.pack(f"<{len(self.cu_flag_conv)}I", *self.cu_flag_conv),
+                struct.pack("<256H", *self.alu_rom),
+                struct.pack("<H", len(templates)),
+                templates,
+            ]
+        )
+        digest = hashlib.sha256(payload).digest()
+        return HEADER.pack(MAGIC, VERSION, self.source, digest) + payload
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise IsaError("Instruction set artifact is truncated")
+        magic, version, source, digest = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise IsaError("Not an instruction set artifact")
+        if version != VERSION:
+            raise IsaError(
+                "Instruction set artifact is version %d, not %d" % (version, VERSION)
+            )
+
+        payload = data[HEADER.size :]
+        if hashlib.sha256(payload).digest() != digest:
+            raise IsaError("Instruction set artifact is corrupt")
+
+        cu_rom = list(payload[0:256])
+        cu_rom_2 = list(payload[256:512])
+        count = payload[512]
+        offset = 513
+        cu_flag_conv = list(struct.unpack_from(f"<{count}I", payload, offset))
+        offset += 4 * count
+        alu_rom = list(struct.unpack_from("<256H", payload, offset))
+        offset += 512
+        (length,) = struct.unpack_from("<H", payload, offset)
+        offset += 2
+        templates = payload[offset : offset + length].decode().split("\0")
+
+        return cls(cu_rom, cu_rom_2, cu_flag_conv, alu_rom, templates, source)
+
+    @property
+    def hash(self):
+        """Content hash of the instruction set, changes whenever any table does."""
+        return hashlib.sha256(self.to_bytes()[HEADER.size :]).hexdigest()[:16]
+
+
+def source_hash(cu_flags=CU_FLAGS, alu_flags=ALU_FLAGS):
+    h = hashlib.sha256()
+    for path in (cu_flags, alu_flags):
+        h.update(Path(path).read_bytes())
+    return h.digest()
+
+
+def _columns(header, name):
+    return [i for i, x in enumerate(header) if x == name]
+
+
+def _column(header, name, n=0, sheet="cu_flags.csv"):
+    # The n'th column called name
+    columns = _columns(header, name)
+    if len(columns) <= n:
+        raise IsaError("%s has no column %s" % (sheet, name))
+    return columns[n]
+
+
+def _marked(row, columns):
+    # The word with a bit set for every column marked with an x
+    return sum(1 << i for i, x in enumerate(columns) if row[x].strip())
+
+
+def _hex(value):
+    return int(value, 16) if value.strip() else 0
+
+
+def _read_sheet(path):
+    with open(path, "r", newline="") as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+
+def build(cu_flags=CU_FLAGS, alu_flags=ALU_FLAGS):
+    """Parses the spreadsheets into an InstructionSet.
+
+    Columns are found by their headers. Raises IsaError listing every row
+    whose flag word doesn't match the flags marked in it, or whose CU
+    VALUE doesn't index that word in UNIQUE VALUES, and every repeated
+    UNIQUE VALUES entry.
+    """
+    header, rows = _read_sheet(cu_flags)
+    problems = []
+
+    # Each half of the instruction has its flags, the word they make
+    # (headed FIRST in both) and its index in UNIQUE VALUES
+    halves = [
+        (
+            [_column(header, x, n) for x in FLAG_NAMES],
+            _column(header, "FIRST", n),
+            _column(header, "CU VALUE", n),
+        )
+        for n in range(2)
+    ]
+    unique = _column(header, "UNIQUE VALUES")
+    assembler = _column(header, "ASSEMBLER INST")
+
+    cu_flag_conv = [int(row[unique], 16) for row in rows if row[unique].strip()]
+    seen = set()
+    for word in cu_flag_conv:
+        if word in seen:
+            problems.append("UNIQUE VALUES has %X more than once" % word)
+        seen.add(word)
+    if len(cu_flag_conv) > 256:
+        problems.append("%d UNIQUE VALUES don't fit a byte" % len(cu_flag_conv))
+
+    roms = []
+    for n, (flags, word, value) in enumerate(halves):
+        rom = []
+        for opcode, row in enumerate(rows):
+            marked = _marked(row, flags)
+            if _hex(row[word]) != marked:
+                problems.append(
+                    "%02X half %d: flags marked are %X, FIRST is %s"
+                    % (opcode, n + 1, marked, row[word])
+                )
+            index = _hex(row[value])
+            if index >= len(cu_flag_conv) or cu_flag_conv[index] != marked:
+                problems.append(
+                    "%02X half %d: CU VALUE %X isn't the index of %X"
+                    % (opcode, n + 1, index, marked)
+                )
+            rom.append(index)
+        roms.append(rom)
+    cu_rom, cu_rom_2 = roms
+    templates = [row[assembler] for row in rows]
+
+    header, rows = _read_sheet(alu_flags)
+    bits = [_column(header, x, sheet="alu_flags.csv") for x in ALU_BITS]
+    cselect = _column(header, "CSELECT", sheet="alu_flags.csv")
+    final = _column(header, "FINAL", sheet="alu_flags.csv")
+    alu_rom = []
+    for opcode, row in enumerate(rows):
+        marked = _marked(row, bits) | _hex(row[cselect]) << len(ALU_BITS)
+        if _hex(row[final]) != marked:
+            problems.append(
+                "%02X: ALU bits marked are %X, FINAL is %s"
+                % (opcode, marked, row[final])
+            )
+        alu_rom.append(_hex(row[final]))
+
+    if not len(cu_rom) == len(alu_rom) == 256:
+        problems.append("Expected 256 opcodes in both sheets")
+    if problems:
+        raise IsaError("\n".join(problems))
+
+    return InstructionSet(
+        cu_rom,
+        cu_rom_2,
+        cu_flag_conv,
+        alu_rom,
+        templates,
+        source_hash(cu_flags, alu_flags),
+    )
+
+
+def _alu_decoding(path):
+    # The width of alu_rom and the opcodes alu.sv compares cins against
+    text = Path(path).read_text()
+    width = re.search(r"reg \[(\d+):0\] alu_rom", text)
+    opcodes = {
+        name: int(value, 16)
+        for name, value in re.findall(r"localparam (\w+_INS) = 'h(\w+);", text)
+    }
+    return int(width.group(1)) + 1 if width else None, opcodes
+
+
+def cross_check(isa, alu_sv=ALU_SV, known=KNOWN_DISAGREEMENTS):
+    """Compares the ALU words and the CU flags of the opcodes alu.sv decodes
+    itself against what alu.sv does with them. Returns a description of
+    every disagreement not in known, no list when alu.sv isn't there to
+    check."""
+    if not Path(alu_sv).exists():
+        return []
+    width, opcodes = _alu_decoding(alu_sv)
+    problems = []
+    if width is not None:
+        for opcode, word in enumerate(isa.alu_rom):
+            if word >> width and opcode not in known:
+                problems.append(
+                    "%02X: ALU word %X is wider than alu_rom's %d bits"
+                    % (opcode, word, width)
+                )
+
+    uses_alu = sum(1 << FLAG_NAMES.index(x) for x in ALU_USE)
+    for name, opcode in sorted(opcodes.items(), key=lambda x: x[1]):
+        if opcode in known:
+            continue
+        starts = (isa.flags_1[opcode] | isa.flags_2[opcode]) & uses_alu
+        if name == "CLR_CMP_INS" and not starts:
+            # Only acts on the flags in INVERT
+            problems.append(
+                "%02X (%s): alu.sv clears the flags while it runs, but the CU "
+                "never starts the ALU for it" % (opcode, isa.templates[opcode])
+            )
+        elif name != "CLR_CMP_INS" and starts:
+            # Only latched in IDLE, where it takes the place of start
+            problems.append(
+                "%02X (%s): alu.sv latches the mode while idle, but the CU "
+                "starts the ALU for it" % (opcode, isa.templates[opcode])
+            )
+    return problems
+
+
+def mem_tables(isa):
+    """The ROM tables the RTL loads, by .mem file name."""
+    return {name: getattr(isa, name) for name in MEM_TABLES}
+
+
+def _read_mem_text(text):
+    return [int(x, 16) for x in text.split()]
+
+
+def write_if_changed(path, data):
+    """Writes data to path through a temporary file, unless path already
+    holds it. Returns whether it wrote."""
+    path = Path(path)
+    if path.exists() and path.read_bytes() == data:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    return True
+
+
+def write_mems(isa, rom_dir=ROM_DIR):
+    """Writes the tables to <name>.mem in rom_dir for $readmemh.
+
+    A .mem that already has the same values is left as it is, whatever its
+    spacing, so its timestamp only moves when its contents do. Returns the
+    paths written.
+    """
+    written = []
+    for name, values in mem_tables(isa).items():
+        path = Path(rom_dir) / ("%s.mem" % name)
+        if path.exists() and _read_mem_text(path.read_text()) == list(values):
+            continue
+        write_if_changed(path, " ".join("%X" % x for x in values).encode())
+        written.append(path)
+    return written
+
+
+def save(isa, path=ARTIFACT):
+    return write_if_changed(path, isa.to_bytes())
+
+
+def load(path=ARTIFACT):
+    return InstructionSet.from_bytes(Path(path).read_bytes())
+
+
+@functools.lru_cache(maxsize=None)
+def default_isa():
+    """The instruction set from rom/isa.bin, loaded once per process.
+
+    The sheets are only parsed when the artifact is missing. Rebuild it with
+    `python -m isa` after editing them, `python -m isa --strict` fails while
+    it is stale.
+    """
+    try:
+        return load()
+    except (OSError, IsaError):
+        return build()
@@ -1,16 +1,13 @@
 import sys
 from pathlib import Path
 
-f = open(sys.argv[1], "r").readlines()
-j = []
-for line in f[1:]:
-    for g in line.split(" "):
-        if "*" in g:
-            q = [int(g.split("*")[1], 16)] * int(g.split("*")[0])
-            j.extend(q)
-        else:
-            q = int(g, 16)
-            j.append(q)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from assembler import read_image
+
+# Any image the assembler writes (.o, .bin or .hex) to a 256 entry
+# $readmemh file
+j = read_image(sys.argv[1])
 
 o = [hex(x)[2:] for x in j]
 po = o + ["0"] * (256 - len(o))
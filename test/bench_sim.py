@@ -0,0 +1,98 @@
+import sys
+import shutil
+import argparse
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from runner import TEST_DIR, SIMULATORS, find_shards, run_shards
+
+# Matches the Clock in test_full.setup()
+CLOCK_PERIOD_NS = 10000
+
+TOOLS = {"icarus": "iverilog", "verilator": "verilator"}
+
+
+def shard_speed(shard):
+    # cocotb's own timings leave out simulator start up and elaboration
+    if shard.results is None or not shard.results.exists():
+        return None
+    testcase = ET.parse(shard.results).getroot().find(".//testcase")
+    if testcase is None or testcase.find("failure") is not None:
+        return None
+
+    cycles = float(testcase.get("sim_time_ns")) / CLOCK_PERIOD_NS
+    return cycles, float(testcase.get("time"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare simulated cycles per second of each simulator on the example programs"
+    )
+    parser.add_argument("--sims", nargs="+", choices=SIMULATORS, default=SIMULATORS)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Parallel simulators, more than one skews the timings",
+    )
+    parser.add_argument(
+        "--build-dir", type=Path, default=TEST_DIR / "sim_build_parallel"
+    )
+    parser.add_argument(
+        "-k", dest="pattern", help="Only run tests whose name contains this"
+    )
+    args = parser.parse_args()
+
+    sims = [x for x in args.sims if shutil.which(TOOLS[x])]
+    for sim in args.sims:
+        if sim not in sims:
+            print(f"Skipping {sim}, {TOOLS[sim]} is not installed")
+    if not sims:
+        return 1
+
+    speeds = {}
+    for sim in sims:
+        print(f"Running on {sim}")
+        shards = find_shards(["test_full"], args.pattern)
+        run_shards(shards, args.build_dir.resolve(), sim, args.jobs)
+        speeds[sim] = {x.name: shard_speed(x) for x in shards}
+
+    names = list(speeds[sims[0]])
+    print()
+    print("%-40s %10s" % ("test", "cycles") + "".join("%14s" % x for x in sims))
+
+    totals = {x: [0, 0] for x in sims}
+    for name in names:
+        cycles = None
+        row = ""
+        for sim in sims:
+            speed = speeds[sim].get(name)
+            if speed is None:
+                row += "%14s" % "failed"
+                continue
+            cycles = speed[0]
+            row += "%14.0f" % (speed[0] / speed[1])
+            totals[sim][0] += speed[0]
+            totals[sim][1] += speed[1]
+        print("%-40s %10s" % (name, "-" if cycles is None else "%.0f" % cycles) + row)
+
+    print(
+        "%-40s %10s" % ("total", "")
+        + "".join("%14.0f" % (c / t if t else 0) for c, t in totals.values())
+    )
+
+    base = totals[sims[0]]
+    for sim in sims[1:]:
+        c, t = totals[sim]
+        if t and base[1]:
+            print(
+                "%s runs at %.2fx the speed of %s"
+                % (sim, (c / t) / (base[0] / base[1]), sims[0])
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,452 @@
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+TEST_DIR = Path(__file__).resolve().parent
+ROOT = TEST_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+from isa import default_isa
+from assembler.assembler import emit, NUMBER, LABEL
+from emulator import Computer, CU_STATES, default_roms
+from emulator.profile import instruction_states
+from emulator.roms import JMPO, RAMI, RAMO
+
+HALT = 0xFF
+
+# Operands most likely to find carries, overflows and sign bugs
+CORNERS = [0x00, 0x01, 0x7F, 0x80, 0x81, 0xFE, 0xFF]
+
+# Coverage features are ints, the kind in the bits above the opcode
+OPCODE_FLAGS = 0 << 16
+JUMP = 1 << 16
+PAGED = 2 << 16
+EDGE = 3 << 16
+
+
+class Program:
+    """A fuzzed program, instructions are (opcode, operand) with operand
+    None, a number, or for {label} templates the index of the instruction
+    jumped to (len(instructions) is the halt at the end)."""
+
+    def __init__(self, instructions, inputs=()):
+        self.instructions = list(instructions)
+        self.inputs = list(inputs)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def _assembled(self):
+        # The assembler's own (line, opcode, operand) and labels
+        labels = {}
+        assembled = []
+        address = 0
+        for i, (opcode, operand) in enumerate(self.instructions):
+            labels["l%d" % i] = address
+            if isinstance(operand, tuple):
+                assembled.append((i, opcode, "l%d" % operand[0]))
+                address += 3
+            else:
+                assembled.append((i, opcode, operand))
+                address += 1 if operand is None else 2
+        labels["l%d" % len(self)] = address
+        assembled.append((len(self), HALT, None))
+        return assembled, labels
+
+    def image(self):
+        return emit(*self._assembled())
+
+    def source(self, templates):
+        targets = {x[1][0] for x in self.instructions if isinstance(x[1], tuple)}
+        lines = []
+        for i, (opcode, operand) in enumerate(self.instructions + [(HALT, None)]):
+            if i in targets:
+                lines.append(":l%d" % i)
+            line = templates[opcode]
+            if isinstance(operand, tuple):
+                line = line.replace(LABEL, "l%d" % operand[0])
+            elif operand is not None:
+                line = line.replace(NUMBER, str(operand))
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    def without(self, start, stop):
+        """A copy with instructions[start:stop] removed, jumps into them land
+        on whatever follows."""
+        removed = stop - start
+        instructions = []
+        for opcode, operand in self.instructions[:start] + self.instructions[stop:]:
+            if isinstance(operand, tuple):
+                target = operand[0]
+                if target >= stop:
+                    target -= removed
+                elif target > start:
+                    target = start
+                operand = (target,)
+            instructions.append((opcode, operand))
+        return Program(instructions, self.inputs)
+
+
+class Generator:
+    """Random instructions from the ISA's templates, a kind of instruction
+    (mov, jmp, load...) is picked first so the 100 or so opp variants don't
+    drown out the jumps and memory instructions."""
+
+    def __init__(self, isa, rng):
+        self.rng = rng
+        self.templates = isa.templates
+        self.kinds = {}
+        for opcode, template in enumerate(isa.templates):
+            if template and opcode != HALT:
+                self.kinds.setdefault(template.split()[0], []).append(opcode)
+        self.kind_names = sorted(self.kinds)
+
+    def number(self):
+        if self.rng.random() < 0.5:
+            return self.rng.choice(CORNERS)
+        return self.rng.randrange(256)
+
+    def instruction(self, length):
+        opcode = self.rng.choice(self.kinds[self.rng.choice(self.kind_names)])
+        template = self.templates[opcode]
+        if LABEL in template:
+            return opcode, (self.rng.randrange(length + 1),)
+        if NUMBER in template:
+            return opcode, self.number()
+        return opcode, None
+
+    def program(self, length):
+        instructions = [self.instruction(length) for _ in range(length)]
+        inputs = [self.number() for _ in range(self.rng.randrange(1, 8))]
+        return Program(instructions, inputs)
+
+    def mutate(self, program, corpus):
+        instructions = list(program.instructions)
+        inputs = list(program.inputs)
+        length = len(instructions)
+        for _ in range(self.rng.randrange(1, 4)):
+            choice = self.rng.randrange(6)
+            i = self.rng.randrange(length) if length else 0
+            if choice == 0 and length:
+                instructions[i] = self.instruction(length)
+            elif choice == 1:
+                instructions.insert(i, self.instruction(length + 1))
+                length += 1
+            elif choice == 2 and length > 1:
+                return Program(instructions, inputs).without(i, i + 1)
+            elif choice == 3 and length and instructions[i][1] is not None:
+                opcode, operand = instructions[i]
+                if isinstance(operand, tuple):
+                    operand = (self.rng.randrange(length + 1),)
+                else:
+                    operand = self.number()
+                instructions[i] = (opcode, operand)
+            elif choice == 4 and corpus:
+                # Splice in part of another interesting program
+                other = self.rng.choice(corpus).instructions
+                start = self.rng.randrange(len(other) + 1)
+                part = other[start : start + self.rng.randrange(1, 9)]
+                part = [
+                    (x, (min(y[0], length),) if isinstance(y, tuple) else y)
+                    for x, y in part
+                ]
+                instructions[i:i] = part
+                length += len(part)
+            else:
+                inputs = [self.number() for _ in range(self.rng.randrange(1, 8))]
+        return Program(instructions, inputs)
+
+
+class Coverage:
+    """Everything a run exercised: opcodes with the flags and ALU modes they
+    ran under, jumps taken and not taken, RAM accesses off page 0 and the CU
+    state transitions the instructions went through."""
+
+    def __init__(self, roms=None):
+        self.roms = roms or default_roms()
+        self.seen = set()
+        self._edges = {}
+        self._jumps = set()
+        self._memory = set()
+        for opcode in range(256):
+            flags = self.roms.flags_1[opcode] | self.roms.flags_2[opcode]
+            if flags & JMPO:
+                self._jumps.add(opcode)
+            if flags & (RAMI | RAMO):
+                self._memory.add(opcode)
+
+    def edges(self, opcode):
+        # The CU goes through the same states for an opcode every time
+        edges = self._edges.get(opcode)
+        if edges is None:
+            states = [x for x, _ in instruction_states(self.roms, opcode, 1)]
+            if states[-1] != "FLAGS_1":
+                # Back to fetching, unless it halted
+                states.append("UPDATE_SPI")
+            edges = set()
+            for a, b in zip(states, states[1:]):
+                edges.add(EDGE | CU_STATES.index(a) << 4 | CU_STATES.index(b))
+            self._edges[opcode] = edges
+        return edges
+
+    def run(self, computer, steps):
+        """Runs computer for up to steps instructions, returns its features."""
+        features = set()
+        jumps = self._jumps
+        memory = self._memory
+        rom = computer.rom
+        while computer.instructions < steps:
+            pc = computer.pc
+            opcode = rom[pc]
+            features.add(
+                OPCODE_FLAGS
+                | opcode << 6
+                | computer.zflag
+                | computer.oflag << 1
+                | computer.cflag << 2
+                | computer.sflag << 3
+                | computer.carry_mode << 4
+                | computer.signed_mode << 5
+            )
+            if opcode in memory and computer.mpage:
+                features.add(PAGED | opcode)
+            running = computer.step()
+            features.update(self.edges(opcode))
+            if not running:
+                break
+            if opcode in jumps:
+                taken = not pc < computer.pc <= pc + 3
+                features.add(JUMP | opcode << 1 | taken)
+        return features
+
+    def add(self, features):
+        """Adds features, returns how many weren't seen before."""
+        new = features - self.seen
+        self.seen |= new
+        return len(new)
+
+    def summary(self):
+        kinds = {}
+        for x in self.seen:
+            kinds[x >> 16] = kinds.get(x >> 16, 0) + 1
+        opcodes = {x >> 6 & 0xFF for x in self.seen if x >> 16 == 0}
+        jumps = len(self._jumps) * 2
+        return (
+            "%d opcodes (%d with flags), %d of %d jump outcomes, %d paged RAM "
+            "accesses, %d CU transitions"
+            % (
+                len(opcodes),
+                kinds.get(0, 0),
+                kinds.get(1, 0),
+                jumps,
+                kinds.get(2, 0),
+                kinds.get(3, 0),
+            )
+        )
+
+
+def emulate(program, steps):
+    """A failure of program on the fast model, None if there isn't one."""
+    try:
+        computer = Computer(program.image(), False, program.inputs)
+        computer.run(instructions=steps)
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+    return None
+
+
+def minimize(program, still_fails):
+    """Delta debugs program down to the fewest instructions that still fail.
+
+    still_fails(candidates) returns the first of a list of programs that
+    still fails, or None, so a slow engine can try a whole round at once.
+    """
+    chunks = 2
+    while len(program) >= 2:
+        size = -(-len(program) // chunks)
+        candidates = [
+            program.without(x, x + size) for x in range(0, len(program), size)
+        ]
+        found = still_fails(candidates)
+        if found is not None:
+            program = found
+            chunks = max(chunks - 1, 2)
+        elif chunks >= len(program):
+            break
+        else:
+            chunks = min(chunks * 2, len(program))
+
+    # Then make every number as plain as it can be
+    for i, (opcode, operand) in enumerate(program.instructions):
+        if operand is None or isinstance(operand, tuple) or operand == 0:
+            continue
+        instructions = list(program.instructions)
+        instructions[i] = (opcode, 0)
+        found = still_fails([Program(instructions, program.inputs)])
+        if found is not None:
+            program = found
+    return program
+
+
+def write_case(directory, name, program, templates, steps):
+    """Writes name.j and a golden.py expectation (name.e) of what the fast
+    model does with it, so golden.py can run it on any engine."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    computer = Computer(program.image(), False, program.inputs)
+    computer.run(instructions=steps)
+    # Programs that don't halt only have to match the outputs they got to
+    count = computer.instructions if computer.halted else -1
+    outputs = computer.outputs
+    if not computer.halted:
+        outputs = outputs[:64]
+    (directory / f"{name}.j").write_text(program.source(templates))
+    (directory / f"{name}.e").write_text(
+        "s: %d\ni: %s\no: %s\n"
+        % (
+            count,
+            ", ".join(str(x) for x in program.inputs),
+            ", ".join(str(x) for x in outputs),
+        )
+    )
+    return directory / f"{name}.e"
+
+
+class Fuzzer:
+    def __init__(self, seed=0, length=32, steps=1000, isa=None):
+        self.isa = isa or default_isa()
+        self.rng = random.Random(seed)
+        self.generator = Generator(self.isa, self.rng)
+        self.coverage = Coverage()
+        self.length = length
+        self.steps = steps
+        self.corpus = []
+        self.failures = []
+        self.programs = 0
+
+    def one(self):
+        if self.corpus and self.rng.random() < 0.8:
+            program = self.generator.mutate(self.rng.choice(self.corpus), self.corpus)
+        else:
+            program = self.generator.program(self.rng.randrange(1, self.length + 1))
+        self.programs += 1
+
+        try:
+            computer = Computer(program.image(), False, program.inputs)
+            features = self.coverage.run(computer, self.steps)
+        except Exception as e:
+            self.failures.append((program, "%s: %s" % (type(e).__name__, e)))
+            return
+        if self.coverage.add(features):
+            self.corpus.append(program)
+
+    def run(self, programs=None, seconds=None):
+        start = time.perf_counter()
+        while programs is None or self.programs < programs:
+            if seconds is not None and time.perf_counter() - start >= seconds:
+                break
+            self.one()
+        return time.perf_counter() - start
+
+
+def rtl_failures(paths, sim, jobs=None):
+    """The .e cases that fail on the RTL in lockstep with the emulator."""
+    from golden import run_cocotb
+
+    results = run_cocotb(paths, sim, jobs)
+    return [(path, x.error) for path, x in zip(paths, results) if not x.passed]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate random programs, keep those that reach new "
+        "coverage on the emulator and check them against the RTL"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--programs", "-n", type=int, help="Stop after this many programs"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10, help="Stop after this long"
+    )
+    parser.add_argument(
+        "--length", type=int, default=32, help="Most instructions in a new program"
+    )
+    parser.add_argument(
+        "--steps", type=int, default=1000, help="Instructions to run each program for"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["emulator", "icarus", "verilator"],
+        default="emulator",
+        help="Where the programs that reach new coverage are checked, the "
+        "emulator alone only finds crashes of the emulator",
+    )
+    parser.add_argument("--jobs", "-j", type=int, help="Simulations to run at once")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=TEST_DIR / "fuzz_output",
+        help="Where the corpus and minimized failures are written",
+    )
+    args = parser.parse_args(argv)
+
+    fuzzer = Fuzzer(args.seed, args.length, args.steps)
+    seconds = None if args.programs is not None else args.seconds
+    elapsed = fuzzer.run(args.programs, seconds)
+    print(
+        "%d programs in %.2fs, %.0f programs/s"
+        % (fuzzer.programs, elapsed, fuzzer.programs / elapsed)
+    )
+    print("Corpus of %d, %s" % (len(fuzzer.corpus), fuzzer.coverage.summary()))
+
+    templates = fuzzer.isa.templates
+    failures = []
+    for program, error in fuzzer.failures:
+
+        def still_fails(candidates):
+            for x in candidates:
+                if emulate(x, args.steps) is not None:
+                    return x
+            return None
+
+        failures.append((minimize(program, still_fails), error))
+
+    if args.engine != "emulator":
+        corpus_dir = args.output / "corpus"
+        paths = [
+            write_case(corpus_dir, "%04d" % i, x, templates, args.steps)
+            for i, x in enumerate(fuzzer.corpus)
+        ]
+        found = rtl_failures(paths, args.engine, args.jobs)
+        print(
+            "%d of %d checked on the %s diverged"
+            % (len(found), len(paths), args.engine)
+        )
+        for path, error in found:
+            program = fuzzer.corpus[paths.index(path)]
+            work = args.output / "minimize" / path.stem
+
+            def still_fails(candidates):
+                cases = [
+                    write_case(work, "%d" % i, x, templates, args.steps)
+                    for i, x in enumerate(candidates)
+                ]
+                for case, _ in rtl_failures(cases, args.engine, args.jobs):
+                    return candidates[cases.index(case)]
+                return None
+
+            failures.append((minimize(program, still_fails), error))
+
+    for n, (program, error) in enumerate(failures):
+        path = write_case(
+            args.output / "failures", "%04d" % n, program, templates, args.steps
+        )
+        print("%s: %s" % (path.with_suffix(".j"), error.splitlines()[0]))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
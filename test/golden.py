@@ -0,0 +1,320 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+TEST_DIR = Path(__file__).resolve().parent
+ROOT = TEST_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+from emulator import Computer, Profile, read_image, spi_cycles, ALU_CYCLES
+from emulator.profile import step as profile_step
+from emulator.trace import TraceWriter, step as trace_step
+from assembler import assemble, assemble_debug
+
+PROGRAMS = ROOT / "example_programs" / "assembly"
+
+# Step limit for programs that never halt (s: -1), the same as the compiler's
+# hardware_assembly tests use
+DEFAULT_STEPS = 5000
+
+IMAGE_SUFFIXES = [".o", ".bin", ".hex"]
+
+
+class Expectation(object):
+    def __init__(self, steps=500, inputs=(), outputs=(), ram=None):
+        self.steps = steps
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.ram = ram or {}
+
+    @property
+    def finite(self):
+        # The program has to halt within steps and print exactly outputs,
+        # otherwise outputs only has to be a prefix of what it prints
+        return self.steps >= 0
+
+    @property
+    def max_steps(self):
+        return self.steps if self.finite else DEFAULT_STEPS
+
+
+def _numbers(value):
+    return [int(x) & 0xFF for x in value.split(",") if x.strip()]
+
+
+def read_expectation(path):
+    expectation = Expectation()
+    with open(path, "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            key = key.strip()
+            value = value.strip()
+            if key == "s":
+                expectation.steps = int(value)
+            elif key == "i":
+                expectation.inputs = _numbers(value)
+            elif key == "o":
+                expectation.outputs = _numbers(value)
+            elif key == "r" and value:
+                for pair in value.split(","):
+                    address, data = pair.split(":")
+                    expectation.ram[int(address)] = int(data) & 0xFF
+    return expectation
+
+
+def load_program(path):
+    """The program for a .e file, assembled from its .j or else read from
+    its image"""
+    path = Path(path)
+    source = path.with_suffix(".j")
+    if source.exists():
+        return assemble(source.read_text())
+    for suffix in IMAGE_SUFFIXES:
+        if path.with_suffix(suffix).exists():
+            return read_image(path.with_suffix(suffix))
+    raise FileNotFoundError("No .j or image for %s" % path)
+
+
+def discover(directory=PROGRAMS):
+    return [
+        x
+        for x in sorted(Path(directory).rglob("*.e"))
+        if any(x.with_suffix(y).exists() for y in (".j", *IMAGE_SUFFIXES))
+    ]
+
+
+def max_cycles(expectation, address_24bit=False):
+    # The slowest instructions do three SPI transactions and an ALU pass
+    return expectation.max_steps * (3 * spi_cycles(address_24bit) + ALU_CYCLES + 8)
+
+
+def check(expectation, outputs, ram, halted=None):
+    """Returns why the run doesn't match the expectation, None if it does.
+
+    outputs are the values uo_out changed to, from 0 at reset, which is all
+    test_full.run() can see and what Computer.outputs records. halted is None
+    when the engine can't tell whether the CPU halted.
+    """
+    expected = expectation.outputs
+    for previous, value in zip([0] + expected, expected):
+        if value == previous:
+            return "expected outputs %s can't be seen, uo_out doesn't change to %d" % (
+                expected,
+                value,
+            )
+    if outputs[: len(expected)] != expected:
+        return "expected outputs %s, got %s" % (expected, outputs[: len(expected) + 4])
+    if expectation.finite:
+        if len(outputs) > len(expected):
+            return "expected outputs %s, got extra %s" % (
+                expected,
+                outputs[len(expected) :],
+            )
+        if halted is False:
+            return "didn't halt within %d steps" % expectation.steps
+
+    for address, data in expectation.ram.items():
+        if ram[address] != data:
+            return "expected RAM[%d] == %d, got %d" % (address, data, ram[address])
+    return None
+
+
+def write_profile(profile_dir, path, profile):
+    """Writes name.txt with the hottest instructions and name.folded for a
+    flamegraph, mapped to the .j source when there is one."""
+    path = Path(path)
+    debug_info = None
+    source = path.with_suffix(".j")
+    if source.exists():
+        _, debug_info = assemble_debug(source.read_text(), source.name)
+
+    name = path.stem + ("-24bit" if profile.address_24bit else "")
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    (profile_dir / f"{name}.txt").write_text(profile.report(debug_info) + "\n")
+    (profile_dir / f"{name}.folded").write_text(profile.folded(debug_info, path.stem))
+
+
+def trace_path(trace_dir, path, address_24bit=False):
+    name = Path(path).stem + ("-24bit" if address_24bit else "")
+    Path(trace_dir).mkdir(parents=True, exist_ok=True)
+    return Path(trace_dir) / f"{name}.trace"
+
+
+class Result(object):
+    def __init__(self, name, engine, address_24bit=False):
+        self.name = name
+        self.engine = engine
+        self.address_24bit = address_24bit
+        self.error = None
+        self.outputs = []
+        self.instructions = None
+        self.cycles = None
+        self.elapsed = 0
+
+    @property
+    def passed(self):
+        return self.error is None
+
+
+def run_emulator(path, address_24bit=False, profile_dir=None, trace_dir=None):
+    path = Path(path)
+    result = Result(path.stem, "emulator", address_24bit)
+    start = time.perf_counter()
+    writer = None
+    try:
+        expectation = read_expectation(path)
+        computer = Computer(load_program(path), address_24bit, expectation.inputs)
+        step = computer.step
+        if profile_dir is not None:
+            profile = Profile(address_24bit)
+            cache = {}
+            step = partial(profile_step, computer, profile, cache)
+        if trace_dir is not None:
+            writer = TraceWriter(
+                trace_path(trace_dir, path, address_24bit), address_24bit
+            )
+            step = partial(trace_step, computer, writer, step)
+
+        # One more step than allowed, for the halt itself
+        steps = expectation.max_steps + 1
+        expected = expectation.outputs
+        checked = 0
+        while computer.instructions < steps and step():
+            outputs = computer.outputs
+            if len(outputs) > checked:
+                checked = len(outputs)
+                if checked > len(expected) or outputs[-1] != expected[checked - 1]:
+                    # Wrong already, no need to wait for the rest
+                    break
+            if not expectation.finite and checked >= len(expected):
+                break
+
+        result.outputs = computer.outputs
+        result.instructions = computer.instructions
+        result.cycles = computer.cycles
+        result.error = check(
+            expectation, computer.outputs, computer.ram, computer.halted
+        )
+        if profile_dir is not None:
+            write_profile(profile_dir, path, profile)
+    except Exception as e:
+        result.error = "%s: %s" % (type(e).__name__, e)
+    finally:
+        if writer is not None:
+            writer.close()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def run_cocotb(paths, sim="icarus", jobs=None, profile_dir=None, trace_dir=None):
+    from runner import Shard, run_shards
+
+    # One simulator run per program, test_golden.py reads GOLDEN_PROGRAM
+    shards = []
+    for path in paths:
+        shard = Shard("test_golden", "test_golden", label=Path(path).stem)
+        shard.env["GOLDEN_PROGRAM"] = str(Path(path).resolve())
+        if profile_dir is not None:
+            shard.env["GOLDEN_PROFILE"] = str(Path(profile_dir).resolve())
+        if trace_dir is not None:
+            shard.env["GOLDEN_TRACE"] = str(Path(trace_dir).resolve())
+        shards.append(shard)
+    run_shards(shards, TEST_DIR / "sim_build_parallel", sim, jobs)
+
+    results = []
+    for path, shard in zip(paths, shards):
+        result = Result(Path(path).stem, sim)
+        result.elapsed = shard.elapsed
+        result.error = shard.failure()
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run every program with a .e expectation file and check its outputs"
+    )
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        type=Path,
+        default=PROGRAMS,
+        help="Where to look for .e files (default example_programs/assembly)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["emulator", "icarus", "verilator"],
+        default="emulator",
+        help="What to run the programs on, the emulator is by far the fastest",
+    )
+    parser.add_argument(
+        "--address-24bit", action="store_true", help="Use 24 bit SPI addressing"
+    )
+    parser.add_argument("--jobs", "-j", type=int, help="Programs to run at once")
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="DIR",
+        help="Write a cycle profile and flamegraph stacks of each program here",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="DIR",
+        help="Record an instruction trace of each program here, "
+        "see python -m emulator.trace",
+    )
+    parser.add_argument(
+        "-k", dest="pattern", help="Only run programs whose name contains this"
+    )
+    args = parser.parse_args(argv)
+
+    paths = discover(args.directory)
+    if args.pattern is not None:
+        paths = [x for x in paths if args.pattern in x.stem]
+    if not paths:
+        print("No programs found")
+        return 1
+
+    start = time.perf_counter()
+    if args.engine == "emulator":
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(
+                pool.map(
+                    run_emulator,
+                    paths,
+                    [args.address_24bit] * len(paths),
+                    [args.profile] * len(paths),
+                    [args.trace] * len(paths),
+                )
+            )
+    else:
+        results = run_cocotb(paths, args.engine, args.jobs, args.profile, args.trace)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        status = "ok" if result.passed else "FAILED"
+        line = "%-30s %-6s %8.2f ms" % (result.name, status, result.elapsed * 1000)
+        if result.cycles is not None:
+            line += " %8d instructions %10d cycles" % (
+                result.instructions,
+                result.cycles,
+            )
+        print(line)
+        if not result.passed:
+            print("    " + result.error)
+
+    failed = [x for x in results if not x.passed]
+    print(
+        "%d programs, %d failed in %.2fs on the %s"
+        % (len(results), len(failed), elapsed, args.engine)
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+
+TEST_DIR = Path(__file__).resolve().parent
+ROOT = TEST_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+from isa import default_isa
+from emulator import Computer, profile_run
+from emulator.roms import HALT, JMPO, ROMO, RAMO, RAMI, ALUO
+
+BASELINE = TEST_DIR / "latency_baseline.json"
+ENGINES = ["emulator", "icarus", "verilator"]
+MODES = {"16bit": False, "24bit": True}
+
+# Operand of every instruction that isn't a jump, MAR and MPAGE loads keep
+# RAM accesses on page 0x10
+OPERAND = 0x10
+
+# Jump targets far from the program, to tell taken jumps apart
+PROBES = [0x1000, 0x2000]
+
+# Two byte jumps can only reach addresses like 0x0101, which are 257 apart
+NOP = 0x00
+MAX_PADDING = 0x101
+
+
+def _run_one(code, start, flags=0):
+    # Where the emulator goes after running the instruction at start
+    computer = Computer(bytes(start) + code)
+    computer.pc = start
+    computer.zflag, computer.oflag, computer.cflag, computer.sflag = [
+        (flags >> x) & 1 for x in range(4)
+    ]
+    computer.step()
+    return computer
+
+
+def _jump(opcode, start):
+    """The bytes for jump opcode at start that carry on to the next
+    instruction whether it's taken or not, None if it can't be made to."""
+    # Jumps without PCC in their second half are two bytes long, and read
+    # the same operand byte twice
+    following = {}
+    landed = {}
+    for flags in range(16):
+        for probe in PROBES:
+            code = bytes([opcode, probe >> 8, probe & 0xFF])
+            landed[flags, probe] = _run_one(code, start, flags).pc
+        if landed[flags, PROBES[0]] == landed[flags, PROBES[1]]:
+            following[landed[flags, PROBES[0]]] = True
+    if len(following) > 1:
+        return None
+    length = following.popitem()[0] - start if following else 3
+
+    bases = set()
+    for flags in range(16):
+        if landed[flags, PROBES[0]] != landed[flags, PROBES[1]]:
+            value = PROBES[0] if length == 3 else (PROBES[0] >> 8) * 0x101
+            bases.add((landed[flags, PROBES[0]] - value) & 0xFFFF)
+    if len(bases) > 1:
+        return None
+    target = (start + length - bases.pop()) & 0xFFFF if bases else 0
+    if length == 2 and target >> 8 != target & 0xFF:
+        return None
+    return bytes([opcode, target >> 8, target & 0xFF])[:length]
+
+
+def _place(isa, opcode, start):
+    """The bytes for opcode at start that carry on to the next instruction,
+    None if it can't be made to."""
+    if (isa.flags_1[opcode] | isa.flags_2[opcode]) & JMPO:
+        code = _jump(opcode, start)
+    else:
+        code = bytes([opcode, OPERAND, OPERAND])
+        computer = _run_one(code, start)
+        code = None if computer.halted else code[: computer.pc - start]
+    if code is None:
+        return None
+    for flags in range(16):
+        if _run_one(code, start, flags).pc != start + len(code):
+            return None
+    return code
+
+
+def benchmark_program(isa=None):
+    """One of every opcode in a straight line, then halt.
+
+    Two byte jumps can only land on addresses like 0x0101, nops are put in
+    front of them until they do. Returns the program and the opcode at the
+    address of every instruction in it.
+    """
+    isa = isa or default_isa()
+    program = bytearray()
+    placed = {}
+    for opcode, template in enumerate(isa.templates):
+        if not template or isa.flags_1[opcode] & HALT:
+            continue
+        for padding in range(MAX_PADDING):
+            code = _place(isa, opcode, len(program) + padding)
+            if code is not None:
+                break
+        if code is None:
+            continue
+        program.extend(bytes([NOP]) * padding)
+        placed[len(program)] = opcode
+        program.extend(code)
+    program.append(0xFF)
+    return bytes(program), placed
+
+
+def instruction_class(template):
+    # The same instruction on different registers costs the same, jump
+    # conditions (jmp c) aren't registers
+    if template.startswith("jmp"):
+        return template
+    return re.sub(r"\b[abcd]\b", "r", template)
+
+
+def spi_type(flags):
+    if flags & RAMI:
+        return "ram write"
+    if flags & RAMO:
+        return "ram read"
+    return "rom read"
+
+
+def measure(profile, placed, mode, results=None, isa=None):
+    """The latencies a profile of benchmark_program() shows, in cycles.
+
+    Every ALU opcode gets its own start to done latency, instructions and
+    SPI transactions the worst of their class. Adds to results when given,
+    so the worst of several runs is kept.
+    """
+    isa = isa or default_isa()
+    results = {} if results is None else results
+
+    def worst(key, cycles):
+        results[key] = max(results.get(key, 0), cycles)
+
+    for pc, opcode in placed.items():
+        runs = profile.executed[pc]
+        if not runs:
+            continue
+        states = profile.states[pc]
+        template = isa.templates[opcode]
+        flags = (("1", isa.flags_1[opcode]), ("2", isa.flags_2[opcode]))
+
+        worst(
+            "cu/%s/%s" % (mode, instruction_class(template)), profile.cycles(pc) // runs
+        )
+        if any(x & ALUO for _, x in flags):
+            # Doesn't depend on the address mode
+            worst("alu/%02x %s" % (opcode, template), profile.alu_stalls(pc) // runs)
+
+        worst("spi/%s/rom read" % mode, states["UPDATE_SPI"] // runs)
+        for half, x in flags:
+            cycles = states["FLAGS_%s_SPI" % half] // runs
+            if cycles and x & (ROMO | RAMO | RAMI):
+                worst("spi/%s/%s" % (mode, spi_type(x)), cycles)
+    return results
+
+
+def emulator_latencies():
+    program, placed = benchmark_program()
+    results = {}
+    for mode, address_24bit in MODES.items():
+        profile = profile_run(Computer(program, address_24bit))
+        measure(profile, placed, mode, results)
+    return results
+
+
+def rtl_latencies(sim, jobs=None):
+    from runner import Shard, run_shards
+
+    output = TEST_DIR / "sim_build_parallel" / "latency.json"
+    if output.exists():
+        output.unlink()
+    shard = Shard("test_latency", "test_latency")
+    shard.env["LATENCY_RESULTS"] = str(output)
+    run_shards([shard], TEST_DIR / "sim_build_parallel", sim, jobs)
+    if shard.failure() is not None or not output.exists():
+        print("Simulation failed:", shard.failure())
+        return None
+    return json.loads(output.read_text())
+
+
+def compare(baseline, results):
+    """Returns the keys whose latency grew, and prints every difference."""
+    grew = []
+    for key in sorted(set(baseline) | set(results)):
+        old = baseline.get(key)
+        new = results.get(key)
+        if old is None:
+            print("%-40s %6s -> %6d  new" % (key, "", new))
+        elif new is None:
+            print("%-40s %6d -> %6s  not measured" % (key, old, ""))
+        elif new > old:
+            print("%-40s %6d -> %6d  SLOWER" % (key, old, new))
+            grew.append(key)
+        elif new < old:
+            print("%-40s %6d -> %6d  faster" % (key, old, new))
+    return grew
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure ALU, instruction and SPI latencies in clock cycles "
+        "and fail if any grew over the baseline"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="emulator",
+        help="The emulator's cycle model, which only catches changes to the "
+        "model itself, or the RTL on a simulator, which catches RTL regressions",
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Record the measured latencies as the new baseline",
+    )
+    parser.add_argument("--show", action="store_true", help="Print every latency")
+    args = parser.parse_args(argv)
+
+    if args.engine == "emulator":
+        results = emulator_latencies()
+    else:
+        results = rtl_latencies(args.engine)
+        if results is None:
+            return 1
+
+    if args.show:
+        for key, cycles in sorted(results.items()):
+            print("%-40s %6d" % (key, cycles))
+
+    baselines = {}
+    if args.baseline.exists():
+        baselines = json.loads(args.baseline.read_text())
+
+    if args.update:
+        baselines[args.engine] = results
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print("%d latencies written to %s" % (len(results), args.baseline))
+        return 0
+    if args.engine not in baselines:
+        print(
+            "No %s baseline in %s, record one with --engine %s --update"
+            % (args.engine, args.baseline, args.engine)
+        )
+        return 1
+
+    grew = compare(baselines[args.engine], results)
+    print(
+        "%d latencies, %d grew over the %s baseline"
+        % (len(results), len(grew), args.engine)
+    )
+    return 1 if grew else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+import os
+import ast
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+import sysconfig
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+TEST_DIR = Path(__file__).resolve().parent
+ROOT = TEST_DIR.parent
+SRC = ROOT / "src"
+
+# Same sources as the Makefile
+VERILOG_SOURCES = [
+    TEST_DIR / "tb.v",
+    SRC / "tt_um_aerox2_jrb8_computer.sv",
+    SRC / "alu.sv",
+    SRC / "cmp.sv",
+    SRC / "cu.sv",
+    SRC / "jmp.sv",
+    SRC / "spi.sv",
+]
+TOPLEVEL = "tb"
+
+MODULES = ["test_full", "test_alu", "test_cmp", "test_jmp", "test_spi"]
+
+# Modules whose tests run every program in both SPI address modes, each mode
+# becomes its own shard through the ADDRESS_24BIT environment variable
+ADDRESS_MODE_MODULES = ["test_full"]
+
+# Paths the simulation opens relative to its working directory
+# ($readmemh("../rom/...") and "../example_programs/...")
+SHARED_DIRS = ["rom", "example_programs"]
+
+
+class Shard(object):
+    def __init__(self, module, testcase, address_24bit=None, label=None):
+        self.module = module
+        self.testcase = testcase
+        self.address_24bit = address_24bit
+
+        self.name = f"{module}.{testcase}"
+        if address_24bit is not None:
+            self.name += "[24bit]" if address_24bit else "[16bit]"
+        if label is not None:
+            self.name += f"[{label}]"
+
+        # Extra environment for the simulator, how parametrised modules like
+        # test_golden get told what to run
+        self.env = {}
+
+        self.elapsed = 0
+        self.returncode = None
+        self.work_dir = None
+        self.results = None
+
+    def failure(self):
+        """Why the shard failed, None if every test in it passed."""
+        if self.results is None or not self.results.exists():
+            return f"Simulator exited with {self.returncode}, see sim.log"
+        for testcase in ET.parse(self.results).getroot().iter("testcase"):
+            failure = testcase.find("failure")
+            if failure is not None:
+                return failure.get("message") or f"{testcase.get('name')} failed"
+        return None
+
+
+def find_tests(module):
+    # Parse rather than import, cocotb can only be imported inside a simulator
+    tree = ast.parse((TEST_DIR / f"{module}.py").read_text())
+
+    tests = []
+    for node in tree.body:
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Call):
+                decorator = decorator.func
+            if ast.unparse(decorator) == "cocotb.test":
+                tests.append(node.name)
+    return tests
+
+
+def find_shards(modules, pattern=None):
+    shards = []
+    for module in modules:
+        for test in find_tests(module):
+            if module in ADDRESS_MODE_MODULES:
+                shards.append(Shard(module, test, False))
+                shards.append(Shard(module, test, True))
+            else:
+                shards.append(Shard(module, test))
+
+    if pattern is not None:
+        shards = [x for x in shards if pattern in x.name]
+    return shards
+
+
+def cocotb_config(*args):
+    return subprocess.check_output(["cocotb-config", *args], text=True).strip()
+
+
+SIMULATORS = ["icarus", "verilator"]
+
+ICARUS_ARGS = ["-D", "COCOTB_SIM=1", "-s", TOPLEVEL, "-g2012"]
+
+# Same as cocotb's Makefile.verilator. --public-flat-rw keeps the
+# hierarchy (pc, alu_module, spi_module, ...) visible to the tests.
+VERILATOR_ARGS = [
+    "-DCOCOTB_SIM=1",
+    "--top-module",
+    TOPLEVEL,
+    "--vpi",
+    "--public-flat-rw",
+    "--prefix",
+    "Vtop",
+    "-o",
+    "Vtop",
+    "--timescale",
+    "1ns/1ps",
+    "-Wno-fatal",
+]
+
+# The unit tests force and drive nets inside the design, which Verilator's
+# VPI doesn't support, so only the full computer tests run on it
+VERILATOR_MODULES = ["test_full"]
+
+
+def tool_version(*cmd):
+    # Part of the cache key, a new simulator must not reuse an old image
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ""
+
+
+def source_hash(sources, args, version):
+    h = hashlib.sha256()
+    h.update(version.encode())
+    h.update("\0".join(args).encode())
+    for source in sources:
+        h.update(b"\0" + Path(source).name.encode() + b"\0")
+        h.update(Path(source).read_bytes())
+    return h.hexdigest()[:16]
+
+
+def icarus_build(out_dir):
+    cmds = out_dir / "cmds.f"
+    cmds.write_text("+timescale+1ns/1ps\n")
+    subprocess.run(
+        [
+            "iverilog",
+            "-o",
+            str(out_dir / "sim.vvp"),
+            *ICARUS_ARGS,
+            "-f",
+            str(cmds),
+            *[str(x) for x in VERILOG_SOURCES],
+        ],
+        check=True,
+    )
+
+
+def verilator_args():
+    lib_dir = cocotb_config("--lib-dir")
+    main = Path(cocotb_config("--share")) / "lib" / "verilator" / "verilator.cpp"
+    return [
+        *VERILATOR_ARGS,
+        "-LDFLAGS",
+        f"-Wl,-rpath,{lib_dir} -L{lib_dir} -lcocotbvpi_verilator",
+        str(main),
+    ]
+
+
+def verilator_build(out_dir):
+    subprocess.run(
+        [
+            "verilator",
+            "-cc",
+            "--exe",
+            "-Mdir",
+            str(out_dir),
+            *verilator_args(),
+            *[str(x) for x in VERILOG_SOURCES],
+        ],
+        check=True,
+    )
+    subprocess.run(
+        ["make", "-C", str(out_dir), f"-j{os.cpu_count()}", "-f", "Vtop.mk"],
+        check=True,
+    )
+
+
+def compile_design(build_dir, sim="icarus", rebuild=False):
+    # Only the RTL goes into the image, the programs and ROMs are read at run
+    # time, so editing assembly never triggers a recompile
+    if sim == "verilator":
+        version = tool_version("verilator", "--version")
+        key = source_hash(VERILOG_SOURCES, verilator_args(), version)
+        build, image = verilator_build, "Vtop"
+    else:
+        version = tool_version("iverilog", "-V")
+        key = source_hash(VERILOG_SOURCES, ICARUS_ARGS, version)
+        build, image = icarus_build, "sim.vvp"
+
+    cache_dir = build_dir / "cache" / f"{sim}-{key}"
+    if (cache_dir / image).exists() and not rebuild:
+        return cache_dir / image, True
+
+    tmp_dir = build_dir / "cache" / f"{sim}-{key}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    build(tmp_dir)
+
+    # Swap the finished build in whole, so a concurrent or interrupted run
+    # never sees half an image
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return cache_dir / image, False
+
+
+def simulator_command(sim, image):
+    if sim == "verilator":
+        return [str(image)]
+    lib_dir = cocotb_config("--lib-dir")
+    vpi = cocotb_config("--lib-name", "vpi", "icarus")
+    return ["vvp", "-M", lib_dir, "-m", vpi, str(image)]
+
+
+def prepare_run_dir(run_dir):
+    run_dir.mkdir(parents=True, exist_ok=True)
+    for name in SHARED_DIRS:
+        link = run_dir / name
+        if not link.exists():
+            link.symlink_to(ROOT / name, target_is_directory=True)
+
+
+def simulator_env():
+    env = dict(os.environ)
+    env["TOPLEVEL"] = TOPLEVEL
+    env["TOPLEVEL_LANG"] = "verilog"
+    env["LIBPYTHON_LOC"] = cocotb_config("--libpython")
+    env["PYGPI_PYTHON_BIN"] = sys.executable
+    env["PYTHONPATH"] = os.pathsep.join([str(TEST_DIR), *sys.path])
+    if sys.prefix == sys.base_prefix:
+        env["PYTHONHOME"] = sysconfig.get_config_var("prefix")
+    return env
+
+
+def run_shard(shard, command, run_dir, env):
+    shard.work_dir = run_dir / shard.name
+    shard.work_dir.mkdir(parents=True, exist_ok=True)
+    shard.results = shard.work_dir / "results.xml"
+    if shard.results.exists():
+        shard.results.unlink()
+
+    env = dict(env)
+    env["MODULE"] = shard.module
+    env["TESTCASE"] = shard.testcase
+    env["COCOTB_RESULTS_FILE"] = str(shard.results)
+    if shard.address_24bit is not None:
+        env["ADDRESS_24BIT"] = "1" if shard.address_24bit else "0"
+    env.update(shard.env)
+
+    start = time.perf_counter()
+    with open(shard.work_dir / "sim.log", "w") as log:
+        shard.returncode = subprocess.run(
+            command,
+            cwd=shard.work_dir,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        ).returncode
+    shard.elapsed = time.perf_counter() - start
+    return shard
+
+
+def run_shards(shards, build_dir, sim="icarus", jobs=None, rebuild=False):
+    start = time.perf_counter()
+    image, cached = compile_design(build_dir, sim, rebuild)
+    if cached:
+        print("Using cached design", image)
+    else:
+        print("Compiled design in %.2fs" % (time.perf_counter() - start))
+
+    # A directory per simulator, each test runs two levels below the shared
+    # rom and example_programs links
+    run_dir = build_dir / sim
+    prepare_run_dir(run_dir)
+
+    command = simulator_command(sim, image)
+    env = simulator_env()
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(run_shard, x, command, run_dir, env) for x in shards]
+        for future in as_completed(futures):
+            shard = future.result()
+            print("%8.2fs  %s" % (shard.elapsed, shard.name))
+    return shards
+
+
+def merge_results(shards, output):
+    root = ET.Element("testsuites", name="results")
+    suite = ET.SubElement(root, "testsuite", name="all", package="all")
+
+    failures = []
+    for shard in shards:
+        testcases = []
+        if shard.results.exists():
+            testcases = ET.parse(shard.results).getroot().iter("testcase")
+
+        found = False
+        for testcase in testcases:
+            found = True
+            testcase.set("name", shard.name.split(".", 1)[1])
+            testcase.set("wall_time_s", "%.3f" % shard.elapsed)
+            suite.append(testcase)
+            if testcase.find("failure") is not None:
+                failures.append(shard)
+
+        if not found:
+            # The simulator died before cocotb could write its results
+            testcase = ET.SubElement(
+                suite,
+                "testcase",
+                name=shard.name.split(".", 1)[1],
+                classname=shard.module,
+                wall_time_s="%.3f" % shard.elapsed,
+            )
+            ET.SubElement(
+                testcase,
+                "failure",
+                message=f"Simulator exited with {shard.returncode}, see sim.log",
+            )
+            failures.append(shard)
+
+    ET.ElementTree(root).write(output, encoding="utf-8", xml_declaration=True)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile the design once and run the cocotb tests in parallel"
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count(), help="Parallel simulators"
+    )
+    parser.add_argument(
+        "--build-dir",
+        type=Path,
+        default=TEST_DIR / "sim_build_parallel",
+        help="Where to put the compiled design and a directory per test",
+    )
+    parser.add_argument(
+        "--results",
+        type=Path,
+        default=TEST_DIR / "results.xml",
+        help="Merged results file to write",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Compile the design even if a cached build of the sources exists",
+    )
+    parser.add_argument(
+        "-k", dest="pattern", help="Only run tests whose name contains this"
+    )
+    parser.add_argument(
+        "--sim", choices=SIMULATORS, default="icarus", help="Simulator to run on"
+    )
+    parser.add_argument("modules", nargs="*", help="Test modules to run")
+    args = parser.parse_args(argv)
+
+    modules = args.modules
+    if not modules:
+        modules = VERILATOR_MODULES if args.sim == "verilator" else MODULES
+
+    shards = find_shards(modules, args.pattern)
+    if not shards:
+        print("No tests found")
+        return 1
+
+    start = time.perf_counter()
+    run_shards(shards, args.build_dir.resolve(), args.sim, args.jobs, args.rebuild)
+
+    failures = merge_results(shards, args.results)
+    elapsed = time.perf_counter() - start
+
+    print()
+    print("Slowest tests:")
+    for shard in sorted(shards, key=lambda x: x.elapsed, reverse=True)[:5]:
+        print("%8.2fs  %s" % (shard.elapsed, shard.name))
+    print()
+    print(
+        "%d tests, %d failed, %.2fs wall time, %.2fs simulated serially"
+        % (len(shards), len(failures), elapsed, sum(x.elapsed for x in shards))
+    )
+    for shard in failures:
+        print("FAILED", shard.name, shard.work_dir / "sim.log")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import cocotb
+from cocotb.triggers import Event, FallingEdge, RisingEdge
+
+READ_COMMAND = 0x03
+WRITE_COMMAND = 0x02
+
+
+class SpiMemory(object):
+    """SPI flash/SRAM device model driven by the sclk edges of the bus.
+
+    MOSI is sampled on the rising edge of sclk, MISO is shifted out on the
+    falling edge which is when spi.sv samples the previous bit. Addresses
+    at or above ram_base go to ram (offset by ram_base), everything else is
+    read from rom. Reads of unprogrammed rom return 0xFF like erased flash.
+    rom and ram can be lists or emulator.PagedMemory.
+    """
+
+    def __init__(
+        self, cs, sclk, mosi, miso, rom=None, ram=None, ram_base=0, address_24bit=False
+    ):
+        self.cs = cs
+        self.sclk = sclk
+        self.mosi = mosi
+        self.miso = miso
+
+        self.rom = rom
+        self.ram = ram
+        self.ram_base = ram_base
+        self.address_bits = 24 if address_24bit else 16
+
+        self.reads = 0
+        self.writes = 0
+        self.error = None
+        self.failed = Event()
+        self._task = None
+
+    def start(self):
+        self._task = cocotb.start_soon(self._run())
+        return self
+
+    def stop(self):
+        if self._task is not None:
+            self._task.kill()
+            self._task = None
+
+    def read(self, address):
+        if self.ram is not None and address >= self.ram_base:
+            return self.ram[address - self.ram_base]
+        if address < len(self.rom):
+            return self.rom[address]
+        return 0xFF
+
+    def write(self, address, data):
+        if self.ram is None or address < self.ram_base:
+            raise ValueError(
+                "Write of %02x to read only address %06x" % (data, address)
+            )
+        self.ram[address - self.ram_base] = data
+
+    async def _shift_in(self, bits):
+        value = 0
+        for i in range(bits):
+            await RisingEdge(self.sclk)
+            value = value << 1 | self.mosi.value.integer
+        return value
+
+    async def _transaction(self):
+        command = await self._shift_in(8)
+        address = await self._shift_in(self.address_bits)
+
+        if command == WRITE_COMMAND:
+            data = await self._shift_in(8)
+            self.write(address, data)
+            self.writes += 1
+        elif command == READ_COMMAND:
+            data = self.read(address)
+            for i in range(8):
+                await FallingEdge(self.sclk)
+                self.miso.value = (data >> (7 - i)) & 1
+            await FallingEdge(self.sclk)
+            self.miso.value = 0
+            self.reads += 1
+        else:
+            raise ValueError("Unknown SPI command %02x" % command)
+
+    async def _run(self):
+        while True:
+            await FallingEdge(self.cs)
+            try:
+                await self._transaction()
+            except Exception as e:
+                self.error = e
+                self.failed.set()
+                return
+
+
+def start_memories(dut, rom, ram, address_24bit=False):
+    miso = dut.spi_miso
+    miso.value = 0
+
+    if address_24bit:
+        # A single 24 bit device, RAM lives above the 64K of ROM
+        memories = [
+            SpiMemory(
+                dut.spi_cs_rom,
+                dut.spi_sclk,
+                dut.spi_mosi,
+                miso,
+                rom=rom,
+                ram=ram,
+                ram_base=0x10000,
+                address_24bit=True,
+            )
+        ]
+    else:
+        memories = [
+            SpiMemory(dut.spi_cs_rom, dut.spi_sclk, dut.spi_mosi, miso, rom=rom),
+            SpiMemory(dut.spi_cs_ram, dut.spi_sclk, dut.spi_mosi, miso, ram=ram),
+        ]
+
+    for memory in memories:
+        memory.start()
+    return memories
@@ -7,22 +7,36 @@
 module tb ();
 
   // Dump the signals to a VCD file. You can view it with gtkwave.
+  // Verilator traces through VERILATOR_TRACE=1 instead.
+`ifndef VERILATOR
   initial begin
     $dumpfile("tb.vcd");
     $dumpvars(0, tb);
     #1;
   end
+`endif
 
   // Wire up the inputs and outputs:
   reg clk;
   reg rst_n;
   reg ena;
   reg [7:0] ui_in;
-  reg [7:0] uio_in;
+  wire [7:0] uio_in;
   wire [7:0] uo_out;
   wire [7:0] uio_out;
   wire [7:0] uio_oe;
 
+  // SPI memory bus, broken out for the cocotb memory models. Inputs are
+  // whole signals as Verilator can't drive single bits of a vector over VPI.
+  reg spi_miso;
+  reg address_24bit;
+  assign uio_in = {address_24bit, 4'b0, spi_miso, 2'b0};
+
+  wire spi_cs_rom = uio_out[0];
+  wire spi_mosi = uio_out[1];
+  wire spi_sclk = uio_out[3];
+  wire spi_cs_ram = uio_out[4];
+
   // Replace tt_um_example with your module name:
   tt_um_aerox2_jrb8_computer  tt_um_aerox2_jrb8_computer  (
 
@@ -4,21 +4,9 @@ from test_jmp import *
 from test_spi import *
 
 if __name__ == "__main__":
-    from cocotb_test.simulator import run
-    from glob import glob
+    import sys
+    from runner import main
 
-    sources = ["tb.v", *glob("../src/*.sv"), *glob("../src/*.v")]
-
-    # run(
-    #     verilog_sources=sources,
-    #     toplevel="tb",
-    #     module="test",
-    #     work_dir="../src",
-    # )
-
-    run(
-        verilog_sources=sources,
-        toplevel="tb",
-        module="test_full",
-        work_dir="../src",
-    )
+    # Goes through the runner so the compiled design is reused between runs
+    # until one of the Verilog sources changes
+    sys.exit(main(["test_full", *sys.argv[1:]]))
@@ -1,12 +1,23 @@
+import os
+import sys
 import cocotb
 import random
+from pathlib import Path
 from cocotb.clock import Clock
-from cocotb.triggers import Timer, ClockCycles, RisingEdge
+from cocotb.triggers import Timer, ClockCycles, RisingEdge, FallingEdge
 from cocotb.handle import Force
 
 # TODO: Fine tune this
 ALU_CYCLES = 5
 
+# The state enum in alu.sv, in order
+ALU_STATES = ["IDLE", "DECODE", "ANDZ", "XORZ", "SUM", "AND", "MULT", "DIV", "INVERT"]
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from emulator import read_mem, ROM_DIR, alu as alu_model
+from emulator.alu_table import table, format_mismatches, OPCODES, FIELDS
+
 
 async def setup(dut):
     alu = dut.tt_um_aerox2_jrb8_computer.alu_module
@@ -169,7 +180,7 @@ async def test_alu_additions_overflows(dut):
         lambda alu: assert_(alu.carryout.value == 1),
     )
 
-    # TODO Test a+b overflow?
+    # a+b overflow is covered by test_alu_exhaustive
 
     # Test with overflow
     # a, b = gen_rand(lambda a,b: a+b > 127)
@@ -250,3 +261,124 @@ async def test_alu_extra(dut):
     await test(
         alu, clk, [0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xBB], [v, v, v, v, v, v], False
     )
+
+
+def exhaustive_pairs():
+    # ALU_PAIRS=all checks all 65536 operand pairs of every opcode, otherwise
+    # the corners plus that many (default 64) seeded random pairs
+    count = os.environ.get("ALU_PAIRS", "64")
+    if count == "all":
+        return list(range(0x10000))
+    corners = [0x00, 0x01, 0x7F, 0x80, 0x81, 0xFE, 0xFF]
+    pairs = {a << 8 | b for a in corners for b in corners}
+    rng = random.Random(0)
+    while len(pairs) < len(corners) ** 2 + int(count):
+        pairs.add(rng.randrange(0x10000))
+    return sorted(pairs)
+
+
+async def watch_invert(alu, clk, seen):
+    # Samples what the cmp module latches, mid cycle while the ALU is in
+    # INVERT: the zero and sign of the result before inversion, overout,
+    # carryout and whether cmpo lets it latch them
+    while True:
+        await FallingEdge(clk)
+        state = alu.state.value
+        if state.is_resolvable and ALU_STATES[state.integer] == "INVERT":
+            result = alu.aluout.value.integer
+            seen.append(
+                (
+                    int(result == 0),
+                    alu.overout.value.integer,
+                    alu.carryout.value.integer,
+                    result >> 7,
+                    alu.cmpo.value.integer,
+                )
+            )
+
+
+async def check_table(alu, clk, alu_rom, opcodes, expected, pairs, mismatches):
+    # One transaction per opcode and pair, results are only collected so a
+    # single run reports every mismatch
+    aluout = FIELDS.index("aluout")
+    flags = [FIELDS.index(x) for x in ("zflag", "oflag", "cflag", "sflag")]
+    seen = []
+    watcher = cocotb.start_soon(watch_invert(alu, clk, seen))
+    for pair in pairs:
+        a, b = pair >> 8, pair & 0xFF
+        alu.a.value = Force(a)
+        alu.b.value = Force(b)
+        for i, opcode in enumerate(opcodes):
+            seen.clear()
+            alu.cins.value = Force(opcode)
+            alu.start.value = Force(1)
+            await ClockCycles(clk, 1)
+            alu.start.value = Force(0)
+            await RisingEdge(alu.done)
+
+            got = alu.aluout.value.integer
+            if got != expected[i, aluout, pair]:
+                mismatches.append(
+                    (opcode, a, b, "aluout", int(expected[i, aluout, pair]), got)
+                )
+            if len(seen) != 1:
+                mismatches.append((opcode, a, b, "INVERT", 1, len(seen)))
+                continue
+            *got, cmpo = seen[0]
+            for field, value in zip(flags, got):
+                if value != expected[i, field, pair]:
+                    mismatches.append(
+                        (
+                            opcode,
+                            a,
+                            b,
+                            FIELDS[field],
+                            int(expected[i, field, pair]),
+                            value,
+                        )
+                    )
+            # Only opcodes with CMP set write the flags
+            cmp = int(bool(alu_rom[opcode] & alu_model.CMP))
+            if cmpo != cmp:
+                mismatches.append((opcode, a, b, "cmpo", cmp, cmpo))
+    watcher.kill()
+
+
+async def set_mode(alu, clk, ins):
+    # Mode instructions are latched while the ALU is idle, no start needed
+    alu.cins.value = Force(ins)
+    await ClockCycles(clk, 2)
+
+
+@cocotb.test()
+async def test_alu_exhaustive(dut):
+    alu, clk, a, b = await setup(dut)
+
+    # The same alu_rom.mem the RTL reads, not the instruction set artifact
+    alu_rom = read_mem(ROM_DIR / "alu_rom.mem")
+    pairs = exhaustive_pairs()
+    mismatches = []
+
+    expected = table(alu_rom, OPCODES)
+    await check_table(alu, clk, alu_rom, OPCODES, expected, pairs, mismatches)
+
+    # Division is the only operation signed mode changes
+    divide = [x for x in OPCODES if alu_rom[x] >> 8 == alu_model.DIV]
+    await set_mode(alu, clk, alu_model.SIGN_ON_INS)
+    expected = table(alu_rom, divide, signed_mode=True)
+    await check_table(alu, clk, alu_rom, divide, expected, pairs, mismatches)
+    await set_mode(alu, clk, alu_model.SIGN_OFF_INS)
+
+    # Carry mode adds the carry in to the sums that write the flags
+    sums = [x for x in OPCODES if alu_rom[x] >> 8 == alu_model.SUM]
+    await set_mode(alu, clk, alu_model.CARRY_ON_INS)
+    alu.carryin.value = Force(1)
+    expected = table(alu_rom, sums, carryin=1, carry_mode=True)
+    await check_table(alu, clk, alu_rom, sums, expected, pairs, mismatches)
+    alu.carryin.value = Force(0)
+    await set_mode(alu, clk, alu_model.CARRY_OFF_INS)
+
+    assert not mismatches, "%d mismatches\n%s" % (
+        len(mismatches),
+        format_mismatches(mismatches),
+    )
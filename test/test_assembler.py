@@ -0,0 +1,285 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from assembler import (
+    assemble,
+    parse,
+    emit,
+    optimize,
+    assemble_tree,
+    assemble_object,
+    cached_object,
+    link,
+    assemble_debug,
+    DebugInfo,
+    read_image,
+    write_image,
+    ImageError,
+    AssemblyError,
+    LinkError,
+)
+from emulator import Computer, read_raw
+
+PROGRAMS = Path(__file__).resolve().parent.parent / "example_programs" / "assembly"
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "add_program",
+        "div_mult_test",
+        "division_test",
+        "jmp_program",
+        "large_numbers",
+        "memory_test",
+        "output",
+        "primes",
+    ],
+)
+def test_matches_checked_in_images(name):
+    text = (PROGRAMS / f"{name}.j").read_text()
+    assert assemble(text) == bytes(read_raw(PROGRAMS / f"{name}.o"))
+
+
+def test_operands():
+    assert assemble("nop\nmov a b\nhalt") == bytes([0x00, 0x01, 0xFF])
+    assert assemble("load rom a 0x1f") == bytes([0xD0, 0x1F])
+    assert assemble("save b ram[0b101]") == bytes([0xED, 0x05])
+    assert assemble("out ram[200]  // comment") == bytes([0xF9, 200])
+    assert assemble("jmp z 10") == bytes([0x3B, 10])
+    assert assemble("set c rampage") == bytes([0xDA])
+
+
+def test_labels():
+    text = """
+    :start
+    nop
+    jmp >= end
+    jmp start
+    :end
+    halt
+    """
+    assert assemble(text) == bytes([0x00, 0x36, 0x00, 0x07, 0x30, 0x00, 0x00, 0xFF])
+
+
+def test_errors():
+    with pytest.raises(AssemblyError) as e:
+        assemble("nop\nfoo a")
+    assert e.value.line == 2
+
+    with pytest.raises(AssemblyError):
+        assemble("mov a a")
+
+    with pytest.raises(AssemblyError):
+        assemble("load rom a 256")
+
+    with pytest.raises(AssemblyError):
+        assemble("jmp missing")
+
+    with pytest.raises(AssemblyError) as e:
+        assemble(":loop\nnop\n:loop\njmp loop")
+    assert e.value.line == 3
+
+
+def test_assemble_tree(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.j").write_text("nop\nhalt\n")
+    (tmp_path / "sub" / "b.j").write_text("out 5\nhalt\n")
+    (tmp_path / "bad.j").write_text("foo\n")
+
+    results = {x.source.name: x for x in assemble_tree(tmp_path, jobs=1)}
+    assert results["a.j"].size == 2
+    assert results["b.j"].size == 3
+    assert results["bad.j"].error is not None
+    assert read_raw(tmp_path / "sub" / "b.o") == [0xF8, 5, 0xFF]
+
+    results = {x.source.name: x for x in assemble_tree(tmp_path, jobs=1)}
+    assert results["a.j"].skipped
+    assert not results["bad.j"].skipped
+
+
+def test_link():
+    main = assemble_object("jmp .start\n:.start\njmp mult\n:done\nhalt", "main")
+    mult = assemble_object(":mult\nopp a*b\njmp .start\n:.start\njmp done", "mult")
+    image = link([main, mult])
+    assert image == bytes(
+        [0x30, 0x00, 0x03, 0x30, 0x00, 0x07, 0xFF]
+        + [0x85, 0x30, 0x00, 0x0B, 0x30, 0x00, 0x06]
+    )
+
+    # A single module links to the same image as assembling it directly
+    text = (PROGRAMS / "primes.j").read_text()
+    assert link([assemble_object(text)]) == assemble(text)
+
+    with pytest.raises(LinkError):
+        link([main, main])
+    with pytest.raises(LinkError):
+        link([main])
+
+
+def test_object_cache(tmp_path):
+    source = tmp_path / "a.j"
+    source.write_text(":a\njmp a\n")
+    module, cached = cached_object(source)
+    assert not cached
+    module, cached = cached_object(source)
+    assert cached
+    assert link([module]) == bytes([0x30, 0x00, 0x00])
+
+    source.write_text("nop\n:a\njmp a\n")
+    module, cached = cached_object(source)
+    assert not cached
+    assert link([module]) == bytes([0x00, 0x30, 0x00, 0x01])
+
+    # Neither a.fast.j nor another a.j sharing the cache evicts a.j's object
+    (tmp_path / "a.fast.j").write_text("nop\n")
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "a.j").write_text("halt\n")
+    for path in (source, tmp_path / "a.fast.j", tmp_path / "b" / "a.j", source):
+        cached_object(path, tmp_path / ".jcache")
+    module, cached = cached_object(source, tmp_path / ".jcache")
+    assert cached
+    module, cached = cached_object(tmp_path / "b" / "a.j", tmp_path / ".jcache")
+    assert cached
+    assert link([module]) == assemble("halt\n")
+
+
+def optimized(text):
+    instructions, labels, report = optimize(*parse(text))
+    return emit(instructions, labels), report
+
+
+def test_optimizer():
+    text = """
+    load rom a 3
+    mov a b
+    mov b a
+    cmp a b
+    cmp a b
+    jmp = skip
+    :skip
+    jmp hop
+    out 1
+    :hop
+    jmp end
+    :end
+    out a
+    halt
+    """
+    data, report = optimized(text)
+    # load, mov a b, cmp a b, out a, halt
+    assert data == bytes([0xD0, 3, 0x01, 0x21, 0xF4, 0xFF])
+    assert report.bytes_saved == len(assemble(text)) - len(data)
+    assert report.removed["redundant moves"] == 1
+    assert (
+        report.removed["repeated compares"]
+        + report.removed["compares whose flags are never read"]
+        == 1
+    )
+    assert report.removed["unreachable instructions"] == 1
+
+
+def test_optimizer_keeps_behaviour():
+    for name in ["division_test", "large_numbers", "primes", "input_program"]:
+        text = (PROGRAMS / f"{name}.j").read_text()
+        data, report = optimized(text)
+        assert len(data) <= len(assemble(text))
+
+        before = Computer(assemble(text), inputs=[41, 42, 43])
+        after = Computer(data, inputs=[41, 42, 43])
+        before.run(instructions=2000)
+        after.run(instructions=2000)
+        n = min(len(before.outputs), len(after.outputs))
+        assert n > 0
+        assert before.outputs[:n] == after.outputs[:n]
+
+
+def test_optimizer_skips_numeric_jumps():
+    text = "jmpr 2\nmov a b\nmov a b\nhalt"
+    data, report = optimized(text)
+    assert report.skipped
+    assert data == assemble(text)
+
+
+def test_debug_info(tmp_path):
+    text = (PROGRAMS / "primes.j").read_text()
+    data, debug_info = assemble_debug(text, "primes.j")
+    assert data == assemble(text)
+
+    lines = text.splitlines()
+    for address, file, ln, instruction in debug_info.entries:
+        assert debug_info.files[file] == "primes.j"
+        assert lines[ln - 1].strip().startswith(instruction)
+
+    # Addresses inside an instruction resolve to it, past the end to nothing
+    assert debug_info.entry(debug_info.entries[-1][0] + 1) == debug_info.entries[-1]
+    assert debug_info.entry(len(data) + 10) is None
+    assert "primes.j:" in debug_info.symbolize(5)
+
+    image = tmp_path / "primes.o"
+    image.write_text("v2.0 raw\n")
+    debug_info.save(image.with_suffix(".jdbg"))
+    loaded = DebugInfo.find(image)
+    assert loaded.entries == debug_info.entries
+    assert loaded.labels == debug_info.labels
+
+
+def test_linked_debug_info():
+    main = assemble_object("jmp .start\n:.start\njmp mult\n:done\nhalt", "main.j")
+    mult = assemble_object(":mult\nopp a*b\njmp .start\n:.start\njmp done", "mult.j")
+    debug_info = DebugInfo.from_modules([main, mult])
+    assert debug_info.file(7) == "mult.j"
+    assert debug_info.line(7) == 2
+    assert debug_info.text(8) == "jmp .start"
+    assert debug_info.label(8) == "mult"
+
+
+@pytest.mark.parametrize("suffix", [".o", ".bin", ".hex"])
+def test_image_formats(tmp_path, suffix):
+    data = assemble((PROGRAMS / "primes.j").read_text())
+    path = tmp_path / f"primes{suffix}"
+    write_image(path, data)
+    assert read_image(path) == data
+
+
+def test_intel_hex(tmp_path):
+    path = tmp_path / "a.hex"
+    write_image(path, bytes(range(20)))
+    assert path.read_text().splitlines() == [
+        ":10000000000102030405060708090A0B0C0D0E0F78",
+        ":0400100010111213A6",
+        ":00000001FF",
+    ]
+
+    # Gaps are erased flash
+    path.write_text(":020004000102F7\n:00000001FF\n")
+    assert read_image(path) == b"\xff" * 4 + b"\x01\x02"
+
+    path.write_text(":020004000102F8\n:00000001FF\n")
+    with pytest.raises(ImageError):
+        read_image(path)
+
+    # Start addresses are ignored
+    path.write_text(":0400000500000100F6\n:0100000001FE\n:00000001FF\n")
+    assert read_image(path) == b"\x01"
+
+    # Nothing past the ROM is allocated
+    path.write_text(":02000004FFFFFC\n:0100000001FE\n:00000001FF\n")
+    with pytest.raises(ImageError):
+        read_image(path)
+
+    # Binary images that happen to start with ':' (0x3a)
+    path = tmp_path / "a.bin"
+    path.write_bytes(b":\x00\xff")
+    assert read_image(path) == b":\x00\xff"
+
+    # Only a .bin is read as raw bytes, anything else has to parse
+    for content in (b":\x00\xff", b"v2.0 raw\n30 0g", b"\x30\x00"):
+        path = tmp_path / "a.o"
+        path.write_bytes(content)
+        with pytest.raises(ImageError):
+            read_image(path)
@@ -0,0 +1,417 @@
+import sys
+import math
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from emulator import (
+    Computer,
+    FastComputer,
+    read_raw,
+    spi_cycles,
+    ALU_CYCLES,
+    CU_STATES,
+    profile_run,
+    PagedMemory,
+    PAGE_SIZE,
+    FULL_SIZE,
+)
+from emulator import fast
+from emulator.alu import evaluate
+from assembler import assemble_debug
+
+PROGRAMS = Path(__file__).resolve().parent.parent / "example_programs" / "assembly"
+
+
+def run(name, cycles, address_24bit=False, inputs=[]):
+    computer = Computer(read_raw(PROGRAMS / name), address_24bit, inputs)
+    computer.run(cycles)
+    return computer
+
+
+@pytest.mark.parametrize("address_24bit", [False, True])
+def test_add_example(address_24bit):
+    computer = run("add_program.o", 100000, address_24bit)
+    assert computer.halted
+    assert computer.outputs == [34]
+
+
+@pytest.mark.parametrize("address_24bit", [False, True])
+def test_input_example(address_24bit):
+    computer = run("input_program.o", 20000, address_24bit, [41, 42, 43])
+    assert computer.outputs[:3] == [-1 & 0xFF, 0, 1]
+
+
+def test_outputs_are_changes():
+    # Like test_full.run(), which can only see uo_out change
+    program, _ = assemble_debug(
+        "load rom a 0\nout a\nload rom a 5\nout a\nout a\nhalt\n", "out.j"
+    )
+    computer = Computer(program)
+    computer.run()
+    assert computer.outputs == [5]
+
+
+@pytest.mark.parametrize("address_24bit", [False, True])
+def test_ram_example(address_24bit):
+    computer = run("memory_test.o", 100000, address_24bit)
+    assert computer.ram[21] == 12
+    assert computer.ram[43] == 34
+    assert computer.ram[65] == 56
+    assert computer.outputs == [34, 56]
+
+
+@pytest.mark.parametrize("address_24bit", [False, True])
+def test_large_numbers_example(address_24bit):
+    computer = run("large_numbers.o", 1000000, address_24bit)
+    a = 4567 + 1234
+    b = 1234 * 5678
+    assert computer.halted
+    assert computer.outputs == [
+        a & 0xFF,
+        (a >> 8) & 0xFF,
+        b & 0xFF,
+        (b >> 8) & 0xFF,
+        (b >> 16) & 0xFF,
+        (b >> 24) & 0xFF,
+    ]
+
+
+def test_division_example():
+    assert run("division_test.o", 1000000).outputs == [4, 7]
+    assert run("div_mult_test.o", 1000000).outputs == [7, 115, 1]
+
+
+def test_primes_example():
+    outputs = run("primes.o", 1000000).outputs
+    assert len(outputs) > 10
+    for output in outputs:
+        assert all(output % i != 0 for i in range(2, int(math.sqrt(output)) + 1))
+
+
+def test_cycle_counts():
+    # nop is a fetch plus two empty FLAGS states
+    computer = Computer([0x00, 0xFF])
+    computer.step()
+    assert computer.cycles == spi_cycles() + 1 + 4
+
+    # opp a+b goes through the ALU once
+    computer = Computer([0x6C, 0xFF], address_24bit=True)
+    computer.step()
+    assert computer.cycles == spi_cycles(True) + 1 + 4 + ALU_CYCLES
+
+
+def test_alu_flags_before_invert():
+    # opp -1 computes 0 and inverts it, the zero flag sees the 0
+    aluout, zflag, oflag, cflag, sflag = evaluate(0xB7, 0x12, 0x34)
+    assert aluout == 0xFF
+    assert zflag == 1
+    assert sflag == 0
+
+
+def test_profile():
+    text = (PROGRAMS / "division_test.j").read_text()
+    program, debug_info = assemble_debug(text, "division_test.j")
+    computer = Computer(program)
+    profile = profile_run(computer)
+
+    # Every cycle is accounted for, in the states the CU really goes through
+    assert profile.cycles() == computer.cycles
+    assert sum(profile.executed.values()) == computer.instructions
+    assert set(profile.state_totals()) <= set(CU_STATES)
+
+    lines = profile.by_line(debug_info)
+    assert sum(lines.values()) == computer.cycles
+    for ln in lines:
+        assert text.splitlines()[ln - 1].strip()
+
+    # opp a-b goes round the loop 8 times, with an ALU operation each time
+    assert lines[6] == 8 * (spi_cycles(False) + 5 + ALU_CYCLES)
+    report = profile.report(debug_info).split("Source lines:")[1]
+    rows = [x.split() for x in report.split("CU states:")[0].splitlines()[2:]]
+    assert ["6", "8", "640", "9.0", "opp", "a-b"] in rows
+
+    folded = profile.folded(debug_info, "division_test")
+    assert sum(int(x.rsplit(" ", 1)[1]) for x in folded.splitlines()) == computer.cycles
+
+
+def test_paged_memory(tmp_path):
+    memory = PagedMemory()
+    assert memory[0xFFFFFF] == 0xFF
+    assert not memory.pages
+
+    memory[0x123456] = 5
+    memory.load(PAGE_SIZE - 1, b"\x01\x02")
+    assert memory[0x123456] == 5
+    assert memory[PAGE_SIZE - 2 : PAGE_SIZE + 2] == b"\xff\x01\x02\xff"
+    assert len(memory.pages) == 3
+    assert memory.dirty_ranges() == [
+        (0, 2 * PAGE_SIZE),
+        (0x123000, 0x123000 + PAGE_SIZE),
+    ]
+    with pytest.raises(IndexError):
+        memory[FULL_SIZE] = 0
+
+    snapshot = memory.snapshot()
+    memory.clear_dirty()
+    memory[0x123456] = 6
+    memory[0x800000] = 7
+    assert memory.dirty_ranges() == [
+        (0x123000, 0x123000 + PAGE_SIZE),
+        (0x800000, 0x800000 + PAGE_SIZE),
+    ]
+    assert memory.changes(snapshot) == [(0x123456, 5, 6), (0x800000, 0xFF, 7)]
+
+    memory.restore(snapshot)
+    assert memory[0x123456] == 5
+    assert memory[0x800000] == 0xFF
+    assert memory.changes(snapshot) == []
+
+    # Backed by a mapped image, written pages are copies
+    image = tmp_path / "a.bin"
+    image.write_bytes(bytes(range(10)))
+    memory = PagedMemory.from_file(image)
+    assert memory[3] == 3
+    assert memory[10] == 0xFF
+    memory[3] = 0x33
+    assert memory[3] == 0x33
+    assert memory[4] == 4
+    assert image.read_bytes() == bytes(range(10))
+
+
+@pytest.mark.parametrize(
+    "modes",
+    [{}, {"signed_mode": True}, {"carry_mode": True, "carryin": 1}],
+)
+def test_alu_table(modes):
+    alu_table = pytest.importorskip("emulator.alu_table")
+
+    expected = alu_table.table(**modes)
+    assert expected.shape == (len(alu_table.OPCODES), len(alu_table.FIELDS), 0x10000)
+
+    # The vectorised model against the scalar one the emulator runs
+    pairs = [a << 8 | b for a in (0, 1, 0x7F, 0x80, 0xFF) for b in range(256)]
+    assert alu_table.cross_check(expected, pairs=pairs, **modes) == []
+
+    index = alu_table.OPCODES.index(0x84)
+    assert expected[index, 0, 13 << 8 | 11] == 143
+
+
+def test_latency_benchmark():
+    from latency import benchmark_program, emulator_latencies
+
+    # Every instruction in the benchmark carries on to the next one
+    program, placed = benchmark_program()
+    computer = Computer(program)
+    visited = []
+    while computer.step():
+        visited.append(computer.pc)
+    assert computer.halted and computer.pc == len(program) - 1
+    assert set(placed) <= {0, *visited}
+
+    results = emulator_latencies()
+    assert results["alu/6c opp a+b"] == ALU_CYCLES
+    assert results["spi/16bit/rom read"] == spi_cycles()
+    assert results["spi/24bit/ram write"] == spi_cycles(True)
+    assert results["cu/16bit/nop"] == spi_cycles() + 1 + 4
+
+
+def test_trace(tmp_path):
+    from emulator.trace import TraceWriter, TraceReader, trace_run, first_divergence
+
+    program = (PROGRAMS / "memory_test.j").read_text()
+    computer = Computer(assemble_debug(program)[0])
+    with TraceWriter(tmp_path / "a.trace") as writer:
+        trace_run(computer, writer)
+
+    with TraceReader(tmp_path / "a.trace") as trace:
+        assert len(trace) == computer.instructions - 1
+        assert trace[-1].areg == computer.areg
+        assert any(x.write for x in trace)
+        n = len(trace) // 2
+        assert trace.find_cycle(trace[n].cycles) == n
+        assert first_divergence(trace, trace) is None
+
+        # A register that's off by one from some instruction on
+        changed = [x._replace(breg=x.breg + (i >= n)) for i, x in enumerate(trace)]
+        assert first_divergence(trace, changed) == n
+        assert first_divergence(trace, list(trace)[:-1]) == len(trace) - 1
+
+
+def test_lockstep():
+    from emulator.trace import record
+    from emulator.lockstep import Lockstep
+
+    text = (PROGRAMS / "division_test.j").read_text()
+    program, debug_info = assemble_debug(text, "division_test.j")
+
+    # Another engine's retired instructions, here from a second emulator
+    engine = Computer(program)
+    retired = []
+    while True:
+        pc = engine.pc
+        if not engine.step():
+            break
+        retired.append(record(engine, pc))
+
+    lockstep = Lockstep(Computer(program), debug_info)
+    for x in retired:
+        lockstep.write(x)
+    lockstep.finish(engine.halted)
+    assert not lockstep.diverged
+
+    # The engine gets one register wrong
+    n = len(retired) // 2
+    lockstep = Lockstep(Computer(program), debug_info)
+    for i, x in enumerate(retired):
+        lockstep.write(x if i != n else x[:3] + ((x[3] + 1) & 0xFF,) + x[4:])
+    assert lockstep.diverged
+    assert "instruction %d, differs in areg" % n in lockstep.report
+    assert "division_test.j:" in lockstep.report
+
+    # Or halts early
+    lockstep = Lockstep(Computer(program))
+    for x in retired[:n]:
+        lockstep.write(x)
+    lockstep.finish(True)
+    assert "the engine halted" in lockstep.report
+
+
+def test_fuzzer():
+    from fuzz import Fuzzer, Program, minimize
+    from assembler import assemble
+
+    fuzzer = Fuzzer(seed=1)
+    fuzzer.run(programs=200)
+    assert fuzzer.corpus and not fuzzer.failures
+    for program in fuzzer.corpus:
+        assert assemble(program.source(fuzzer.isa.templates)) == program.image()
+
+    # Jumps into removed instructions land on what follows them
+    program = Program([(0x00, None), (0x30, (2,)), (0x01, None), (0x02, None)])
+    assert program.without(2, 3).instructions[1] == (0x30, (2,))
+    assert program.without(0, 1).instructions[0] == (0x30, (1,))
+
+    def has_multiply(candidates):
+        for x in candidates:
+            if any(opcode == 0x85 for opcode, _ in x.instructions):
+                return x
+        return None
+
+    longer = Program(program.instructions + [(0x85, None)] + program.instructions)
+    assert minimize(longer, has_multiply).instructions == [(0x85, None)]
+
+
+def machine_state(computer):
+    return {k: v for k, v in vars(computer).items() if k != "rom"}
+
+
+@pytest.mark.parametrize("hot", [1, fast.HOT])
+@pytest.mark.parametrize("address_24bit", [False, True])
+@pytest.mark.parametrize("name", sorted(x.name for x in PROGRAMS.glob("*.o")))
+def test_fast_computer(name, address_24bit, hot, monkeypatch):
+    # With HOT at 1 every entry is translated, otherwise cold code is stepped
+    monkeypatch.setattr(fast, "HOT", hot)
+    program = read_raw(PROGRAMS / name)
+    for budget in ({"cycles": 200000}, {"instructions": 777}, {"cycles": 12345}):
+        expected = Computer(program, address_24bit, [41, 42, 43])
+        expected.run(**budget)
+        computer = FastComputer(program, address_24bit, [41, 42, 43])
+        computer.run(**budget)
+        assert machine_state(computer) == machine_state(expected)
+        assert computer.rom == expected.rom
+
+
+def test_fast_computer_rom_writes():
+    program, _ = assemble_debug(":loop\nload rom a 1\nout a\njmp loop\n", "loop.j")
+    computer = FastComputer(program)
+    computer.run(instructions=10)
+    assert set(computer.outputs) == {1}
+
+    # The translated loop has the 1 folded in
+    computer.rom[1] = 2
+    computer.run(instructions=20)
+    assert computer.outputs[-1] == 2
+
+    # As do the counts of entries to them
+    computer.reset()
+    assert computer.rom.blocks == {}
+
+
+def test_fast_computer_straight_line():
+    # Code that runs once is only stepped, so it can't be much slower than
+    # Computer. CPU time, the best of a few runs and some margin keep this
+    # steady on a busy machine
+    program, _ = assemble_debug(
+        "mov a b\nopp a+b\nout a\nload rom b 3\n" * 1000 + "halt\n", "line.j"
+    )
+    best = {Computer: math.inf, FastComputer: math.inf}
+    for _ in range(15):
+        for cls in best:
+            computer = cls(program)
+            start = time.process_time()
+            computer.run()
+            best[cls] = min(best[cls], time.process_time() - start)
+    assert computer.rom.blocks == {0: 1}
+    assert best[FastComputer] < best[Computer] * 1.2
+
+
+@pytest.mark.parametrize("address_24bit", [False, True])
+def test_batch_computer(address_24bit):
+    np = pytest.importorskip("numpy")
+    from emulator.batch import BatchComputer, sweep_inputs
+
+    program = read_raw(PROGRAMS / "input_program.o")
+    inputs = sweep_inputs(1) + [[41, 42, 43], [], [42, 7, 200, 42]]
+    computer = BatchComputer(program, inputs, address_24bit)
+    computer.run(cycles=20000)
+
+    for i, x in enumerate(inputs):
+        expected = Computer(program, address_24bit, x)
+        expected.run(20000)
+        assert computer.outputs(i) == expected.outputs
+        for name in ("pc", "areg", "breg", "zflag", "sflag", "cycles"):
+            assert getattr(computer, name)[i] == getattr(expected, name)
+
+    # Only the masked machines step
+    program = read_raw(PROGRAMS / "memory_test.o")
+    computer = BatchComputer(program, [[], []])
+    computer.step(np.array([True, False]))
+    assert list(computer.instructions) == [1, 0]
+    computer.run()
+    assert computer.halted.all()
+    assert list(computer.ram(43)) == [34, 34]
+
+
+def test_checkpoint(tmp_path):
+    from emulator.checkpoint import Checkpoint, capture, restore, fast_forward, STATE
+
+    text = (PROGRAMS / "memory_test.j").read_text()
+    program, debug_info = assemble_debug(text, "memory_test.j")
+    expected = Computer(program, True)
+    expected.run(100000)
+
+    computer = Computer(program, True)
+    computer.run(instructions=8)
+    capture(computer).save(tmp_path / "memory_test.ckpt")
+    checkpoint = Checkpoint.load(tmp_path / "memory_test.ckpt")
+
+    for engine in (None, FastComputer((), True)):
+        computer = restore(checkpoint, engine)
+        computer.run(100000)
+        for name in STATE:
+            assert getattr(computer, name) == getattr(expected, name)
+        assert computer.ram == expected.ram
+        assert computer.outputs == expected.outputs
+
+    # Up to a label, the first time the program gets there
+    program, debug_info = assemble_debug(
+        (PROGRAMS / "primes.j").read_text(), "primes.j"
+    )
+    computer = Computer(program)
+    assert fast_forward(computer, address=debug_info.labels["nextprime"])
+    assert computer.pc == debug_info.labels["nextprime"]
+    assert not fast_forward(computer, 100, address=0xFFFF)
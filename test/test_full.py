@@ -1,12 +1,88 @@
+import os
+import sys
 import math
 import glob
 from pathlib import Path
 
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import Timer, ClockCycles
-
-RAM = [0xFF] * 65536
+from cocotb.handle import Force, Release
+from cocotb.triggers import (
+    Timer,
+    ClockCycles,
+    Edge,
+    First,
+    Event,
+    RisingEdge,
+    FallingEdge,
+    ReadOnly,
+)
+from cocotb.utils import get_sim_time
+
+# The emulator and assembler packages live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spi_memory import start_memories
+from assembler import DebugInfo, read_image
+from emulator import (
+    Computer,
+    CU_STATES,
+    PagedMemory,
+    FULL_SIZE,
+    PAGE_SIZE,
+    default_roms,
+    spi_cycles,
+    ALU_CYCLES,
+)
+from emulator.lockstep import Lockstep
+from emulator.checkpoint import fast_forward, capture, restore
+from emulator.trace import pack_flags, ram_write
+
+ROM_SIZE = 0x10000
+
+# Pages are only allocated as the program writes them, so RAM can cover all
+# of the 24 bit address space above the ROM
+RAM = PagedMemory(ROM_SIZE)
+
+# Set by run(), how many clock cycles the last program took and whether it
+# got to a halt
+CYCLES = 0
+HALTED = False
+
+CLOCK_PERIOD_US = 10
+
+# The gate level netlist (make GATES=yes) only has the top level pins
+GATE_LEVEL = os.environ.get("GATES", "") == "yes"
+
+# LOCKSTEP=1 runs the emulator alongside the tests, failing at the first
+# instruction where they disagree. It watches the CU's internals, so it's off
+# by default at gate level
+LOCKSTEP = os.environ.get("LOCKSTEP", "0" if GATE_LEVEL else "1") == "1"
+
+# Starting from a checkpoint forces registers inside the design, which
+# Verilator's VPI can't do and the gate level netlist doesn't have
+CAN_FORCE = not GATE_LEVEL and not (cocotb.SIM_NAME or "").lower().startswith(
+    "verilator"
+)
+
+# Where the design keeps each register of an emulator.checkpoint.Checkpoint
+CHECKPOINT_SIGNALS = [
+    ("pc", "cu_module.pc_reg"),
+    ("mar", "mar"),
+    ("mpage", "mpage"),
+    ("areg", "areg"),
+    ("breg", "breg"),
+    ("creg", "creg"),
+    ("dreg", "dreg"),
+    ("oreg", "oreg"),
+    ("highbits", "jmp_module.highbits"),
+    ("zflag", "cmp_module.zflag"),
+    ("oflag", "cmp_module.oflag"),
+    ("cflag", "cmp_module.cflag"),
+    ("sflag", "cmp_module.sflag"),
+    ("carry_mode", "alu_module.carry_mode"),
+    ("signed_mode", "alu_module.signed_mode"),
+]
 
 
 class MicroMock(object):
@@ -14,147 +90,334 @@ class MicroMock(object):
         self.__dict__.update(kwargs)
 
 
-async def setup(dut):
-    global RAM
-    RAM = [0xFF] * 65536
+def has_internals(dut):
+    # Whether the design's hierarchy (cu_module, pc, ...) is there to watch
+    return hasattr(dut.tt_um_aerox2_jrb8_computer, "cu_module")
+
 
-    computer = dut.tt_um_aerox2_jrb8_computer
-    clk = computer.clk
-    sclk = computer.uio_out[3]
+def checkpoint_signals(dut):
+    top = dut.tt_um_aerox2_jrb8_computer
+    for name, path in CHECKPOINT_SIGNALS:
+        signal = top
+        for part in path.split("."):
+            signal = getattr(signal, part)
+        yield name, signal
 
-    clock = Clock(clk, 10, units="us")
-    cocotb.start_soon(clock.start())
 
-    computer.rst_n.value = 1
+async def setup(dut, ROM, address_24bit=False, checkpoint=None):
+    """Resets the DUT and starts the clock and memories, running ROM from the
+    start or, given an emulator.checkpoint.Checkpoint, from there. The
+    checkpoint's registers are forced while the DUT is in reset and released
+    once it has started fetching."""
+    global RAM
+    if checkpoint is not None and not CAN_FORCE:
+        raise RuntimeError("Can't start from a checkpoint on %s" % cocotb.SIM_NAME)
+    RAM = PagedMemory(FULL_SIZE - ROM_SIZE if address_24bit else ROM_SIZE)
+    ROM = PagedMemory.from_bytes(ROM, ROM_SIZE)
+    if checkpoint is not None:
+        for start in range(0, len(checkpoint.ram), PAGE_SIZE):
+            page = checkpoint.ram[start : start + PAGE_SIZE]
+            if page != bytes([RAM.fill]) * len(page):
+                RAM.load(start, page)
+        # Only what the program writes from here on counts
+        RAM.clear_dirty()
+
+    clk = dut.clk
+
+    clock = Clock(clk, CLOCK_PERIOD_US, units="us")
+    clock_task = cocotb.start_soon(clock.start())
+
+    dut.ena.value = 1
+    dut.ui_in.value = 0
+    dut.rst_n.value = 1
     await Timer(10, "us")
-    computer.rst_n.value = 0
+    dut.rst_n.value = 0
+    if checkpoint is not None:
+        for name, signal in checkpoint_signals(dut):
+            signal.value = Force(int(checkpoint.state[name]))
+
+    # The memories need to be listening before the CPU starts fetching
+    dut.address_24bit.value = int(address_24bit)
+    memories = start_memories(dut, ROM, RAM, address_24bit)
     await Timer(10, "us")
-    computer.rst_n.value = 1
+    dut.rst_n.value = 1
+    if checkpoint is not None:
+        # Nothing writes them while fetching, so they keep the forced values
+        await RisingEdge(clk)
+        await FallingEdge(clk)
+        for _, signal in checkpoint_signals(dut):
+            signal.value = Release()
     # await Timer(10, 'us')
 
     mock = MicroMock(
-        ui_in=computer.ui_in,
-        uo_out=computer.uo_out,
-        uio_in=computer.uio_in,
-        uio_out=computer.uio_out,
-        uio_oe=computer.uio_oe,
-        ena=computer.ena,
-        rst_n=computer.rst_n,
+        ui_in=dut.ui_in,
+        uo_out=dut.uo_out,
+        uio_in=dut.uio_in,
+        uio_out=dut.uio_out,
+        uio_oe=dut.uio_oe,
+        ena=dut.ena,
+        rst_n=dut.rst_n,
     )
 
-    return mock, clk, sclk
-
-
-async def wait_for_sclk(sclk, v):
-    q = sclk.value
-    while q != v:
-        q = sclk.value
-        await Timer(5, "us")
-
-
-async def send_data(computer, sclk, ROM, address_24bit, cs_ram):
-    read_or_write = 0
-    for i in range(8):
-        await wait_for_sclk(sclk, 1)
-        read_or_write |= computer.uio_out[1].value.integer << (7 - i)
-        await wait_for_sclk(sclk, 0)
-    assert bin(read_or_write) == bin(0x2) or bin(read_or_write) == bin(0x3)
-
-    address = 0
-    v = 24 if address_24bit else 16
-    for i in range(v):
-        await wait_for_sclk(sclk, 1)
-        address |= computer.uio_out[1].value.integer << (v - 1 - i)
-        await wait_for_sclk(sclk, 0)
-
-    if address >= 0x10000 or cs_ram:
-        address -= 0x10000
-        if read_or_write == 0x2:
-            # Write
-            data = 0
-            for i in range(8):
-                await wait_for_sclk(sclk, 1)
-                data |= computer.uio_out[1].value.integer << (7 - i)
-                await wait_for_sclk(sclk, 0)
-            await wait_for_sclk(sclk, 0)
-
-            # print("Written data is", data, "at", address)
-            RAM[address] = data
-        else:
-            # Read
-            data = RAM[address]
-            # print("Read data is", data)
-            for i in range(8):
-                await wait_for_sclk(sclk, 0)
-                computer.uio_in[2].value = (data >> (7 - i)) & 1
-                await wait_for_sclk(sclk, 1)
-            await wait_for_sclk(sclk, 0)
-            computer.uio_in[2].value = 0
-    else:
-        assert bin(read_or_write) == bin(0x03)
-        data = ROM[address]
-        # print("Reading ROM from", address, "which is", data)
-
-        for i in range(8):
-            await wait_for_sclk(sclk, 0)
-            computer.uio_in[2].value = (data >> (7 - i)) & 1
-            await wait_for_sclk(sclk, 1)
-        await wait_for_sclk(sclk, 0)
-        computer.uio_in[2].value = 0
-
-
-async def run(dut, ROM, cycles, address_24bit=False, inputs=[]):
-    computer, clk, sclk = await setup(dut)
+    return mock, clk, [clock_task, *memories]
+
+
+async def monitor_outputs(
+    computer, outputs, inputs, expected_outputs, done, current_input=0
+):
+    while True:
+        await Edge(computer.uo_out)
+        outputs.append(computer.uo_out.value.integer)
+        if current_input + 1 < len(inputs):
+            current_input += 1
+            computer.ui_in.value = inputs[current_input]
+        if expected_outputs is not None and len(outputs) > expected_outputs:
+            done.set()
+
+
+async def monitor_halt(halt, halted):
+    while True:
+        await Edge(halt)
+        if halt.value.is_resolvable and halt.value.integer:
+            halted.set()
+            return
+
+
+async def monitor_idle(clk, memories, halted, window):
+    # Without the CU's halt signal, a CPU that hasn't finished an SPI
+    # transaction in window cycles has halted. The ALU and the CU's own
+    # states never take longer than that between two transactions
+    transfers = None
+    while True:
+        await ClockCycles(clk, window)
+        now = sum(memory.reads + memory.writes for memory in memories)
+        if now == transfers:
+            halted.set()
+            return
+        transfers = now
+
+
+async def profile_cu(clk, computer, profile):
+    # Costs a Python callback every clock, so only runs when asked for
+    cu = computer.cu_module
+    pc = 0
+    previous = None
+    while True:
+        await RisingEdge(clk)
+        if not cu.cu_state.value.is_resolvable:
+            continue
+        state = CU_STATES[cu.cu_state.value.integer]
+        if state == "UPDATE_SPI" and previous != "UPDATE_SPI":
+            # The address of the instruction being fetched
+            pc = computer.pc.value.integer
+        profile.add(pc, state, 1, state != previous)
+        previous = state
+
+
+async def trace_cu(computer, sinks, start, lockstep=None, diverged=None, pc=0):
+    # Hands every retired instruction to each of sinks (TraceWriters and the
+    # Lockstep), sets diverged once lockstep has. Only wakes up when cu_state changes, a few times an
+    # instruction, which is cheap enough to leave on
+    cu = computer.cu_module
+    cmp = computer.cmp_module
+    alu = computer.alu_module
+    roms = default_roms()
+    while True:
+        await Edge(cu.cu_state)
+        await ReadOnly()
+        state = cu.cu_state.value
+        if not state.is_resolvable or CU_STATES[state.integer] != "UPDATE_SPI":
+            continue
+
+        # Back in UPDATE_SPI, the previous instruction has retired
+        opcode = cu.ir_reg.value.integer
+        mpage = computer.mpage.value.integer
+        mar = computer.mar.value.integer
+        retired = (
+            int((get_sim_time("us") - start) // CLOCK_PERIOD_US),
+            pc,
+            opcode,
+            computer.areg.value.integer,
+            computer.breg.value.integer,
+            computer.creg.value.integer,
+            computer.dreg.value.integer,
+            pack_flags(
+                cmp.zflag.value.integer,
+                cmp.oflag.value.integer,
+                cmp.cflag.value.integer,
+                cmp.sflag.value.integer,
+                alu.carry_mode.value.integer,
+                alu.signed_mode.value.integer,
+            ),
+            mar,
+            mpage,
+            computer.oreg.value.integer,
+            *ram_write(roms, opcode, mpage, mar, RAM),
+        )
+        for sink in sinks:
+            sink.write(retired)
+        if lockstep is not None and lockstep.diverged:
+            diverged.set()
+            return
+        pc = computer.pc.value.integer
+
+
+async def run(
+    dut,
+    ROM,
+    cycles,
+    address_24bit=False,
+    inputs=[],
+    expected_outputs=None,
+    profile=None,
+    debug_info=None,
+    trace=None,
+    lockstep=False,
+    checkpoint=None,
+):
+    """Runs ROM for at most cycles clock cycles and returns the values uo_out
+    took, starting with its value before the program ran.
+
+    Stops early once the CU halts or, when expected_outputs is given, once
+    the program has output that many values. At gate level, where there is
+    no halt signal to watch, halting is taken to be the SPI bus going quiet. Given an emulator.Profile,
+    the cycles spent in every CU state are recorded in it per instruction,
+    and given an emulator.trace.TraceWriter every retired instruction is.
+    With lockstep, the emulator runs alongside and the run fails at the
+    first instruction where they disagree. Given a checkpoint, the program
+    carries on from it instead of starting from reset, and uo_out starts
+    at the value it had there.
+    """
+    global CYCLES, HALTED
+    computer, clk, (clock_task, *memories) = await setup(
+        dut, ROM, address_24bit, checkpoint
+    )
 
     # Only for debugging
     _computer = dut.tt_um_aerox2_jrb8_computer
 
-    computer.uio_in[7].value = address_24bit
-
-    outputs = []
-    current_input = -1
-    previous_output = None
-
-    for cycle in range(cycles):
-        await ClockCycles(clk, 1)
-
-        current_output = computer.uo_out.value
-        if current_output != previous_output:
-            outputs.append(current_output)
-            if len(inputs) > 0:
-                if current_input + 1 < len(inputs):
-                    current_input += 1
-                computer.ui_in.value = inputs[current_input]
-        previous_output = current_output
-
-        try:
-            cs_rom = computer.uio_out[0] == 0
-            cs_ram = computer.uio_out[4] == 0
-
-            v = (cs_rom) if address_24bit else (cs_rom | cs_ram)
-            if v:
-                await send_data(
-                    computer,
-                    sclk,
-                    ROM,
-                    address_24bit,
-                    cs_ram and not address_24bit,
-                )
-        except Exception as e:
-            print(e)
-            print(f"Failure at cycle: {cycle}")
-            print(f"PC was: {_computer.pc.value.integer}")
-            print(RAM[:50])
-            break
+    first_input = 0 if checkpoint is None else checkpoint.input_index
+    outputs = [computer.uo_out.value.integer]
+    if len(inputs) > 0:
+        computer.ui_in.value = inputs[first_input]
+    done = Event()
+    halted = Event()
+    monitor = cocotb.start_soon(
+        monitor_outputs(computer, outputs, inputs, expected_outputs, done, first_input)
+    )
+    if has_internals(dut):
+        halt_monitor = cocotb.start_soon(monitor_halt(_computer.cu_module.halt, halted))
+    else:
+        window = 2 * spi_cycles(address_24bit) + ALU_CYCLES
+        halt_monitor = cocotb.start_soon(monitor_idle(clk, memories, halted, window))
+
+    profiler = None
+    if profile is not None:
+        profiler = cocotb.start_soon(profile_cu(clk, _computer, profile))
+
+    start = get_sim_time("us")
+    sinks = [] if trace is None else [trace]
+    model = None
+    diverged = Event()
+    if lockstep and not has_internals(dut):
+        dut._log.info("No CU to watch, running without lockstep")
+        lockstep = False
+    if lockstep:
+        if checkpoint is None:
+            model = Lockstep(Computer(ROM, address_24bit, inputs), debug_info)
+        else:
+            model = Lockstep(restore(checkpoint), debug_info)
+        sinks.append(model)
+    tracer = None
+    if sinks:
+        pc = 0
+        traced_start = start
+        if checkpoint is not None:
+            # Traces count cycles from the start of the program
+            pc = checkpoint.state["pc"]
+            traced_start -= checkpoint.state["cycles"] * CLOCK_PERIOD_US
+        tracer = cocotb.start_soon(
+            trace_cu(_computer, sinks, traced_start, model, diverged, pc)
+        )
+
+    await First(
+        ClockCycles(clk, cycles),
+        done.wait(),
+        halted.wait(),
+        diverged.wait(),
+        *[m.failed.wait() for m in memories],
+    )
+    CYCLES = int((get_sim_time("us") - start) // CLOCK_PERIOD_US)
+    HALTED = halted.is_set()
+    dut._log.info(
+        "Ran %d of %d cycles%s" % (CYCLES, cycles, ", halted" if HALTED else "")
+    )
+
+    monitor.kill()
+    halt_monitor.kill()
+    if profiler is not None:
+        profiler.kill()
+    if tracer is not None:
+        tracer.kill()
+    for memory in memories:
+        memory.stop()
+        if memory.error is not None:
+            print(memory.error)
+            if has_internals(dut):
+                pc = _computer.pc.value.integer
+                if debug_info is not None:
+                    print(f"PC was: {debug_info.symbolize(pc)}")
+                else:
+                    print(f"PC was: {pc}")
+            print(list(RAM[:50]))
+    clock_task.kill()
+
+    if model is not None:
+        model.finish(HALTED)
+        assert not model.diverged, model.report
     return outputs
 
 
-async def load_and_run(dut, path, steps, address_24bit=False, inputs=[]):
-    with open(path, "r") as f:
-        program_d = f.readlines()
-    program_b = [int(x, 16) for x in program_d[1].split()]
+async def load_and_run(
+    dut, path, steps, address_24bit=False, inputs=[], expected_outputs=None
+):
+    program_b = list(read_image(path))
+    debug_info = DebugInfo.find(path, program_b)
+
+    return await run(
+        dut,
+        program_b,
+        steps,
+        address_24bit,
+        inputs,
+        expected_outputs,
+        debug_info=debug_info,
+        lockstep=LOCKSTEP,
+    )
 
-    return await run(dut, program_b, steps, address_24bit, inputs)
+
+async def run_from(dut, checkpoint, cycles, expected_outputs=None, debug_info=None):
+    """Runs on from checkpoint for at most cycles, see run()."""
+    return await run(
+        dut,
+        list(checkpoint.rom),
+        cycles,
+        checkpoint.address_24bit,
+        checkpoint.inputs,
+        expected_outputs,
+        debug_info=debug_info,
+        lockstep=LOCKSTEP,
+        checkpoint=checkpoint,
+    )
+
+
+def address_modes():
+    # ADDRESS_24BIT=0/1 restricts a run to one SPI address mode, which lets
+    # runner.py shard the tests, otherwise both modes are tested
+    mode = os.environ.get("ADDRESS_24BIT", "")
+    if mode == "":
+        return [False, True]
+    return [mode == "1"]
 
 
 def string_to_dict(s):
@@ -167,134 +430,99 @@ def string_to_dict(s):
 
 @cocotb.test()
 async def test_add_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/add_program.o", 200)
-    assert outputs[1] == 34
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/add_program.o", 200, True
-    )
-    assert outputs[1] == 34
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/add_program.o", 1000, address_24bit
+        )
+        assert outputs[1] == 34
 
 
 @cocotb.test()
 async def test_output_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/output.o", 200)
-    assert outputs[1] == 13
-    assert outputs[2] == 37
-    assert outputs[3] == 74
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/output.o", 200, True
-    )
-    assert outputs[1] == 13
-    assert outputs[2] == 37
-    assert outputs[3] == 74
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/output.o", 2000, address_24bit
+        )
+        assert outputs[1] == 13
+        assert outputs[2] == 37
+        assert outputs[3] == 74
 
 
 @cocotb.test()
 async def test_input_example(dut):
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/input_program.o", 500, False, [41, 42, 43]
-    )
-    assert outputs[1] == -1 & 0xFF
-    assert outputs[2] == 0
-    assert outputs[3] == 1
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/input_program.o", 500, True, [41, 42, 43]
-    )
-    assert outputs[1] == -1 & 0xFF
-    assert outputs[2] == 0
-    assert outputs[3] == 1
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut,
+            "../example_programs/assembly/input_program.o",
+            10000,
+            address_24bit,
+            [41, 42, 43],
+            expected_outputs=3,
+        )
+        assert outputs[1] == -1 & 0xFF
+        assert outputs[2] == 0
+        assert outputs[3] == 1
 
 
 @cocotb.test()
 async def test_jmp_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/jmp_program.o", 300)
-    assert outputs[1] == 6
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/jmp_program.o", 300, True
-    )
-    assert outputs[1] == 6
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/jmp_program.o", 2500, address_24bit
+        )
+        assert outputs[1] == 6
 
 
 @cocotb.test()
 async def test_division_example(dut):
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/division_test.o", 2000
-    )
-    assert outputs[1] == 4
-    assert outputs[2] == 7
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/division_test.o", 2000, True
-    )
-    assert outputs[1] == 4
-    assert outputs[2] == 7
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/division_test.o", 10000, address_24bit
+        )
+        assert outputs[1] == 4
+        assert outputs[2] == 7
 
 
 @cocotb.test()
 async def test_division_example_2(dut):
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/div_mult_test.o", 900
-    )
-    assert outputs[1] == 7
-    assert outputs[2] == 115
-    assert outputs[3] == 1
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/div_mult_test.o", 900, True
-    )
-    assert outputs[1] == 7
-    assert outputs[2] == 115
-    assert outputs[3] == 1
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/div_mult_test.o", 2000, address_24bit
+        )
+        assert outputs[1] == 7
+        assert outputs[2] == 115
+        assert outputs[3] == 1
 
 
 @cocotb.test()
 async def test_ram_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/memory_test.o", 300)
-    assert RAM[21] == 12
-    assert RAM[43] == 34
-    assert RAM[65] == 56
-    assert outputs[1] == 34
-    assert outputs[2] == 56
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/memory_test.o", 300, True
-    )
-    assert RAM[21] == 12
-    assert RAM[43] == 34
-    assert RAM[65] == 56
-    assert outputs[1] == 34
-    assert outputs[2] == 56
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/memory_test.o", 2500, address_24bit
+        )
+        assert RAM[21] == 12
+        assert RAM[43] == 34
+        assert RAM[65] == 56
+        # Nothing but the first page was written
+        assert RAM.dirty_ranges() == [(0, PAGE_SIZE)]
+        assert outputs[1] == 34
+        assert outputs[2] == 56
 
 
 @cocotb.test()
 async def test_large_numbers_example(dut):
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/large_numbers.o", 3000
-    )
-    a = 4567 + 1234
-    assert outputs[1] == a & 0xFF
-    assert outputs[2] == (a >> 8) & 0xFF
-
-    a = 1234 * 5678
-    assert outputs[3] == a & 0xFF
-    assert outputs[4] == (a >> 8) & 0xFF
-    assert outputs[5] == (a >> 16) & 0xFF
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/large_numbers.o", 3000, True
-    )
-    a = 4567 + 1234
-    assert outputs[1] == a & 0xFF
-    assert outputs[2] == (a >> 8) & 0xFF
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/large_numbers.o", 30000, address_24bit
+        )
+        a = 4567 + 1234
+        assert outputs[1] == a & 0xFF
+        assert outputs[2] == (a >> 8) & 0xFF
 
-    a = 1234 * 5678
-    assert outputs[3] == a & 0xFF
-    assert outputs[4] == (a >> 8) & 0xFF
-    assert outputs[5] == (a >> 16) & 0xFF
+        a = 1234 * 5678
+        assert outputs[3] == a & 0xFF
+        assert outputs[4] == (a >> 8) & 0xFF
+        assert outputs[5] == (a >> 16) & 0xFF
 
 
 def is_perfect_square(n):
@@ -308,17 +536,13 @@ def is_fibonacci(num):
 
 @cocotb.test()
 async def test_fibonacci_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/fibonacci.o", 500)
-    assert len(outputs) > 1
-    for output in outputs[1:]:
-        assert is_fibonacci(output)
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/fibonacci.o", 500, True
-    )
-    assert len(outputs) > 1
-    for output in outputs[1:]:
-        assert is_fibonacci(output)
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/fibonacci.o", 7000, address_24bit
+        )
+        assert len(outputs) > 1
+        for output in outputs[1:]:
+            assert is_fibonacci(output)
 
 
 def is_prime(n):
@@ -332,20 +556,29 @@ def is_prime(n):
 
 @cocotb.test()
 async def test_primes_example(dut):
-    outputs = await load_and_run(dut, "../example_programs/assembly/primes.o", 5000)
-    assert len(outputs) > 2
-    for output in outputs[2:]:
-        assert is_prime(output.integer)
-
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/primes.o", 5000, True
-    )
-    assert len(outputs) > 2
-    for output in outputs[2:]:
-        assert is_prime(output.integer)
-    outputs = await load_and_run(
-        dut, "../example_programs/assembly/primes.o", 5000, True
-    )
-    assert len(outputs) > 2
-    for output in outputs[2:]:
-        assert is_prime(output.integer)
+    for address_24bit in address_modes():
+        outputs = await load_and_run(
+            dut, "../example_programs/assembly/primes.o", 80000, address_24bit
+        )
+        assert len(outputs) > 2
+        for output in outputs[2:]:
+            assert is_prime(output)
+
+
+@cocotb.test(skip=not CAN_FORCE)
+async def test_checkpoint(dut):
+    # Gets to the primes past 40 without simulating the millions of cycles
+    # it takes to work them out
+    path = "../example_programs/assembly/primes.o"
+    program = list(read_image(path))
+    debug_info = DebugInfo.find(path, program)
+    for address_24bit in address_modes():
+        emulator = Computer(program, address_24bit)
+        emulator.run(1000000)
+        assert fast_forward(emulator, address=debug_info.labels["printprime"])
+        checkpoint = capture(emulator)
+
+        outputs = await run_from(dut, checkpoint, 40000, 1, debug_info)
+        assert outputs[0] == emulator.oreg
+        assert outputs[1] > 40
+        assert is_prime(outputs[1])
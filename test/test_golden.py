@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+
+import cocotb
+
+import test_full
+from golden import (
+    discover,
+    read_expectation,
+    load_program,
+    max_cycles,
+    check,
+    write_profile,
+    trace_path,
+)
+from emulator import Profile
+from emulator.trace import TraceWriter
+from assembler import DebugInfo
+
+
+def programs():
+    # golden.py runs one program per simulator through GOLDEN_PROGRAM,
+    # otherwise (make MODULE=test_golden) every program is run
+    path = os.environ.get("GOLDEN_PROGRAM", "")
+    if path:
+        return [path]
+    return discover()
+
+
+@cocotb.test()
+async def test_golden(dut):
+    failures = []
+    for path in programs():
+        expectation = read_expectation(path)
+        program = list(load_program(path))
+        debug_info = DebugInfo.find(Path(path).with_suffix(".o"), program)
+        for address_24bit in test_full.address_modes():
+            # Programs that never halt only need to print the expected prefix
+            expected_outputs = None
+            if not expectation.finite:
+                expected_outputs = len(expectation.outputs)
+            # golden.py --profile DIR
+            profile = None
+            if os.environ.get("GOLDEN_PROFILE", ""):
+                profile = Profile(address_24bit)
+            # golden.py --trace DIR
+            trace = None
+            if os.environ.get("GOLDEN_TRACE", ""):
+                trace = TraceWriter(
+                    trace_path(os.environ["GOLDEN_TRACE"], path, address_24bit),
+                    address_24bit,
+                )
+            outputs = await test_full.run(
+                dut,
+                program,
+                max_cycles(expectation, address_24bit),
+                address_24bit,
+                expectation.inputs,
+                expected_outputs,
+                profile,
+                debug_info,
+                trace,
+                lockstep=test_full.LOCKSTEP,
+            )
+            if trace is not None:
+                trace.close()
+            if profile is not None:
+                write_profile(os.environ["GOLDEN_PROFILE"], path, profile)
+            # The first value is uo_out before the program has run, and only
+            # changes of uo_out are seen
+            halted = test_full.HALTED if expectation.finite else None
+            error = check(expectation, outputs[1:], test_full.RAM, halted)
+            if error is not None:
+                failures.append("%s: %s" % (path, error))
+
+    assert not failures, "\n".join(failures)
@@ -0,0 +1,116 @@
+import csv
+import sys
+import shutil
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import isa.isa
+from isa import (
+    build,
+    default_isa,
+    load,
+    source_hash,
+    mem_tables,
+    cross_check,
+    write_mems,
+    InstructionSet,
+    IsaError,
+    ARTIFACT,
+    CU_FLAGS,
+    ALU_FLAGS,
+)
+from emulator import read_mem, ROM_DIR
+
+
+def test_artifact_up_to_date():
+    # Rebuild with `python -m isa` after editing the spreadsheets
+    isa = load()
+    assert isa.source == source_hash()
+    assert isa.to_bytes() == build().to_bytes()
+
+
+def test_default_isa(monkeypatch):
+    # Loads trust the artifact, `python -m isa --strict` checks it instead
+    def unexpected(*args):
+        raise AssertionError("default_isa() hashed the sheets")
+
+    monkeypatch.setattr(isa.isa, "source_hash", unexpected)
+    default_isa.cache_clear()
+    assert default_isa() is default_isa()
+    assert default_isa().to_bytes() == load().to_bytes()
+
+
+def test_round_trip():
+    isa = build()
+    loaded = InstructionSet.from_bytes(isa.to_bytes())
+    assert loaded.templates == isa.templates
+    assert loaded.flags_1 == isa.flags_1
+    assert loaded.flags_2 == isa.flags_2
+    assert loaded.alu_rom == isa.alu_rom
+    assert loaded.hash == isa.hash
+
+
+def test_matches_rtl_roms():
+    isa = load(ARTIFACT)
+    assert isa.cu_rom == read_mem(ROM_DIR / "cu_rom.mem")
+    assert isa.cu_rom_2 == read_mem(ROM_DIR / "cu_rom_2.mem")
+    assert isa.cu_flag_conv == read_mem(ROM_DIR / "cu_flag_conv.mem")
+    assert isa.alu_rom == read_mem(ROM_DIR / "alu_rom.mem")
+
+
+def test_write_mems_only_changed(tmp_path):
+    isa = build()
+    assert write_mems(isa) == []
+
+    for name in mem_tables(isa):
+        shutil.copy(ROM_DIR / ("%s.mem" % name), tmp_path)
+    (tmp_path / "alu_rom.mem").write_text("0")
+    assert write_mems(isa, tmp_path) == [tmp_path / "alu_rom.mem"]
+    assert read_mem(tmp_path / "alu_rom.mem") == isa.alu_rom
+    assert write_mems(isa, tmp_path) == []
+
+
+def test_write_mems_new_dir(tmp_path):
+    isa = build()
+    rom_dir = tmp_path / "new" / "rom"
+    assert len(write_mems(isa, rom_dir)) == len(mem_tables(isa))
+    assert read_mem(rom_dir / "cu_rom.mem") == isa.cu_rom
+
+
+def test_cross_check():
+    # Only the known opp clr disagreement, python -m isa --strict runs in CI
+    isa = build()
+    assert cross_check(isa) == []
+    problems = cross_check(isa, known=())
+    assert len(problems) == 1 and problems[0].startswith("50 (opp clr)")
+
+
+def edit_sheet(source, path, row, column, value):
+    with open(source, newline="") as f:
+        rows = list(csv.reader(f))
+    rows[row][rows[0].index(column)] = value
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def test_build_rejects_bad_sheets(tmp_path):
+    cu_flags = tmp_path / "cu_flags.csv"
+    alu_flags = tmp_path / "alu_flags.csv"
+
+    # A flag word that doesn't match its flags
+    edit_sheet(CU_FLAGS, cu_flags, 1, "FIRST", "7")
+    with pytest.raises(IsaError, match="00 half 1"):
+        build(cu_flags, ALU_FLAGS)
+
+    # The same word twice in UNIQUE VALUES
+    edit_sheet(CU_FLAGS, cu_flags, 2, "UNIQUE VALUES", "%X" % build().cu_flag_conv[0])
+    with pytest.raises(IsaError, match="more than once"):
+        build(cu_flags, ALU_FLAGS)
+
+    # An ALU word that doesn't match its bits
+    edit_sheet(ALU_FLAGS, alu_flags, 1, "FINAL", "3FF")
+    with pytest.raises(IsaError, match="00: ALU bits"):
+        build(CU_FLAGS, alu_flags)
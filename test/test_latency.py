@@ -0,0 +1,30 @@
+import os
+import json
+from pathlib import Path
+
+import cocotb
+
+import test_full
+from latency import benchmark_program, measure, MODES
+from emulator import Computer, Profile
+
+
+@cocotb.test()
+async def test_latency(dut):
+    program, placed = benchmark_program()
+    results = {}
+    for mode, address_24bit in MODES.items():
+        # Twice what the emulator takes, anything slower is a hang
+        computer = Computer(program, address_24bit)
+        computer.run()
+        profile = Profile(address_24bit)
+        await test_full.run(
+            dut, list(program), 2 * computer.cycles, address_24bit, profile=profile
+        )
+        assert test_full.HALTED, "The benchmark didn't get to its halt"
+        measure(profile, placed, mode, results)
+
+    # latency.py --engine icarus reads these back
+    path = os.environ.get("LATENCY_RESULTS", "")
+    if path:
+        Path(path).write_text(json.dumps(results, indent=2, sort_keys=True))